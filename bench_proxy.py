@@ -0,0 +1,753 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for proxy.py
+
+Usage:
+    python3 bench_proxy.py                        # every benchmark
+    python3 bench_proxy.py latency idle --json results.json
+    python3 bench_proxy.py latency --transport fake --fake-latency 0.05
+    python3 bench_proxy.py output-path --size-mb 200 --check-utf8
+    python3 bench_proxy.py scale --scale-sessions 1,10,100
+    python3 bench_proxy.py interrupt --interrupt-backlog 50
+    python3 bench_proxy.py screen --screen-mb 50
+    python3 bench_proxy.py record --size-mb 50
+
+Each benchmark runs proxy.py under a PTY, as it runs in a terminal, with a
+local child and --transport local (or fake). No network access or
+credentials are needed.
+
+    latency      stdin entry written by a controller -> bytes at the child
+                 (p50/p95/p99 ms)
+    throughput   child output flood -> proxy's terminal (MB/s)
+    restart      /clear and plan-toggle restarts (ms until the new child
+                 echoes input; --boot-delay simulates a slow-starting
+                 program, --standby runs the proxy with a warm pool)
+    interrupt    an urgent (:urgent) vs a plain :raw entry sent behind a
+                 backlog of pastes -> bytes at the child (ms); Ctrl+C and
+                 Escape sent :raw take the urgent path
+    idle         proxy CPU use and wakeups while nothing happens
+    output-path  proxy.drain_pty vs the old read/decode loop, in-process
+    screen       proxy_screen.Screen parser throughput on a line flood and
+                 on spinner/input-box redraws like Claude Code's (MB/s),
+                 with snapshot and per-frame diff sizes, in-process
+    record       proxy_record.Recorder cost per 4 KB read and seek time in
+                 the result, in-process; then throughput with and without
+                 --record
+    scale        memory and CPU per session at each --scale-sessions count,
+                 proxy_supervisor.py vs one proxy.py per session (children
+                 are `cat` and not counted)
+
+Results are printed and, with --json, written as one JSON document so runs
+can be compared across versions.
+"""
+
+import argparse
+import codecs
+import glob
+import io
+import json
+import os
+import platform
+import pty
+import re
+import select
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import tty
+
+import proxy
+from proxy_record import Recorder, Recording
+from proxy_screen import Screen
+from proxy_transport import LocalClient
+from test_claude_submit import read_output
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROXY_PATH = os.path.join(SCRIPT_DIR, 'proxy.py')
+SUPERVISOR_PATH = os.path.join(SCRIPT_DIR, 'proxy_supervisor.py')
+
+# Multibyte characters make chunk boundaries fall inside UTF-8 sequences
+FLOOD_LINE = 'héllo wörld ✓ ' * 4
+
+MARKER_RE = re.compile(rb'MARK\d{6}X')
+
+
+def echo_child(log_path, boot_delay=0.0):
+    """Child program: log when it starts and when markers arrive, echo input.
+
+    Timestamps are time.monotonic(), which is system-wide on Linux and so
+    comparable with the benchmark process. boot_delay seconds pass before
+    it starts reading, like a program loading at startup.
+    """
+    time.sleep(boot_delay)
+    log = open(log_path, 'a')
+    log.write(f"START {time.monotonic()}\n")
+    log.flush()
+    tail = b''
+    while True:
+        try:
+            data = os.read(0, 65536)
+        except OSError:
+            break
+        if not data:
+            break
+        now = time.monotonic()
+        window = tail + data
+        for marker in MARKER_RE.findall(window):
+            log.write(f"{marker.decode()} {now}\n")
+        log.flush()
+        tail = window[-12:]  # A marker may straddle two reads
+        os.write(1, data)
+
+
+def read_child_log(log_path):
+    """-> (list of START times, {marker: first arrival time})"""
+    starts, arrivals = [], {}
+    if not os.path.exists(log_path):
+        return starts, arrivals
+    with open(log_path) as f:
+        for line in f:
+            key, stamp = line.split()
+            if key == 'START':
+                starts.append(float(stamp))
+            else:
+                arrivals.setdefault(key, float(stamp))
+    return starts, arrivals
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def echo_command(log_path, boot_delay=0.0):
+    return f"{sys.executable} {os.path.abspath(__file__)} --echo-child {log_path} {boot_delay}"
+
+
+class ProxyRun:
+    """proxy.py running under a PTY with a local transport and a controller"""
+
+    def __init__(self, command, workdir, args):
+        self.socket_path = os.path.join(workdir, 'proxy.sock')
+        self.master_fd, slave_fd = pty.openpty()
+        tty.setraw(slave_fd)
+        self.proc = subprocess.Popen(
+            [sys.executable, PROXY_PATH, '-c', command, '-n', f'bench{os.getpid()}',
+             '--transport', args.transport, '--socket', self.socket_path, *args.proxy_args],
+            stdin=slave_fd,
+            stdout=slave_fd,
+            stderr=slave_fd,
+            close_fds=True,
+            start_new_session=True
+        )
+        os.close(slave_fd)
+        # The child starts before the backend, so keep what it printed meanwhile
+        self.startup = bytearray()
+        self.wait_for(lambda: os.path.exists(self.socket_path), 10, 'proxy start', self.startup)
+        self.client = LocalClient(self.socket_path)
+
+    def wait_for(self, predicate, timeout, what, keep=None):
+        """Drain the proxy's terminal until predicate() holds, appending
+        the output to `keep` if given"""
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline or self.proc.poll() is not None:
+                raise RuntimeError(f'timed out waiting for {what}')
+            # Not read_output(): its 0.1 s select would add up to 100 ms
+            # to whatever is measured after the wait
+            if select.select([self.master_fd], [], [], 0.005)[0]:
+                try:
+                    data = os.read(self.master_fd, 65536)
+                except OSError:
+                    continue
+                if keep is not None:
+                    keep += data
+
+    def stop(self):
+        """Ctrl+C the proxy and wait for it"""
+        if self.proc.poll() is None:
+            self.proc.send_signal(signal.SIGINT)
+        while self.proc.poll() is None:
+            read_output(self.master_fd, 0.1)
+        self.client.close()
+        os.close(self.master_fd)
+
+
+def bench_latency(args, workdir):
+    """Controller write -> bytes at the child, per stdin entry"""
+    log_path = os.path.join(workdir, 'latency.log')
+    run = ProxyRun(echo_command(log_path), workdir, args)
+    sent = {}
+    try:
+        run.wait_for(lambda: read_child_log(log_path)[0], 10, 'child start')
+        suffix = ':noenter:raw' if args.raw else ''
+        for i in range(args.entries):
+            marker = f'MARK{i:06d}X'
+            sent[marker] = time.monotonic()
+            run.client.send('set', f'stdin/{i}', f'{i}:{marker}{suffix}')
+            read_output(run.master_fd, args.interval)
+        run.wait_for(lambda: len(read_child_log(log_path)[1]) >= len(sent), 30, 'delivery')
+    finally:
+        run.stop()
+    _, arrivals = read_child_log(log_path)
+    latencies = sorted((arrivals[m] - t) * 1000 for m, t in sent.items())
+    return {
+        'entries': len(sent),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'max_ms': round(latencies[-1], 3),
+    }
+
+
+def bench_throughput(args, workdir):
+    """Child output flood through the proxy to its terminal"""
+    size = int(args.size_mb * 1024 * 1024)
+    run = ProxyRun(f"yes '{FLOOD_LINE}' | head -c {size}", workdir, args)
+    separator = ('-' * 40).encode()
+    seen = bytes(run.startup)
+    total = 0
+    start = end = None
+    if separator in seen:
+        start = time.perf_counter()
+        total = len(seen) - seen.index(separator) - len(separator)
+    try:
+        while True:
+            ready, _, _ = select.select([run.master_fd], [], [], 10)
+            if not ready:
+                break
+            try:
+                data = os.read(run.master_fd, 1024 * 1024)
+            except OSError:
+                break
+            if not data:
+                break
+            if start is None:
+                # Start the clock at the separator printed once the child runs
+                seen += data
+                if separator in seen:
+                    start = time.perf_counter()
+                    total = len(seen) - seen.index(separator) - len(separator)
+                continue
+            total += len(data)
+            if total >= size:
+                end = time.perf_counter()
+                break
+    finally:
+        run.stop()
+    if end is None:
+        raise RuntimeError(f'only {total} of {size} bytes arrived')
+    elapsed = end - start
+    return {
+        'bytes': size,
+        'seconds': round(elapsed, 3),
+        'mb_per_s': round(size / elapsed / (1024 * 1024), 1),
+    }
+
+
+def bench_restart(args, workdir):
+    """Time from the restart request until the new child echoes input"""
+    log_path = os.path.join(workdir, 'restart.log')
+    run = ProxyRun(echo_command(log_path, args.boot_delay), workdir, args)
+    timings = {'clear': [], 'plan': []}
+    # Between restarts, leave time for the pool to refill and boot
+    settle = 0.2 + (1.5 + args.boot_delay if args.standby else 0)
+    count = 0
+    try:
+        run.wait_for(lambda: read_child_log(log_path)[0], 10 + args.boot_delay, 'child start')
+        for i in range(args.restarts):
+            for kind in timings:
+                count += 1
+                marker = f'MARK{count:06d}X'
+                requested_at = int(time.time() * 1000)
+                requested = time.monotonic()
+                if kind == 'clear':
+                    run.client.send('set', f'stdin/{count}', f'{i}:/clear')
+                else:
+                    # Flip whatever plan mode the last restart left in meta
+                    plan = (run.client.request('get', 'meta')['value'] or {}).get('plan')
+                    run.client.send('set', 'meta/plan', not plan)
+                # The restart clears the session, so stdin written before
+                # the new meta appears could be wiped. Keys keep growing so
+                # the proxy never takes one for an already consumed entry.
+                run.wait_for(lambda: ((run.client.request('get', 'meta')['value'] or {})
+                                      .get('started_at', 0) >= requested_at), 30, f'{kind} restart')
+                count += 1
+                run.client.send('set', f'stdin/{count}', f'{i}:{marker}')
+                run.wait_for(lambda: marker in read_child_log(log_path)[1], 30 + args.boot_delay,
+                             f'{kind} marker')
+                timings[kind].append((read_child_log(log_path)[1][marker] - requested) * 1000)
+                read_output(run.master_fd, settle)
+    finally:
+        run.stop()
+    results = {}
+    for kind, values in timings.items():
+        values.sort()
+        results[f'{kind}_p50_ms'] = round(percentile(values, 50), 1)
+        results[f'{kind}_max_ms'] = round(values[-1], 1)
+    return results
+
+
+def bench_interrupt(args, workdir):
+    """Urgent vs plain entry sent behind a backlog of pastes -> bytes at the child"""
+    log_path = os.path.join(workdir, 'interrupt.log')
+    # Raw mode, so a key arrives without Enter and Ctrl+C is just a byte
+    run = ProxyRun(f"stty raw -echo; {echo_command(log_path)}", workdir, args)
+    timings = {'plain': [], 'urgent': []}
+    filler = 'x' * 2000
+    count = 0
+    try:
+        run.wait_for(lambda: read_child_log(log_path)[0], 10, 'child start')
+        for _ in range(args.interrupt_rounds):
+            for kind in timings:
+                for _ in range(args.interrupt_backlog):
+                    count += 1
+                    last = f'MARK{count:06d}X'
+                    run.client.send('set', f'stdin/{count}', f'{count}:{last} {filler}')
+                count += 1
+                marker = f'MARK{count:06d}X'
+                flags = ':noenter:raw:urgent' if kind == 'urgent' else ':noenter:raw'
+                sent = time.monotonic()
+                run.client.send('set', f'stdin/{count}', f'{count}:{marker}{flags}')
+                run.wait_for(lambda: marker in read_child_log(log_path)[1], 120, f'{kind} entry')
+                timings[kind].append((read_child_log(log_path)[1][marker] - sent) * 1000)
+                # Let the backlog drain before the next round
+                run.wait_for(lambda: last in read_child_log(log_path)[1], 120, 'backlog')
+    finally:
+        run.stop()
+    results = {'backlog': args.interrupt_backlog}
+    for kind, values in timings.items():
+        values.sort()
+        results[f'{kind}_p50_ms'] = round(percentile(values, 50), 1)
+        results[f'{kind}_max_ms'] = round(values[-1], 1)
+    return results
+
+
+def proc_cpu(pid):
+    """-> (cpu seconds, voluntary context switches) of pid, all threads"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    switches = 0
+    for tid in os.listdir(f'/proc/{pid}/task'):
+        try:
+            with open(f'/proc/{pid}/task/{tid}/status') as f:
+                for line in f:
+                    if line.startswith('voluntary_ctxt_switches'):
+                        switches += int(line.split()[1])
+        except FileNotFoundError:
+            pass  # Thread exited meanwhile
+    return cpu, switches
+
+
+def bench_idle(args, workdir):
+    """Proxy CPU use while the child and the controller are silent"""
+    run = ProxyRun('sleep 3600', workdir, args)
+    try:
+        read_output(run.master_fd, 1)  # Let startup settle
+        cpu0, switches0 = proc_cpu(run.proc.pid)
+        read_output(run.master_fd, args.idle_seconds)
+        cpu1, switches1 = proc_cpu(run.proc.pid)
+    finally:
+        run.stop()
+    return {
+        'seconds': args.idle_seconds,
+        'cpu_percent': round((cpu1 - cpu0) / args.idle_seconds * 100, 3),
+        'wakeups_per_s': round((switches1 - switches0) / args.idle_seconds, 2),
+    }
+
+
+def proc_rss_kb(pid):
+    """Resident set size of pid in KiB"""
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def measure_hosts(pids, clients, args):
+    """Memory, then CPU while idle and while every session takes stdin.
+    clients is [(LocalClient, session path prefix)]."""
+    time.sleep(1)  # Let startup settle
+    rss_kb = sum(proc_rss_kb(pid) for pid in pids)
+    threads = sum(len(os.listdir(f'/proc/{pid}/task')) for pid in pids)
+    cpu0 = sum(proc_cpu(pid)[0] for pid in pids)
+    time.sleep(args.scale_seconds)
+    cpu1 = sum(proc_cpu(pid)[0] for pid in pids)
+    for i in range(args.scale_entries):
+        for client, prefix in clients:
+            client.send('set', f'{prefix}stdin/{i}', f'{i}:line {i}')
+    time.sleep(args.scale_seconds)
+    cpu2 = sum(proc_cpu(pid)[0] for pid in pids)
+    return {
+        'processes': len(pids),
+        'threads': threads,
+        'rss_mb': round(rss_kb / 1024, 1),
+        'idle_cpu_percent': round((cpu1 - cpu0) / args.scale_seconds * 100, 2),
+        'load_cpu_ms': round((cpu2 - cpu1) * 1000),
+    }
+
+
+def stop_hosts(procs):
+    for proc in procs:
+        if proc.poll() is None:
+            proc.send_signal(signal.SIGINT)
+    for proc in procs:
+        proc.wait()
+
+
+def wait_for_sockets(paths, procs, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not all(os.path.exists(path) for path in paths):
+        if time.monotonic() > deadline or any(proc.poll() is not None for proc in procs):
+            raise RuntimeError('timed out waiting for sockets')
+        time.sleep(0.05)
+
+
+def scale_supervisor(count, args, workdir):
+    manifest = os.path.join(workdir, f'sessions{count}.json')
+    with open(manifest, 'w') as f:
+        json.dump({'sessions': [{'name': f's{i}', 'command': 'cat'} for i in range(count)]}, f)
+    socket_path = os.path.join(workdir, f'supervisor{count}.sock')
+    proc = subprocess.Popen([sys.executable, SUPERVISOR_PATH, '-m', manifest, '--transport', 'local',
+                             '--socket', socket_path],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT,
+                            start_new_session=True)
+    try:
+        wait_for_sockets([socket_path], [proc])
+        client = LocalClient(socket_path)
+        # Sessions are started once the meta of the last one is there
+        deadline = time.monotonic() + 60
+        while not client.request('get', f's{count - 1}/meta')['value']:
+            if time.monotonic() > deadline:
+                raise RuntimeError('timed out waiting for sessions')
+            time.sleep(0.05)
+        result = measure_hosts([proc.pid], [(client, f's{i}/') for i in range(count)], args)
+        client.close()
+    finally:
+        stop_hosts([proc])
+    return result
+
+
+def scale_proxies(count, args, workdir):
+    socket_paths = [os.path.join(workdir, f'proxy{count}_{i}.sock') for i in range(count)]
+    procs = []
+    try:
+        for i, socket_path in enumerate(socket_paths):
+            procs.append(subprocess.Popen(
+                [sys.executable, PROXY_PATH, '-c', 'cat', '-n', f'bench{os.getpid()}_{i}',
+                 '--transport', 'local', '--socket', socket_path],
+                stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT, start_new_session=True))
+        wait_for_sockets(socket_paths, procs)
+        clients = [LocalClient(socket_path) for socket_path in socket_paths]
+        for client in clients:
+            while not client.request('get', 'meta')['value']:
+                time.sleep(0.05)
+        result = measure_hosts([proc.pid for proc in procs], [(client, '') for client in clients], args)
+        for client in clients:
+            client.close()
+    finally:
+        stop_hosts(procs)
+    return result
+
+
+def bench_scale(args, workdir):
+    """Memory and CPU of N sessions in one supervisor vs N proxies"""
+    results = {}
+    for count in [int(n) for n in args.scale_sessions.split(',')]:
+        result = {}
+        for host, run in (('supervisor', scale_supervisor), ('proxies', scale_proxies)):
+            measured = run(count, args, workdir)
+            measured['rss_mb_per_session'] = round(measured['rss_mb'] / count, 2)
+            measured['load_cpu_ms_per_session'] = round(measured['load_cpu_ms'] / count, 1)
+            result[host] = measured
+            print(f"[bench] scale {count} {host}: {json.dumps(measured)}", flush=True)
+        results[str(count)] = result
+    return results
+
+
+def spawn_flood(size_bytes):
+    """Start a child writing size_bytes of text to a raw PTY"""
+    master_fd, slave_fd = pty.openpty()
+    tty.setraw(slave_fd)
+    proc = subprocess.Popen(
+        f"yes '{FLOOD_LINE}' | head -c {size_bytes}",
+        shell=True,
+        stdin=slave_fd,
+        stdout=slave_fd,
+        stderr=slave_fd,
+        close_fds=True,
+        start_new_session=True
+    )
+    os.close(slave_fd)
+    return proc, master_fd
+
+
+def run_drain(master_fd, check_utf8):
+    """New path: proxy.drain_pty into a binary sink"""
+    sink = open(os.devnull, 'wb')
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    replaced = 0
+
+    def on_output(chunk):
+        nonlocal replaced
+        sink.write(chunk)
+        if check_utf8:
+            replaced += decoder.decode(chunk).count('�')
+
+    os.set_blocking(master_fd, False)
+    total = 0
+    while True:
+        select.select([master_fd], [], [])
+        nread = proxy.drain_pty(master_fd, on_output)
+        if nread < 0:
+            break
+        total += nread
+        sink.flush()
+    sink.close()
+    return total, replaced
+
+
+def run_legacy(master_fd, check_utf8):
+    """Old path: one 4 KB read per wakeup, decode each chunk, text write"""
+    sink = io.TextIOWrapper(open(os.devnull, 'wb'), encoding='utf-8')
+    total = 0
+    replaced = 0
+    while True:
+        ready, _, _ = select.select([master_fd], [], [], 0.1)
+        if ready:
+            try:
+                data = os.read(master_fd, 4096)
+            except OSError:
+                break
+            if not data:
+                break
+            total += len(data)
+            text = data.decode('utf-8', errors='replace')
+            if check_utf8:
+                replaced += text.count('�')
+            sink.write(text)
+            sink.flush()
+    sink.close()
+    return total, replaced
+
+
+def bench_output_path(args, workdir):
+    """Flood a PTY and copy it out with the old and the new output loop"""
+    results = {}
+    for mode, loop in (('legacy', run_legacy), ('drain', run_drain)):
+        proc, master_fd = spawn_flood(int(args.size_mb * 1024 * 1024))
+        start = time.perf_counter()
+        total, replaced = loop(master_fd, args.check_utf8)
+        elapsed = time.perf_counter() - start
+        proc.wait()
+        os.close(master_fd)
+        results[mode] = {
+            'bytes': total,
+            'seconds': round(elapsed, 3),
+            'mb_per_s': round(total / elapsed / (1024 * 1024), 1),
+        }
+        if args.check_utf8:
+            results[mode]['replacement_chars'] = replaced
+    return results
+
+
+def redraw_frame(i):
+    """One spinner/input box redraw in the style of Claude Code's footer"""
+    return ''.join([
+        '\x1b[?25l', '\x1b[2K\x1b[1A' * 5, '\x1b[2K\x1b[G',
+        f'\x1b[38;5;174m✻\x1b[39m \x1b[38;5;174mThinking…\x1b[39m '
+        f'\x1b[2m({i % 600}s · \x1b[1mesc\x1b[22m\x1b[2m to interrupt)\x1b[22m\r\n',
+        '\x1b[2m╭' + '─' * 78 + '╮\x1b[22m\r\n',
+        f'\x1b[2m│\x1b[22m > {FLOOD_LINE[:40]}{i:06d}' + ' ' * 29 + '\x1b[2m│\x1b[22m\r\n',
+        '\x1b[2m╰' + '─' * 78 + '╯\x1b[22m\r\n',
+        '  \x1b[2m? for shortcuts\x1b[22m\r\n',
+        '\x1b[?25h',
+    ]).encode()
+
+
+def bench_screen(args, workdir):
+    """Screen model parser throughput, in 4 KB reads like the PTY gives"""
+    size = int(args.screen_mb * 1024 * 1024)
+    flood = (FLOOD_LINE + '\r\n').encode()
+    streams = {
+        'flood': flood * (size // len(flood)),
+        'redraw': b''.join(redraw_frame(i) for i in range(size // len(redraw_frame(0)))),
+    }
+    results = {}
+    for name, data in streams.items():
+        screen = Screen(proxy.PTY_ROWS, proxy.PTY_COLS)
+        start = time.perf_counter()
+        for offset in range(0, len(data), 4096):
+            screen.feed(data[offset:offset + 4096])
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            'bytes': len(data),
+            'seconds': round(elapsed, 3),
+            'mb_per_s': round(len(data) / elapsed / (1024 * 1024), 1),
+            'snapshot_bytes': len(json.dumps(screen.snapshot())),
+        }
+    # What one redraw costs to publish as a row diff, after the first
+    screen = Screen(proxy.PTY_ROWS, proxy.PTY_COLS)
+    screen.feed(redraw_frame(0))
+    screen.diff()
+    screen.feed(redraw_frame(1))
+    results['redraw']['frame_bytes'] = len(redraw_frame(1))
+    results['redraw']['diff_bytes'] = len(json.dumps(screen.diff()))
+    return results
+
+
+def bench_record(args, workdir):
+    """Recording overhead on the output path, and seeking in the result"""
+    size = int(args.size_mb * 1024 * 1024)
+    line = (FLOOD_LINE + '\r\n').encode()
+    data = memoryview(line * (4096 // len(line) * 64))  # 64 reads of about 4 KB
+    chunks = [data[offset:offset + 4096] for offset in range(0, len(data), 4096)]
+    path = os.path.join(workdir, 'bench.rec')
+    recorder = Recorder(path, proxy.PTY_ROWS, proxy.PTY_COLS)
+    reads = 0
+    start = time.perf_counter()
+    while reads * 4096 < size:
+        for chunk in chunks:
+            recorder.output(chunk)
+        recorder.poll(time.time())
+        reads += len(chunks)
+    elapsed = time.perf_counter() - start
+    recorder.close()
+
+    recording = Recording(path)
+    duration = recording.duration()
+    seeks = 1000
+    seek_start = time.perf_counter()
+    for i in range(seeks):
+        recording.seek(duration * i / seeks)
+    seek_elapsed = time.perf_counter() - seek_start
+    results = {
+        'in_process': {
+            'reads': reads,
+            'us_per_read': round(elapsed / reads * 1000000, 2),
+            'mb_per_s': round(recorder.offset / elapsed / (1024 * 1024), 1),
+            'index_entries': recording.entries,
+            'seek_us': round(seek_elapsed / seeks * 1000000, 1),
+        },
+    }
+    recording.close()
+
+    for label, extra in (('throughput', []), ('throughput_recording', ['--record'])):
+        run_args = argparse.Namespace(**vars(args))
+        run_args.proxy_args = args.proxy_args + extra
+        results[label] = bench_throughput(run_args, workdir)
+    for leftover in glob.glob(os.path.join(SCRIPT_DIR, '.claude', f'proxy_record_bench{os.getpid()}_*')):
+        os.remove(leftover)
+    return results
+
+
+BENCHMARKS = {
+    'latency': bench_latency,
+    'throughput': bench_throughput,
+    'restart': bench_restart,
+    'interrupt': bench_interrupt,
+    'idle': bench_idle,
+    'output-path': bench_output_path,
+    'screen': bench_screen,
+    'record': bench_record,
+    'scale': bench_scale,
+}
+
+
+def git_revision():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def main():
+    if len(sys.argv) in (3, 4) and sys.argv[1] == '--echo-child':
+        echo_child(sys.argv[2], float(sys.argv[3]) if len(sys.argv) == 4 else 0.0)
+        return
+
+    parser = argparse.ArgumentParser(description='Benchmark proxy.py without network access')
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help=f'Benchmarks to run: {", ".join(BENCHMARKS)} (default: all)')
+    parser.add_argument('--json', help='Write results to this JSON file')
+    parser.add_argument('--transport', choices=['local', 'fake'], default='local',
+                        help='Proxy transport (default: local)')
+    parser.add_argument('--fake-latency', type=float, default=0.0,
+                        help='Simulated backend delay for --transport fake, seconds (default: 0)')
+    parser.add_argument('--fake-jitter', type=float, default=0.0,
+                        help='Simulated backend jitter for --transport fake, seconds (default: 0)')
+    parser.add_argument('--entries', type=int, default=100,
+                        help='latency: stdin entries to send (default: 100)')
+    parser.add_argument('--interval', type=float, default=0.2,
+                        help='latency: seconds between entries (default: 0.2)')
+    parser.add_argument('--raw', action='store_true',
+                        help='latency: send entries as :noenter:raw')
+    parser.add_argument('--size-mb', type=float, default=100,
+                        help='throughput/output-path/record: output volume in MB (default: 100)')
+    parser.add_argument('--check-utf8', action='store_true',
+                        help='output-path: count U+FFFD produced by decoding')
+    parser.add_argument('--screen-mb', type=float, default=20,
+                        help='screen: volume of each stream in MB (default: 20)')
+    parser.add_argument('--restarts', type=int, default=3,
+                        help='restart: restarts of each kind (default: 3)')
+    parser.add_argument('--boot-delay', type=float, default=0.0,
+                        help='restart: seconds the child takes to start (default: 0)')
+    parser.add_argument('--standby', type=int, default=0,
+                        help='restart: run the proxy with this many standby children (default: 0)')
+    parser.add_argument('--interrupt-backlog', type=int, default=20,
+                        help='interrupt: pastes queued ahead of each measured entry (default: 20)')
+    parser.add_argument('--interrupt-rounds', type=int, default=3,
+                        help='interrupt: measurements of each kind (default: 3)')
+    parser.add_argument('--idle-seconds', type=float, default=10,
+                        help='idle: measurement window (default: 10)')
+    parser.add_argument('--scale-sessions', default='1,10,100',
+                        help='scale: comma-separated session counts (default: 1,10,100)')
+    parser.add_argument('--scale-seconds', type=float, default=5,
+                        help='scale: idle and load measurement windows (default: 5)')
+    parser.add_argument('--scale-entries', type=int, default=5,
+                        help='scale: stdin entries sent to each session under load (default: 5)')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    args.proxy_args = []
+    if args.transport == 'fake':
+        args.proxy_args += ['--fake-latency', str(args.fake_latency),
+                            '--fake-jitter', str(args.fake_jitter), '--fake-seed', '1']
+    if args.standby:
+        args.proxy_args += ['--standby', str(args.standby)]
+    # proxy.py keeps its sockets and optional debug log in .claude/
+    os.makedirs(os.path.join(SCRIPT_DIR, '.claude'), exist_ok=True)
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'transport': args.transport,
+        'results': {},
+    }
+    for name in args.benchmarks or list(BENCHMARKS):
+        print(f"[bench] {name}...", flush=True)
+        with tempfile.TemporaryDirectory(prefix='bench_proxy_') as workdir:
+            result = BENCHMARKS[name](args, workdir)
+        report['results'][name] = result
+        print(f"[bench] {name}: {json.dumps(result)}", flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"[bench] Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
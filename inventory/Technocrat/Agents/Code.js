@@ -6,7 +6,8 @@ class ClaudeShellPane {
         // State
         this.messages = new Map();
         this.stdinIndex = 0;
-        this.shellRef = null;
+        this.rootRef = null;   // /shell/{name}
+        this.shellRef = null;  // Active session: rootRef, or rootRef/gen/{n}
         this.stdinRef = null;
         this.metaRef = null;
         this.autoScroll = true;
@@ -554,8 +555,34 @@ class ClaudeShellPane {
         this.currentSession = sessionName;
         localStorage.setItem('claude-shell-session', sessionName);
 
-        // Get Firebase references using global net.db
-        this.shellRef = net.db.ref(`/shell/${sessionName}`);
+        // Sessions run with `proxy.py --generations` live under gen/{n},
+        // named by the small /current pointer; others live at the root
+        this.rootRef = net.db.ref(`/shell/${sessionName}`);
+        this.rootRef.child('current').on('value', (snapshot) => {
+            const pointer = snapshot.val();
+            const ref = (pointer && typeof pointer.gen === 'number')
+                ? this.rootRef.child(`gen/${pointer.gen}`) : this.rootRef;
+            if (!this.shellRef || ref.toString() !== this.shellRef.toString()) {
+                this.attachSession(ref);
+            }
+        });
+
+        this.isConnected = true;
+        this.connectBtn.textContent = 'Disconnect';
+        this.connectBtn.classList.add('connected');
+        this.sessionInput.disabled = true;
+
+        log("ClaudeShell", `Connected to session: ${sessionName}`);
+    }
+
+    attachSession(ref) {
+        const switching = this.shellRef !== null;
+        this.detachSession();
+        if (switching) {
+            this.renderMessages();  // The new generation starts empty
+        }
+
+        this.shellRef = ref;
         this.stdinRef = this.shellRef.child('stdin');
         this.metaRef = this.shellRef.child('meta');
 
@@ -564,9 +591,7 @@ class ClaudeShellPane {
             const data = snapshot.val();
             if (data && typeof data === 'object') {
                 const keys = Object.keys(data).map(k => parseInt(k));
-                this.stdinIndex = Math.max(...keys, -1) + 1;
-            } else {
-                this.stdinIndex = 0;
+                this.stdinIndex = Math.max(this.stdinIndex, Math.max(...keys, -1) + 1);
             }
         });
 
@@ -574,6 +599,10 @@ class ClaudeShellPane {
         this.metaRef.on('value', (snapshot) => {
             const meta = snapshot.val();
             if (meta) {
+                // Consumed stdin entries are pruned; never reuse their keys
+                if (typeof meta.stdin_cursor === 'number') {
+                    this.stdinIndex = Math.max(this.stdinIndex, meta.stdin_cursor + 1);
+                }
                 this.updateStatus(meta.status || 'unknown');
                 const isRunning = meta.status === 'running';
                 this.inputEl.disabled = !isRunning;
@@ -607,16 +636,9 @@ class ClaudeShellPane {
                 this.renderMessages();
             }
         });
-
-        this.isConnected = true;
-        this.connectBtn.textContent = 'Disconnect';
-        this.connectBtn.classList.add('connected');
-        this.sessionInput.disabled = true;
-
-        log("ClaudeShell", `Connected to session: ${sessionName}`);
     }
 
-    disconnect() {
+    detachSession() {
         if (this.shellRef) {
             this.shellRef.off();
             this.shellRef = null;
@@ -628,6 +650,14 @@ class ClaudeShellPane {
         this.stdinRef = null;
         this.messages.clear();
         this.stdinIndex = 0;
+    }
+
+    disconnect() {
+        if (this.rootRef) {
+            this.rootRef.child('current').off();
+            this.rootRef = null;
+        }
+        this.detachSession();
         this.isConnected = false;
 
         this.updateStatus('disconnected');
@@ -29,7 +29,8 @@ let inputRefRow = null;
 let inputRefLabel = null;
 
 // Firebase refs for cleanup
-let shellRef = null;
+let rootRef = null;   // /shell/{name}
+let shellRef = null;  // Active session: rootRef, or rootRef/gen/{n}
 let stdinRef = null;
 let metaRef = null;
 let inputRefRef = null;
@@ -554,8 +555,34 @@ let connect = (sessionName) => {
     sessionInput.text = sessionName;
     sessionInput.style.color = "#e8e8e8";
 
-    // Get Firebase references
-    shellRef = net.db.ref(`/shell/${sessionName}`);
+    // Sessions run with `proxy.py --generations` live under gen/{n},
+    // named by the small /current pointer; others live at the root
+    rootRef = net.db.ref(`/shell/${sessionName}`);
+    rootRef.child('current').on('value', (snapshot) => {
+        const pointer = snapshot.val();
+        const ref = (pointer && typeof pointer.gen === 'number')
+            ? rootRef.child(`gen/${pointer.gen}`) : rootRef;
+        if(!shellRef || ref.toString() !== shellRef.toString()){
+            attachSession(ref);
+        }
+    });
+
+    isConnected = true;
+    updateConnectButton();
+    console.log("CodeUI: Connected to session:", sessionName);
+}
+
+let attachSession = (ref) => {
+    const switching = shellRef !== null;
+    detachSession();
+    if(switching){
+        // The new generation starts empty
+        clearTranscript();
+        renderEmptyState();
+        messageCountLabel.text = "";
+    }
+
+    shellRef = ref;
     stdinRef = shellRef.child('stdin');
     metaRef = shellRef.child('meta');
 
@@ -564,9 +591,7 @@ let connect = (sessionName) => {
         const data = snapshot.val();
         if(data && typeof data === 'object'){
             const keys = Object.keys(data).map(k => parseInt(k));
-            stdinIndex = Math.max(...keys, -1) + 1;
-        } else {
-            stdinIndex = 0;
+            stdinIndex = Math.max(stdinIndex, Math.max(...keys, -1) + 1);
         }
     });
 
@@ -574,6 +599,10 @@ let connect = (sessionName) => {
     metaRef.on('value', (snapshot) => {
         const meta = snapshot.val();
         if(meta){
+            // Consumed stdin entries are pruned; never reuse their keys
+            if(typeof meta.stdin_cursor === 'number'){
+                stdinIndex = Math.max(stdinIndex, meta.stdin_cursor + 1);
+            }
             updateStatus(meta.status || 'unknown');
         } else {
             updateStatus('not_found');
@@ -604,15 +633,9 @@ let connect = (sessionName) => {
             checkForClearCommand(data);
         }
     });
-
-    isConnected = true;
-    updateConnectButton();
-    console.log("CodeUI: Connected to session:", sessionName);
 }
 
-let disconnect = () => {
-    console.log("CodeUI: Disconnecting...");
-
+let detachSession = () => {
     if(shellRef){
         shellRef.off();
         shellRef = null;
@@ -624,6 +647,16 @@ let disconnect = () => {
     stdinRef = null;
     messages.clear();
     stdinIndex = 0;
+}
+
+let disconnect = () => {
+    console.log("CodeUI: Disconnecting...");
+
+    if(rootRef){
+        rootRef.child('current').off();
+        rootRef = null;
+    }
+    detachSession();
     isConnected = false;
 
     updateStatus('disconnected');
@@ -63,7 +63,8 @@ class PepperInject {
         this.thinkingRef = null;
         this.revisionRef = null;
         this.historyRef = null;
-        this.shellRef = null;
+        this.shellRootRef = null;  // /shell/{name}
+        this.shellRef = null;      // Active session: shellRootRef, or shellRootRef/gen/{n}
         this.stdinRef = null;
         this.metaRef = null;
         this.inputRefRef = null;
@@ -112,7 +112,32 @@
                 sessionLabel.style.color = "#e8e8e8";
             }
 
-            this.shellRef = net.db.ref(`/shell/${sessionName}`);
+            // Sessions run with `proxy.py --generations` live under gen/{n},
+            // named by the small /current pointer; others live at the root
+            this.shellRootRef = net.db.ref(`/shell/${sessionName}`);
+            this.shellRootRef.child('current').on('value', (snapshot) => {
+                const pointer = snapshot.val();
+                const ref = (pointer && typeof pointer.gen === 'number')
+                    ? this.shellRootRef.child(`gen/${pointer.gen}`) : this.shellRootRef;
+                if (!this.shellRef || ref.toString() !== this.shellRef.toString()) {
+                    this.attachShellSession(ref);
+                }
+            });
+
+            this.isConnected = true;
+            this.updateConnectButton();
+        },
+
+        attachShellSession(ref) {
+            const switching = this.shellRef !== null;
+            this.detachShellSession();
+            if (switching) {
+                // The new generation starts empty
+                this.clearMessagesUI();
+                this.showEmptyState();
+            }
+
+            this.shellRef = ref;
             this.stdinRef = this.shellRef.child('stdin');
             this.metaRef = this.shellRef.child('meta');
 
@@ -121,9 +146,7 @@
                 const data = snapshot.val();
                 if (data && typeof data === 'object') {
                     const keys = Object.keys(data).map(k => parseInt(k));
-                    this.stdinIndex = Math.max(...keys, -1) + 1;
-                } else {
-                    this.stdinIndex = 0;
+                    this.stdinIndex = Math.max(this.stdinIndex, Math.max(...keys, -1) + 1);
                 }
             });
 
@@ -131,6 +154,10 @@
             this.metaRef.on('value', (snapshot) => {
                 const meta = snapshot.val();
                 if (meta) {
+                    // Consumed stdin entries are pruned; never reuse their keys
+                    if (typeof meta.stdin_cursor === 'number') {
+                        this.stdinIndex = Math.max(this.stdinIndex, meta.stdin_cursor + 1);
+                    }
                     this.updateShellStatus(meta.status || 'unknown');
                 } else {
                     this.updateShellStatus('not_found');
@@ -167,15 +194,11 @@
                     this.checkForClearCommand(data);
                 }
             });
-
-            this.isConnected = true;
-            this.updateConnectButton();
         },
 
-        disconnectShell() {
-            console.log("PepperInject: Disconnecting shell...");
-
+        detachShellSession() {
             if (this.shellRef) {
+                this.shellRef.child('meta/plan').off();
                 this.shellRef.off();
                 this.shellRef = null;
             }
@@ -186,6 +209,16 @@
             this.stdinRef = null;
             this.messages.clear();
             this.stdinIndex = 0;
+        },
+
+        disconnectShell() {
+            console.log("PepperInject: Disconnecting shell...");
+
+            if (this.shellRootRef) {
+                this.shellRootRef.child('current').off();
+                this.shellRootRef = null;
+            }
+            this.detachShellSession();
             this.isConnected = false;
 
             this.updateShellStatus('disconnected');
@@ -5,31 +5,85 @@ Proxy Shell - Run commands with PTY and sync stdin from Firebase
 Usage:
     python3 proxy.py -c 'command' -n program_name
     python3 proxy.py --command 'claude' --name my_session
+    python3 proxy.py -c 'claude' -n my_session --transport local
 
 The command runs in a PTY. Stdin is read from Firebase at:
     /shell/{program_name}/stdin/
 
+With --transport local the session lives in memory instead and local
+controllers talk to it over a Unix socket (see proxy_transport.py).
+--transport fake runs the Firebase code path against an in-process
+database with injectable latency (see proxy_fakedb.py), served on the
+same kind of socket. --transport shared uses a stand-in served by
+`python3 proxy_fakedb.py`, which several proxies can share.
+
+With --lease-ttl a proxy only runs a session while it holds the lease at
+meta/lease, so two proxies never drive the same name. A second proxy
+started with --lease-wait stands by and takes the session over once the
+owner stops renewing its lease.
+
+The child is started first. Connecting the backend (importing and
+initializing firebase_admin, clearing the session, attaching listeners)
+happens on a background thread meanwhile; stdin written before the
+listeners attach is picked up by their first fetch. --timings prints
+where startup time went.
+
+With --state, whether the child is idle, busy, or waiting on a
+permission prompt or a choice is read from its output as it streams and
+published to meta/state (see StateDetector); --state-patterns sets the
+markers per command. Scanning costs output throughput, so it is off
+unless asked for.
+
+With --publish-output the raw terminal output is also published, in
+numbered records at output/{seq} (see OutputPublisher), for remote
+viewers that want to see the terminal itself. --screen instead keeps a
+model of the screen (proxy_screen.py) and publishes the rows that changed
+plus periodic full snapshots under screen/ (see ScreenPublisher), so a
+viewer that joins late starts from the latest snapshot.
+
+--record writes everything read from and written to the PTY, with
+timestamps, to an indexed file that proxy_record.py can seek in, replay
+and export to asciicast.
+
 Transcript output is handled separately by the status_line.py hook,
-which writes to /shell/{program_name}/{timestamp}/
+which writes to /shell/{program_name}/{timestamp}/. With --transcript
+the proxy follows Claude Code's JSONL transcript itself instead (see
+TranscriptTailer), sending only the lines appended since the last read.
+Those messages are stored in fixed-size pages under transcript/pages/
+with a small transcript/index, so viewers load the last page first.
+
+Children get the session name in CLAUDE_PROXY_SHELL. A --standby child
+has it too, but hooks should hold off until it is swapped in: they take
+the session from hook_session(), which is None while the child's
+CLAUDE_PROXY_STANDBY marker file exists.
 """
 
 import argparse
+import codecs
+import collections
+import ctypes
+import ctypes.util
+import datetime
+import json
 import subprocess
 import time
 import signal
 import sys
 import os
 import pty
-import select
+import selectors
 import errno
 import queue
+import re
+import threading
 import termios
 import struct
 import fcntl
 import tty
 
-import firebase_admin
-from firebase_admin import credentials, db
+from proxy_record import Recorder
+from proxy_screen import Screen
+from proxy_transport import FirebaseTransport, LocalTransport, default_socket_path
 
 # Get the directory where this script is located
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -37,51 +91,1018 @@ SERVICE_ACCOUNT_PATH = os.path.join(SCRIPT_DIR+"/.claude", 'firebase-service-acc
 DATABASE_URL = 'https://welp-c0e8d-default-rtdb.firebaseio.com'
 
 # Global state for signal handler
-proc = None
-ref = None
-master_fd = None
-stdin_queue = queue.Queue()
-last_stdin_id = -1
-stdin_log = None  # Debug log file handle
-plan_change_queue = queue.Queue()  # Queue for plan mode changes
-original_command = None  # Store the original command with all flags
-plan_listener_initialized = False  # Skip initial listener event
+session = None  # ProxySession run by main()
+wakeup_r = None  # Self-pipe read end, registered with the main loop selector
+wakeup_w = None  # Self-pipe write end, written by listener threads
+backend_error = None  # Exit code when backend setup failed
+timings = None  # StartupTimings, None unless --timings is given
+
+# Added to a command to start Claude Code in plan mode
+PLAN_FLAG = " --permission-mode plan"
+
+# Seconds between meta heartbeat updates
+META_UPDATE_INTERVAL = 5
+
+# Consumed stdin entries are deleted (and the cursor saved) once this many
+# have piled up, and otherwise with every heartbeat
+STDIN_ACK_BATCH = 32
+
+# Stdin pacing defaults (seconds). The settle delays are upper bounds: a wait
+# ends early once the child has produced output and then gone quiet.
+PASTE_SETTLE_MAX = 0.1   # After a paste/raw write, before Enter
+SUBMIT_SETTLE_MAX = 0.5  # After Enter (or :noenter), before the next entry
+OUTPUT_QUIET = 0.05      # Output silence that counts as "child has settled"
+
+# Stdin batching (see StdinBatcher)
+STDIN_BATCH_WINDOW = 0.0       # Seconds an unfinished run of :noenter entries waits for more
+STDIN_BATCH_MAX = 16 * 1024    # Bytes merged into one write; 0 sends every entry on its own
+
+# :raw entries made only of these keys (Ctrl+C, Escape) are urgent without
+# the :urgent flag: they go to the PTY ahead of queued input
+INTERRUPT_KEYS = '\x03\x1b'
+
+# Stdin macros (see parse_macro)
+MACRO_PREFIX = 'macro:'
+MACRO_TIMEOUT = 5.0           # Default limit of a wait or quiet step, seconds
+MACRO_WINDOW = 16 * 1024      # Output kept for a wait step to match
+
+# In-place plan switching (--plan-switch keys). Shift+Tab cycles Claude
+# Code's permission mode: default -> accept edits -> plan -> default. The
+# footer names the current mode; markers are matched against output with
+# escape sequences and whitespace removed.
+MODE_CYCLE_KEY = b'\x1b[Z'
+PLAN_MODE_MARKER = b'planmodeon'
+ACCEPT_EDITS_MARKER = b'accepteditson'
+PLAN_SWITCH_PRESSES = 3          # One full cycle
+PLAN_SWITCH_TIMEOUT = 1.0        # Seconds to wait for a redraw after each press
+PLAN_SWITCH_WINDOW = 16 * 1024   # Output kept for matching
+ANSI_ESCAPE = re.compile(rb'\x1b(?:\[[0-?]*[ -/]*[@-~]|\][^\x07\x1b]*(?:\x07|\x1b\\)|[ -/]*[0-~])')
+
+# Idle/busy detection (see StateDetector). Markers are matched like the
+# plan mode markers; when one read shows several, the state listed first
+# wins. --state-patterns replaces them per command.
+STATE_PATTERNS = {
+    'awaiting-permission': ['Do you want to'],
+    'awaiting-choice': ['Enter to select'],
+    'busy': ['esc to interrupt'],
+    'idle': ['? for shortcuts'],
+}
+STATE_DEBOUNCE = 0.25   # Seconds a new state must hold before it is published
+STATE_BUSY_HOLD = 2.0   # Busy turns idle after this long without a busy marker
+STATE_ESCAPE_MAX = 64   # Longest cut-off escape sequence held for the next read
+INCOMPLETE_ESCAPE = re.compile(rb'\x1b(?:\[[0-?]*[ -/]*|\][^\x07\x1b]*|[ -/]*)\Z')
+WHITESPACE = b' \t\n\r\x0b\x0c'
+
+# Session leases (--lease-ttl). The record lives at the session root's
+# meta, whatever the generation, and is renewed with every heartbeat;
+# contenders poll for it this often while waiting.
+LEASE_PATH = 'meta/lease'
+LEASE_POLL_INTERVAL = 1.0
+
+# Teardown: a retired child's process group gets SIGTERM, then SIGKILL once
+# the grace period is over. The group is polled while it winds down, since
+# grandchildren don't raise SIGCHLD here.
+TEARDOWN_GRACE = 5
+TEARDOWN_POLL_INTERVAL = 0.05
+
+# Warm standby (--standby): replacements are spawned this long after a swap
+# or startup, so they don't compete with the child that just went live.
+# Output a standby child produces while idle is kept (up to the cap) and
+# shown when it is swapped in.
+STANDBY_REFILL_DELAY = 1.0
+STANDBY_OUTPUT_MAX = 256 * 1024
+
+# Background writer: queue bound, retry attempts and backoff (seconds)
+WRITER_QUEUE_SIZE = 1000
+WRITER_RETRIES = 5
+WRITER_BACKOFF = 0.5
+WRITER_BACKOFF_MAX = 8
+WRITER_FLUSH_TIMEOUT = 5
+
+# Debug log defaults (see DebugLog)
+DEBUG_LOG_LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+DEBUG_LOG_QUEUE_SIZE = 10000
+DEBUG_LOG_INTERVAL = 0.2   # Seconds between batched writes
+DEBUG_LOG_MAX_MB = 10      # Rotate once the file grows past this
+DEBUG_LOG_BACKUPS = 3      # Rotated files kept (path.1 ... path.N)
+
+# Size of the child's terminal (TIOCSWINSZ)
+PTY_ROWS = 24
+PTY_COLS = 80
+
+# PTY output is drained into one reused buffer. A single wakeup reads at
+# most OUTPUT_DRAIN_LIMIT bytes so a flood of output can't starve stdin.
+OUTPUT_BUFFER_SIZE = 64 * 1024
+OUTPUT_DRAIN_LIMIT = 1024 * 1024
+# After the child exits, its last writes can take a moment to reach the
+# master side; wait this long for them before giving up on EIO
+OUTPUT_EXIT_WAIT = 0.2
+output_buffer = bytearray(OUTPUT_BUFFER_SIZE)
+output_view = memoryview(output_buffer)
+
+# Output publishing (--publish-output, see OutputPublisher)
+OUTPUT_PUBLISH_INTERVAL = 0.05     # Seconds from a record's first byte until it is sent
+OUTPUT_PUBLISH_CHUNK = 16 * 1024   # Most bytes per record; a full record goes at once
+OUTPUT_PUBLISH_RING = 1024 * 1024  # Unsent bytes kept; past this the oldest are dropped
+OUTPUT_PUBLISH_KEEP = 1000         # Records kept in the session
+OUTPUT_PUBLISH_BACKLOG = 16        # Writer queue depth at which publishing holds off
+
+# Transcript tailing (--transcript, see TranscriptTailer)
+TRANSCRIPT_BATCH_WINDOW = 0.2        # Seconds from a batch's first message until it is sent
+TRANSCRIPT_BATCH_MAX = 200           # Messages per update; a full batch goes at once
+TRANSCRIPT_READ_CHUNK = 1024 * 1024  # Bytes read from the transcript at a time
+TRANSCRIPT_POLL_INTERVAL = 1.0       # Seconds between checks without inotify
+TRANSCRIPT_PAGE_SIZE = 100           # Messages per page under transcript/pages/
+TRANSCRIPT_MESSAGE_TYPES = ('user', 'assistant')
+
+# Screen publishing (--screen, see ScreenPublisher)
+SCREEN_INTERVAL = 0.1            # Seconds between row diffs while the screen changes
+SCREEN_SNAPSHOT_INTERVAL = 5.0   # Seconds between full snapshots
+SCREEN_DIFF_KEEP = 200           # Diffs kept, enough to span a snapshot interval
+
+
+class BackgroundWriter:
+    """Owns all outbound writes to the session transport, on one thread.
+
+    Writes go through a bounded queue so a slow backend never stalls the
+    PTY loop. Consecutive update() calls are merged into one multi-path
+    update until one writes a path above or below a path already in it
+    (the backend rejects that), which then starts the next update. set()
+    and delete() keep their place in the order. Failed
+    writes are retried with exponential backoff. Paths are relative to
+    `prefix` (the active generation, or '' for the session root itself);
+    a leading '/' makes a path relative to the session root instead.
+
+    A write that meets a full queue is dropped (and counted), unless it
+    was made with block=True, which waits up to WRITER_FLUSH_TIMEOUT
+    seconds for room. update(), set() and delete() return whether the
+    write was queued.
+    """
+
+    def __init__(self, session_transport, maxsize=WRITER_QUEUE_SIZE, retries=WRITER_RETRIES):
+        self.transport = session_transport
+        self.prefix = ''
+        self.retries = retries
+        self.queue = queue.Queue(maxsize)
+        self.writes = 0
+        self.dropped = 0
+        self.failed = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.thread = threading.Thread(target=self._run, name='proxy-writer', daemon=True)
+        self.thread.start()
+
+    def update(self, path, values, block=False):
+        return self._submit(('update', self.path(path), values), block)
+
+    def set(self, path, value, block=False):
+        return self._submit(('set', self.path(path), value), block)
+
+    def delete(self, path='', block=False):
+        return self._submit(('delete', self.path(path), None), block)
+
+    def path(self, path=''):
+        """Session-root path that a write to path goes to"""
+        if path.startswith('/'):
+            return path.strip('/')
+        return f'{self.prefix}/{path}'.strip('/')
+
+    def flush(self, timeout=WRITER_FLUSH_TIMEOUT):
+        """Wait until every queued write has been attempted. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stats(self):
+        """Queue depth and write latency, published with the heartbeat"""
+        return {
+            'queue_depth': self.queue.qsize(),
+            'writes': self.writes,
+            'last_write_ms': round(self.last_latency * 1000),
+            'max_write_ms': round(self.max_latency * 1000),
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+    def _submit(self, op, block):
+        try:
+            self.queue.put(op, block=block, timeout=WRITER_FLUSH_TIMEOUT if block else None)
+        except queue.Full:
+            self.dropped += 1
+            print(f"[proxy] Writer queue full, dropped {op[0]} of /{op[1]}")
+            return False
+        return True
+
+    def _run(self):
+        pending = None
+        while True:
+            op = pending if pending is not None else self.queue.get()
+            pending = None
+            taken = 1
+            if op[0] == 'update':
+                # Fold the following updates into one multi-path update
+                values = self._flatten(op[1], op[2])
+                parents = {parent for key in values for parent in self._parents(key)}
+                while True:
+                    try:
+                        nxt = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    more = self._flatten(nxt[1], nxt[2]) if nxt[0] == 'update' else None
+                    if more is None or any(key in parents or not values.keys().isdisjoint(self._parents(key))
+                                           for key in more):
+                        pending = nxt
+                        break
+                    values.update(more)
+                    parents.update(parent for key in more for parent in self._parents(key))
+                    taken += 1
+                op = ('update', '', values)
+            self._write(*op)
+            for _ in range(taken):
+                self.queue.task_done()
+
+    @staticmethod
+    def _flatten(path, values):
+        if not path:
+            return dict(values)
+        return {f"{path}/{key}": value for key, value in values.items()}
+
+    @staticmethod
+    def _parents(key):
+        """'a/b/c' -> ['a', 'a/b']"""
+        parts = key.split('/')
+        return ['/'.join(parts[:i]) for i in range(1, len(parts))]
+
+    def _write(self, kind, path, value):
+        delay = WRITER_BACKOFF
+        for attempt in range(1, self.retries + 1):
+            start = time.perf_counter()
+            try:
+                if kind == 'update':
+                    self.transport.update(path, value)
+                elif kind == 'set':
+                    self.transport.set(path, value)
+                else:
+                    self.transport.delete(path)
+            except Exception as e:
+                if attempt == self.retries:
+                    self.failed += 1
+                    print(f"[proxy] Firebase {kind} of /{path} failed after {attempt} attempts: {e}")
+                    return
+                print(f"[proxy] Firebase {kind} of /{path} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                delay = min(delay * 2, WRITER_BACKOFF_MAX)
+            else:
+                self.last_latency = time.perf_counter() - start
+                self.max_latency = max(self.max_latency, self.last_latency)
+                self.writes += 1
+                return
+
+
+class ScopedWriter:
+    """One session's view of a BackgroundWriter shared by several sessions
+    (proxy_supervisor.py). Paths work as on a writer of its own: relative
+    to `prefix` (the active generation), or with a leading '/' to the
+    session root, which is `root` on the shared writer's transport.
+    """
+
+    def __init__(self, shared, root):
+        self.shared = shared
+        self.root = root
+        self.prefix = ''
+
+    def update(self, path, values, block=False):
+        return self.shared.update(self._shared(path), values, block)
+
+    def set(self, path, value, block=False):
+        return self.shared.set(self._shared(path), value, block)
+
+    def delete(self, path='', block=False):
+        return self.shared.delete(self._shared(path), block)
+
+    def path(self, path=''):
+        """Session-root path that a write to path goes to"""
+        if path.startswith('/'):
+            return path.strip('/')
+        return f'{self.prefix}/{path}'.strip('/')
+
+    def flush(self, timeout=WRITER_FLUSH_TIMEOUT):
+        return self.shared.flush(timeout)
+
+    def stats(self):
+        return self.shared.stats()
+
+    @property
+    def queue(self):
+        return self.shared.queue
+
+    @property
+    def failed(self):
+        return self.shared.failed
+
+    def _shared(self, path):
+        return f'/{self.root}/{self.path(path)}'.rstrip('/')
+
+
+class OutputPublisher:
+    """Publishes the child's terminal output to output/{seq} (--publish-output).
+
+    The read loop only appends to a bounded ring of unsent bytes; past
+    `ring_size` the oldest are dropped and counted, so a backend that
+    falls behind never holds up draining the PTY. A background thread
+    cuts the ring into records of up to `chunk_size` bytes, each sent
+    `interval` seconds after its first byte arrived or as soon as it is
+    full, and queues them on the session writer once attach() gives it
+    one. It holds off while the writer's queue is backed up, so output
+    never crowds out stdin acks and meta; records queued meanwhile go out
+    as one multi-path update. A record is {'t': ms, 'data': text}, plus
+    'gap' (bytes dropped just before it) when there was one. Only the
+    newest `keep` records are kept.
+    """
+
+    def __init__(self, interval=OUTPUT_PUBLISH_INTERVAL, chunk_size=OUTPUT_PUBLISH_CHUNK,
+                 ring_size=OUTPUT_PUBLISH_RING, keep=OUTPUT_PUBLISH_KEEP):
+        self.interval = interval
+        self.chunk_size = max(chunk_size, 1)
+        self.ring_size = max(ring_size, self.chunk_size)
+        self.keep = keep
+        self.writer = None
+        self.cond = threading.Condition()
+        self.ring = bytearray()
+        self.first_at = 0.0  # When the oldest unsent byte arrived
+        self.gap = 0  # Bytes dropped since the last record
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.seq = 0
+        self.records = 0
+        self.published = 0
+        self.dropped = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='proxy-output', daemon=True)
+        self.thread.start()
+
+    def attach(self, session_writer):
+        """Start sending, once the session has been set up"""
+        with self.cond:
+            self.writer = session_writer
+            self.cond.notify()
+
+    def feed(self, chunk):
+        with self.cond:
+            size = len(self.ring)
+            if not size:
+                self.first_at = time.monotonic()
+            self.ring += chunk
+            excess = len(self.ring) - self.ring_size
+            if excess > 0:
+                del self.ring[:excess]
+                self.gap += excess
+                self.dropped += excess
+            if not size or (size < self.chunk_size <= len(self.ring)):
+                self.cond.notify()
+
+    def reset(self):
+        """Drop unsent output and start again at seq 0 (the session is being
+        reset). Records already queued on the writer go before the reset's
+        writes."""
+        with self.cond:
+            self.ring.clear()
+            self.gap = 0
+            self.decoder.reset()
+            self.seq = 0
+
+    def close(self, timeout=WRITER_FLUSH_TIMEOUT):
+        """Queue what is left and stop the thread"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join(timeout)
+
+    def stats(self):
+        return {'seq': self.seq, 'records': self.records, 'bytes': self.published,
+                'pending': len(self.ring), 'dropped': self.dropped}
+
+    def _run(self):
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                if self.writer is None or not self.ring:
+                    if self.closed:
+                        return
+                    self.cond.wait()
+                elif (not self.closed and len(self.ring) < self.chunk_size
+                      and now < self.first_at + self.interval):
+                    self.cond.wait(self.first_at + self.interval - now)
+                elif not self.closed and self.writer.queue.qsize() >= OUTPUT_PUBLISH_BACKLOG:
+                    self.cond.wait(self.interval)
+                else:
+                    self._send()
+
+    def _send(self):
+        data = bytes(self.ring[:self.chunk_size])
+        del self.ring[:self.chunk_size]
+        if self.gap:
+            self.decoder.reset()  # Whatever it held was cut off
+        record = {'t': int(time.time() * 1000),
+                  'data': self.decoder.decode(data, final=self.closed and not self.ring)}
+        if self.gap:
+            record['gap'] = self.gap
+            self.gap = 0
+        values = {str(self.seq): record}
+        if self.seq >= self.keep:
+            values[str(self.seq - self.keep)] = None
+        self.writer.update('output', values)
+        self.seq += 1
+        self.records += 1
+        self.published += len(data)
+
+
+class DebugLog:
+    """Structured debug log, one JSON object per line.
+
+    Callers only append a (time, level, event, fields) tuple to a deque
+    (no lock); a background thread serializes and writes whatever has
+    piled up every `interval` seconds, so neither the main loop nor the
+    listener threads wait on the disk. Records below `level` are dropped
+    on the spot, as are records that find maxsize records pending.
+    The file is rotated to path.1 ... path.{backups} once it grows past
+    max_bytes.
+    """
+
+    def __init__(self, path, level='debug', max_bytes=DEBUG_LOG_MAX_MB * 1024 * 1024,
+                 backups=DEBUG_LOG_BACKUPS, maxsize=DEBUG_LOG_QUEUE_SIZE,
+                 interval=DEBUG_LOG_INTERVAL):
+        self.path = path
+        self.threshold = DEBUG_LOG_LEVELS[level]
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.maxsize = maxsize
+        self.interval = interval
+        self.records = collections.deque()
+        self.closing = threading.Event()
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.file = open(path, 'a', encoding='utf-8')
+        self.thread = threading.Thread(target=self._run, name='proxy-debug-log', daemon=True)
+        self.thread.start()
+
+    def log(self, level, event, **fields):
+        if DEBUG_LOG_LEVELS[level] < self.threshold:
+            return
+        if len(self.records) >= self.maxsize:
+            self.dropped += 1
+            return
+        self.records.append((time.time(), level, event, fields))
+
+    def debug(self, event, **fields):
+        self.log('debug', event, **fields)
+
+    def info(self, event, **fields):
+        self.log('info', event, **fields)
+
+    def close(self, timeout=WRITER_FLUSH_TIMEOUT):
+        """Write out pending records and close the file"""
+        self.closing.set()
+        self.thread.join(timeout)
+
+    def _run(self):
+        while True:
+            closing = self.closing.wait(self.interval)
+            lines = []
+            while self.records:
+                ts, level, event, fields = self.records.popleft()
+                # Values are serialized here, off the stdin path; bytes
+                # and other non-JSON values are logged as their repr()
+                lines.append(json.dumps({'ts': round(ts, 6), 'level': level, 'event': event, **fields},
+                                        default=repr))
+            if self.dropped > self.reported_dropped:
+                lines.append(json.dumps({'ts': round(time.time(), 6), 'level': 'warning', 'event': 'DROPPED',
+                                         'count': self.dropped - self.reported_dropped}))
+                self.reported_dropped = self.dropped
+            try:
+                if lines:
+                    self.file.write('\n'.join(lines) + '\n')
+                    self.file.flush()
+                    if self.file.tell() >= self.max_bytes:
+                        self._rotate()
+            except OSError as e:
+                print(f"[proxy] Debug log write failed: {e}")
+            if closing:
+                self.file.close()
+                return
+
+    def _rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        if self.backups:
+            os.replace(self.path, f'{self.path}.1')
+        self.file = open(self.path, 'w', encoding='utf-8')
+
+
+class StartupTimings:
+    """Startup milestones in ms since main() began, for --timings. Marks
+    come from the main loop and the backend thread; the first of each wins."""
+
+    def __init__(self, start, debug_log=None):
+        self.start = start
+        self.debug_log = debug_log
+        self.marks = {}
+        self.reported = False
+
+    def mark(self, name):
+        self.marks.setdefault(name, round((time.time() - self.start) * 1000, 1))
+
+    def report(self, force=False):
+        """Print the marks once the child has drawn and the backend is up
+        (or when forced)"""
+        if self.reported or not (force or ('first_output' in self.marks and 'backend' in self.marks)):
+            return
+        self.reported = True
+        marks = sorted(self.marks.items(), key=lambda item: item[1])
+        print("[proxy] Startup timings (ms): " + ', '.join(f'{name} {ms}' for name, ms in marks))
+        if self.debug_log:
+            self.debug_log.info('STARTUP', **self.marks)
 
 
 def signal_handler(signum, frame):
     """Handle Ctrl+C gracefully - update status and exit"""
-    global proc, ref, master_fd
-
     print("\n[proxy] Caught interrupt, cleaning up...")
 
-    if master_fd is not None:
+    if session:
+        # Signal every process group now and wait for them after the
+        # status update, so the two overlap
+        if session.interrupt():
+            writer = session.writer
+            if writer.flush() and not writer.failed:
+                print("[proxy] Updated Firebase status to 'interrupted'")
+            else:
+                print(f"[proxy] Failed to update Firebase: {writer.stats()}")
+        session.close()
+        if session.transport:
+            session.transport.close()
+
+    sys.exit(130)  # 128 + SIGINT(2)
+
+
+def child_env(name):
+    """Environment for a session's child: the proxy's own, set up for an
+    80x24 color terminal and tagged with the session name"""
+    env = os.environ.copy()
+    env['TERM'] = 'xterm-256color'
+    env['COLORTERM'] = 'truecolor'
+    env['COLUMNS'] = '80'
+    env['LINES'] = '24'
+    env['CLAUDE_PROXY_SHELL'] = name
+    return env
+
+
+def hook_session(env=None):
+    """Session a hook run under a proxy child acts for: CLAUDE_PROXY_SHELL,
+    or None outside the proxy and while the child waits on standby (the
+    file CLAUDE_PROXY_STANDBY names still exists)"""
+    env = os.environ if env is None else env
+    marker = env.get('CLAUDE_PROXY_STANDBY')
+    if marker and os.path.exists(marker):
+        return None
+    return env.get('CLAUDE_PROXY_SHELL')
+
+
+def spawn_child(command, env):
+    """Start command on a new PTY_COLS x PTY_ROWS raw PTY. Returns (proc, master_fd)
+    with the master end non-blocking so output can be drained until EAGAIN."""
+    master_fd, slave_fd = pty.openpty()
+    os.set_blocking(master_fd, False)
+    winsize = struct.pack('HHHH', PTY_ROWS, PTY_COLS, 0, 0)
+    fcntl.ioctl(slave_fd, termios.TIOCSWINSZ, winsize)
+
+    # Use full raw mode to disable all terminal processing
+    # This ensures input bytes pass through exactly as sent
+    try:
+        tty.setraw(slave_fd)
+        # Re-apply window size after setraw (it may have been cleared)
+        fcntl.ioctl(slave_fd, termios.TIOCSWINSZ, winsize)
+    except Exception as e:
+        print(f"[proxy] Warning: Could not set raw mode: {e}")
+
+    try:
+        child = subprocess.Popen(
+            command,
+            shell=True,
+            stdin=slave_fd,
+            stdout=slave_fd,
+            stderr=slave_fd,
+            close_fds=True,
+            start_new_session=True,
+            env=env
+        )
+    except Exception:
+        os.close(master_fd)
+        raise
+    finally:
+        os.close(slave_fd)  # Close slave in parent, child has it
+    return child, master_fd
+
+
+class Teardown:
+    """One retired child and how long its process group took to go away"""
+
+    def __init__(self, child, reason, now):
+        self.child = child
+        self.reason = reason
+        self.started = now
+        self.exited = None  # When the child itself was reaped
+        self.killed = False
+
+    def stats(self, now):
+        return {
+            'reason': self.reason,
+            'exit_code': self.child.returncode,
+            'exit_ms': round((self.exited - self.started) * 1000, 1) if self.exited else None,
+            'group_ms': round((now - self.started) * 1000, 1),
+            'killed': self.killed,
+        }
+
+
+class Reaper:
+    """Tears down children without blocking the main loop.
+
+    Children run in their own session, so the process group with the
+    child's pid holds the child and everything it started. retire() closes
+    the child's PTY and sends SIGTERM to that group. poll() - run on every
+    main loop pass, which SIGCHLD wakes - reaps the child and checks
+    whether anything is left in the group. Groups still there after
+    `grace` seconds get SIGKILL; after twice that they are given up on.
+    """
+
+    def __init__(self, grace=TEARDOWN_GRACE):
+        self.grace = grace
+        self.pending = []  # Teardown
+        self.completed = 0
+        self.killed = 0
+        self.last = None  # stats() of the last finished teardown
+
+    def retire(self, child, fd=None, reason=''):
+        if fd is not None:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self.pending.append(Teardown(child, reason, time.time()))
+        self._signal(child.pid, signal.SIGTERM)
+
+    def next_deadline(self):
+        if not self.pending:
+            return None
+        return time.time() + TEARDOWN_POLL_INTERVAL
+
+    def poll(self, now):
+        """Advance every teardown. Returns stats() of the ones that finished."""
+        finished = []
+        for teardown in list(self.pending):
+            if teardown.exited is None and teardown.child.poll() is not None:
+                teardown.exited = now
+            gone = teardown.exited is not None and not self._group_alive(teardown.child.pid)
+            if gone or now >= teardown.started + 2 * self.grace:
+                if not gone:
+                    print(f"[proxy] Process group {teardown.child.pid} still alive after SIGKILL, giving up")
+                if teardown in self.pending:
+                    self.pending.remove(teardown)
+                self.completed += 1
+                self.last = teardown.stats(now)
+                finished.append(self.last)
+            elif not teardown.killed and now >= teardown.started + self.grace:
+                teardown.killed = True
+                self.killed += 1
+                self._signal(teardown.child.pid, signal.SIGKILL)
+        return finished
+
+    def finish(self):
+        """Block until every retired group is gone (used at shutdown)"""
+        while self.pending:
+            self.poll(time.time())
+            if self.pending:
+                time.sleep(TEARDOWN_POLL_INTERVAL)
+
+    def stats(self):
+        return {
+            'pending': len(self.pending),
+            'completed': self.completed,
+            'killed': self.killed,
+            'last': self.last,
+        }
+
+    @staticmethod
+    def _group_alive(pgid):
+        """Whether the group still has a member that isn't a zombie. Killed
+        grandchildren are reparented to init, which may be slow to reap them."""
+        if not Reaper._signal(pgid, 0):
+            return False
         try:
-            os.close(master_fd)
+            pids = [pid for pid in os.listdir('/proc') if pid.isdigit()]
         except OSError:
-            pass
-
-    if proc:
-        proc.terminate()
+            return True  # No procfs; trust the signal check
+        for pid in pids:
+            try:
+                with open(f'/proc/{pid}/stat', 'rb') as f:
+                    state, _, pgrp = f.read().rsplit(b')', 1)[1].split()[:3]
+            except (OSError, ValueError):
+                continue  # Exited meanwhile
+            if int(pgrp) == pgid and state != b'Z':
+                return True
+        return False
+
+    @staticmethod
+    def _signal(pgid, sig):
+        """Signal a process group. Returns False once it no longer exists."""
         try:
-            proc.wait(timeout=5)
-        except subprocess.TimeoutExpired:
-            proc.kill()
+            os.killpg(pgid, sig)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True  # Taken over by a process we can't signal; not ours to wait for
+        return True
+
+
+class StandbyChild:
+    """An idle pre-spawned child and the output it produced so far.
 
-    if ref:
+    Its CLAUDE_PROXY_STANDBY names `marker`, a file that exists until
+    release(), so its hooks can tell it isn't serving the session yet.
+    """
+
+    def __init__(self, command, env, marker):
+        self.command = command
+        self.marker = marker
+        open(marker, 'w').close()
         try:
-            ref.child('meta').update({
-                'status': 'interrupted',
-                'updated_at': int(time.time() * 1000)
-            })
-            print("[proxy] Updated Firebase status to 'interrupted'")
-        except Exception as e:
-            print(f"[proxy] Failed to update Firebase: {e}")
+            self.proc, self.fd = spawn_child(command, dict(env, CLAUDE_PROXY_STANDBY=marker))
+        except Exception:
+            self.release()
+            raise
+        self.output = bytearray()
+
+    def release(self):
+        """Remove the marker: the child is swapped in (or dropped)"""
+        try:
+            os.unlink(self.marker)
+        except FileNotFoundError:
+            pass
 
-    sys.exit(130)  # 128 + SIGINT(2)
+
+class StandbyPool:
+    """Pre-spawned children for instant /clear and plan restarts.
+
+    Keeps `size` idle children per command on their own PTYs, registered
+    with the main loop selector (as (pool, child), for drain()) so their
+    output is drained (and kept, up to STANDBY_OUTPUT_MAX bytes) while
+    they wait. start() swaps one in and schedules a refill
+    STANDBY_REFILL_DELAY seconds later; it spawns the command cold when no
+    standby child is ready.
+
+    Standby children get the session's full `env`, CLAUDE_PROXY_SHELL
+    included, plus CLAUDE_PROXY_STANDBY: the path of a marker file in
+    `marker_dir` that is removed when the child is swapped in. A process's
+    environment can't change once it runs, so hooks check the marker (see
+    hook_session()) and hold off while it exists.
+    """
+
+    def __init__(self, commands, env, reaper, size=0, marker_dir=None):
+        self.env = env
+        self.reaper = reaper
+        self.size = size
+        self.marker_dir = marker_dir or os.path.join(SCRIPT_DIR, '.claude')
+        self.spawned = 0
+        self.children = {command: [] for command in commands}
+        self.sel = None
+        self.refill_at = None
+        self.swaps = 0
+        self.misses = 0
+
+    def attach(self, sel, now):
+        """Register with the main loop selector and schedule the first fill"""
+        self.sel = sel
+        self.schedule_refill(now)
+
+    def schedule_refill(self, now):
+        if self.size and self.refill_at is None:
+            self.refill_at = now + STANDBY_REFILL_DELAY
+
+    def next_deadline(self):
+        return self.refill_at
+
+    def refill(self, now):
+        """Spawn missing standby children once the refill is due"""
+        if self.refill_at is None or now < self.refill_at:
+            return
+        self.refill_at = None
+        for command, children in self.children.items():
+            while len(children) < self.size:
+                self.spawned += 1
+                marker = os.path.join(self.marker_dir, f'proxy_standby_{os.getpid()}_'
+                                                       f'{self.env["CLAUDE_PROXY_SHELL"]}_{self.spawned}')
+                try:
+                    os.makedirs(self.marker_dir, exist_ok=True)
+                    child = StandbyChild(command, self.env, marker)
+                except Exception as e:
+                    print(f"[proxy] Failed to start standby child: {e}")
+                    return
+                children.append(child)
+                self.sel.register(child.fd, selectors.EVENT_READ, (self, child))
+
+    def drain(self, child):
+        """Read output from an idle child; drop it if it exited"""
+        nread = drain_pty(child.fd, child.output.extend)
+        if len(child.output) > STANDBY_OUTPUT_MAX:
+            del child.output[:-STANDBY_OUTPUT_MAX]
+        if nread < 0:
+            print(f"[proxy] Standby child exited with code {child.proc.poll()}")
+            self._remove(child)
+            self.reaper.retire(child.proc, child.fd, 'standby exited')
+            self.schedule_refill(time.time())
+
+    def start(self, command):
+        """Swap in a standby child for command, or spawn it cold.
+        Returns (proc, master_fd, output produced while on standby)."""
+        children = self.children.get(command, [])
+        while children:
+            child = children[0]
+            self._remove(child)
+            if child.proc.poll() is None:
+                self.swaps += 1
+                self.schedule_refill(time.time())
+                return child.proc, child.fd, bytes(child.output)
+            self.reaper.retire(child.proc, child.fd, 'standby exited')
+        self.misses += 1
+        self.schedule_refill(time.time())
+        child_proc, fd = spawn_child(command, self.env)
+        return child_proc, fd, None
+
+    def stats(self):
+        return {
+            'ready': sum(len(children) for children in self.children.values()),
+            'swaps': self.swaps,
+            'misses': self.misses,
+        }
+
+    def close(self):
+        for children in self.children.values():
+            for child in list(children):
+                self._remove(child)
+                self.reaper.retire(child.proc, child.fd, 'standby')
+
+    def _remove(self, child):
+        child.release()
+        self.children[child.command].remove(child)
+        if self.sel:
+            try:
+                self.sel.unregister(child.fd)
+            except (KeyError, ValueError):
+                pass  # Selector already closed
+
+
+class Generations:
+    """Generation-namespaced session layout (--generations).
+
+    Each fresh session writes under gen/{n}, and the small record at
+    'current' names the active generation. Resetting the session is one
+    pointer write instead of deleting the whole subtree, so it costs the
+    same however much output the old session left. Readers follow the
+    pointer; collect() deletes generations past the newest `keep`.
+    """
+
+    def __init__(self, current=-1, oldest=0, keep=2):
+        self.current = current
+        self.oldest = min(oldest, max(current, 0))
+        self.keep = max(keep, 1)
+
+    @property
+    def path(self):
+        return f'gen/{self.current}'
+
+    def advance(self):
+        self.current += 1
+
+    def pointer(self):
+        return {'gen': self.current, 'oldest': self.oldest, 'updated_at': int(time.time() * 1000)}
+
+    def collect(self, session_writer):
+        """Queue deletes for generations past the retention limit"""
+        keep_from = self.current - self.keep + 1
+        if self.oldest >= keep_from:
+            return
+        for gen in range(self.oldest, keep_from):
+            session_writer.delete(f'/gen/{gen}')
+        self.oldest = keep_from
+        session_writer.update('/current', {'oldest': self.oldest})
+
+
+class Lease:
+    """Exclusive ownership of a session, recorded at meta/lease.
+
+    claim() takes the lease in a transaction when it is free, already
+    ours, or stale: the same record for `ttl` seconds of our own
+    watching, so hosts' clocks need not agree. The owner renews it with
+    each heartbeat and is fed the record by a listener through observe(),
+    which sets `lost` once another owner has taken over.
+    """
+
+    def __init__(self, owner, ttl):
+        self.owner = owner
+        self.ttl = ttl
+        self.held = False
+        self.lost = False
+        self.acquired_at = None
+        self.renewed = 0.0  # When our last renewal was sent
+        self.seen = None  # Last record of another owner, and since when
+        self.seen_since = 0.0
+
+    def record(self, now):
+        renewed_at = int(now * 1000)
+        return {
+            'owner': self.owner,
+            'acquired_at': self.acquired_at or renewed_at,
+            'renewed_at': renewed_at,
+            'expires_at': renewed_at + int(self.ttl * 1000),
+        }
+
+    def watch(self, current, now):
+        """Note the record of another owner"""
+        if current != self.seen:
+            self.seen = current
+            self.seen_since = now
+
+    def available(self, current, now):
+        """Whether the lease holding current may be taken"""
+        if not isinstance(current, dict) or current.get('owner') == self.owner:
+            return True
+        return current == self.seen and now - self.seen_since >= self.ttl
+
+    def claim(self, session_transport, path=LEASE_PATH):
+        """Take or keep the lease. Returns True if we hold it."""
+        now = time.time()
+        result = session_transport.transaction(
+            path, lambda current: self.record(now) if self.available(current, now) else current)
+        if isinstance(result, dict) and result.get('owner') == self.owner:
+            self.acquired_at = result.get('acquired_at')
+            self.held, self.lost = True, False
+            self.renewed = now
+            return True
+        self.held = False
+        self.watch(result, now)
+        return False
+
+    def renewal(self, now):
+        """Renewed record to write with the heartbeat, or None when the last
+        renewal is too old to be sure nobody took over - claim() again then"""
+        if now - self.renewed >= self.ttl / 2:
+            return None
+        self.renewed = now
+        return self.record(now)
+
+    def observe(self, current):
+        """Record seen by the listener. Returns True if it means the lease is lost."""
+        owner = current.get('owner') if isinstance(current, dict) else None
+        if self.held and owner not in (None, self.owner):
+            self.held, self.lost = False, True
+            self.seen = current
+            return True
+        return False
+
+
+def say(message):
+    """print() for lines that may race another thread's: the line goes out
+    in one write, so other output can't land between text and newline"""
+    sys.stdout.write(message + '\n')
+
+
+def wake_main_loop():
+    """Wake the main loop selector from another thread (self-pipe trick)"""
+    if wakeup_w is None:
+        return
+    try:
+        os.write(wakeup_w, b'\0')
+    except OSError:
+        pass  # Pipe full - a wakeup is already pending
+
+
+def drain_wakeup_pipe():
+    """Consume pending wakeup bytes so the selector can block again"""
+    try:
+        while os.read(wakeup_r, 4096):
+            pass
+    except BlockingIOError:
+        pass
 
 
 def extract_value(raw_value):
-    """Parse timestamp:value[:noenter][:raw] format, return (value, send_enter, use_raw) tuple.
+    """Parse timestamp:value[:noenter][:raw][:urgent] format, return
+    (value, send_enter, use_raw, urgent) tuple.
 
     Format: "1735012345:actualvalue" or "1735012345:actualvalue:noenter:raw"
     where timestamp is all digits.
@@ -89,6 +1110,10 @@ def extract_value(raw_value):
     Flags (can be in any order at end):
     - :noenter - suppresses the Enter keystroke after sending
     - :raw - sends without bracketed paste escape sequences
+    - :urgent - sends ahead of queued input (see --urgent)
+
+    A value of "macro:" followed by a JSON step list is returned as a Macro
+    (see parse_macro), or as None if it doesn't parse.
     """
     send_enter = True
     use_raw = False
@@ -98,78 +1123,2142 @@ def extract_value(raw_value):
         if parts[0].isdigit():
             # Check for flags at the end (can be in any order)
             flags = []
-            while len(parts) > 2 and parts[-1] in ('noenter', 'raw'):
+            while len(parts) > 2 and parts[-1] in ('noenter', 'raw', 'urgent'):
                 flags.append(parts.pop())
             send_enter = 'noenter' not in flags
             use_raw = 'raw' in flags
             value = ':'.join(parts[1:])  # Everything after timestamp
-            return (value, send_enter, use_raw)
-    return (raw_value, True, False)
+            if value.startswith(MACRO_PREFIX):
+                try:
+                    value = parse_macro(value[len(MACRO_PREFIX):])
+                except ValueError as e:
+                    say(f"[proxy] Ignoring stdin macro: {e}")
+                    value = None
+                return (value, False, False, 'urgent' in flags)
+            return (value, send_enter, use_raw, 'urgent' in flags)
+    return (raw_value, True, False, False)
+
+
+class Macro:
+    """Parsed stdin macro, run by SubmitPacer as one entry"""
+
+    def __init__(self, steps, source):
+        # ('keys' or 'paste', text), ('enter',), ('wait', regex, timeout)
+        # or ('quiet', seconds, timeout)
+        self.steps = steps
+        self.source = source
+
+    def __repr__(self):
+        return f'Macro({self.source})'
+
+
+def macro_timeout(params):
+    """Timeout of a wait/quiet step from its optional last parameter"""
+    if not params:
+        return MACRO_TIMEOUT
+    if not isinstance(params[0], (int, float)) or params[0] <= 0:
+        raise ValueError(f'invalid timeout {params[0]!r}')
+    return float(params[0])
+
+
+def parse_macro(text):
+    """Parse a macro's JSON list of steps into a Macro. Raises ValueError.
+
+        [["keys", "4"], ["wait", "Type something", 3], ["paste", "my answer"], ["enter"]]
+
+    keys  - write the text as is (keystrokes, e.g. "\u001b[B" for Down)
+    paste - write the text as a bracketed paste
+    enter - press Enter
+    wait  - until the output since the last write matches the regex, with
+            escape sequences removed; the rest of the macro is skipped if it
+            doesn't within the timeout (default MACRO_TIMEOUT seconds)
+    quiet - until the output has been silent for the given seconds, at most
+            the timeout
+    """
+    try:
+        steps = json.loads(text)
+    except ValueError as e:
+        raise ValueError(f'invalid JSON: {e}')
+    if not isinstance(steps, list) or not steps:
+        raise ValueError('expected a non-empty list of steps')
+    parsed = []
+    for step in steps:
+        kind = step[0] if isinstance(step, list) and step else None
+        params = step[1:] if kind else []
+        if kind in ('keys', 'paste') and len(params) == 1 and isinstance(params[0], str):
+            parsed.append((kind, params[0]))
+        elif kind == 'enter' and not params:
+            parsed.append((kind,))
+        elif kind == 'wait' and len(params) in (1, 2) and isinstance(params[0], str):
+            try:
+                pattern = re.compile(params[0])
+            except re.error as e:
+                raise ValueError(f'invalid regex {params[0]!r}: {e}')
+            parsed.append((kind, pattern, macro_timeout(params[1:])))
+        elif kind == 'quiet' and len(params) in (1, 2) and isinstance(params[0], (int, float)):
+            parsed.append((kind, float(params[0]), macro_timeout(params[1:])))
+        else:
+            raise ValueError(f'invalid step {step!r}')
+    return Macro(parsed, text)
+
+
+def drain_pty(fd, on_output, limit=OUTPUT_DRAIN_LIMIT):
+    """Read a non-blocking PTY master until EAGAIN (or `limit` bytes).
+
+    Each chunk is passed to on_output as a memoryview into the shared
+    output buffer, which is only valid until the next read - consumers
+    must copy or write it out immediately.
+
+    Returns the number of bytes read, or -1 once the PTY has closed.
+    """
+    total = 0
+    while total < limit:
+        try:
+            n = os.readv(fd, [output_buffer])
+        except BlockingIOError:
+            break
+        except OSError as e:
+            if e.errno == errno.EIO:
+                return total or -1  # PTY closed
+            raise
+        if n == 0:
+            return total or -1
+        on_output(output_view[:n])
+        total += n
+    return total
+
+
+def write_pty(fd, data, on_output=None, recorder=None):
+    """Write all of data to the non-blocking PTY master (and to the
+    session's recorder, if it has one).
+
+    If the child isn't reading its input, keep draining its output (to
+    on_output, local stdout by default) while waiting so neither side can
+    block the other.
+    """
+    on_output = on_output or write_stdout
+    if recorder:
+        recorder.input(data)
+    view = memoryview(data)
+    while view:
+        try:
+            view = view[os.write(fd, view):]
+        except BlockingIOError:
+            with selectors.DefaultSelector() as wait_sel:
+                wait_sel.register(fd, selectors.EVENT_READ | selectors.EVENT_WRITE)
+                for _, mask in wait_sel.select(1.0):
+                    if mask & selectors.EVENT_READ:
+                        drain_pty(fd, on_output)
 
 
-def plan_listener(event):
-    """Handle plan mode changes from Firebase"""
-    global stdin_log, plan_listener_initialized
+class TextStdout:
+    """Byte sink for a text-only stdout (no .buffer). Decodes incrementally
+    so multibyte characters split across reads aren't mangled."""
 
-    if event.data is None:
-        return
+    def __init__(self, stream):
+        self.stream = stream
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
 
-    # Skip the initial listener event (fires on setup with current value)
-    if not plan_listener_initialized:
-        plan_listener_initialized = True
-        if stdin_log:
-            stdin_log.write(f"[{time.time():.3f}] PLAN_LISTENER_INIT: skipping initial value {event.data}\n")
-            stdin_log.flush()
-        return
+    def write(self, chunk):
+        self.stream.write(self.decoder.decode(chunk))
 
-    # event.data will be True or False
-    plan_mode = bool(event.data)
-    if stdin_log:
-        stdin_log.write(f"[{time.time():.3f}] PLAN_CHANGE: {plan_mode}\n")
-        stdin_log.flush()
+    def flush(self):
+        self.stream.flush()
 
-    plan_change_queue.put(plan_mode)
-    print(f"[proxy] Plan mode changed to: {plan_mode}")
 
+def stdout_sink():
+    """Binary stream for PTY output: stdout's buffer, or a decoding wrapper"""
+    buffer = getattr(sys.stdout, 'buffer', None)
+    return buffer if buffer is not None else TextStdout(sys.stdout)
 
-def stdin_listener(event):
-    """Handle stdin input from Firebase"""
-    global last_stdin_id, stdin_log
 
-    if event.data is None:
-        return
+def write_stdout(chunk):
+    """Copy PTY output bytes to local stdout without decoding them"""
+    stdout_buffer.write(chunk)
+
+
+stdout_buffer = stdout_sink()
+
+
+class SubmitPacer:
+    """Schedules stdin writes to the PTY without blocking the main loop.
+
+    Each stdin entry becomes a short list of steps: write the paste (or raw
+    bytes), settle, optionally write Enter, settle. A settle step ends once
+    the child has produced output since the last write and then gone quiet
+    for `quiet` seconds, or when its upper bound expires. So the settle
+    after a :noenter paste ends as soon as the paste's echo has gone quiet. With wait_for_output
+    disabled every settle step waits its full upper bound. Output read
+    while a write waits for the child goes to on_output (see write_pty),
+    and the writes themselves to the session's recorder.
+
+    A Macro becomes its own steps, followed by the usual submit settle.
+    While one runs, output passed to feed() is kept from the last write on
+    for its wait steps to match.
+    """
+
+    def __init__(self, paste_settle=PASTE_SETTLE_MAX, submit_settle=SUBMIT_SETTLE_MAX,
+                 quiet=OUTPUT_QUIET, wait_for_output=True, on_output=None, debug_log=None,
+                 recorder=None):
+        self.paste_settle = paste_settle
+        self.on_output = on_output
+        self.debug_log = debug_log
+        self.recorder = recorder
+        self.submit_settle = submit_settle
+        self.quiet = quiet
+        self.wait_for_output = wait_for_output
+        self.steps = collections.deque()
+        self.wait_started = 0.0
+        self.written_at = 0.0  # When the last write went to the PTY
+        self.wait_until = None  # Upper bound of the current settle step
+        self.wait_note = None
+        self.last_output = 0.0
+        self.expect = None  # Regex of a macro wait step in progress
+        self.matched = False
+        self.quiet_for = None  # Silence a macro quiet step in progress waits for
+        self.capturing = False  # A macro is running, keep its output in seen
+        self.seen = bytearray()
+
+    def reset(self):
+        """Drop any scheduled steps (used on restart and write errors)"""
+        self.steps.clear()
+        self.wait_until = None
+        self.expect = None
+        self.quiet_for = None
+        self.capturing = False
+        self.seen.clear()
+
+    def idle(self):
+        """True when no entry is part-way through its steps"""
+        return self.wait_until is None and not self.steps
+
+    def schedule(self, stdin_data, send_enter, use_raw, entries=1, urgent=False):
+        """Queue the steps for one stdin entry (or a batch of `entries` merged ones)"""
+        if isinstance(stdin_data, Macro):
+            self.schedule_macro(stdin_data, urgent)
+            return
+        if use_raw:
+            # Send raw bytes without bracketed paste
+            self.steps.append(('write', stdin_data.encode('utf-8'), 'SENDING_RAW'))
+        else:
+            # Send as bracketed paste:
+            # \x1b[200~ = start paste
+            # \x1b[201~ = end paste
+            paste_bytes = b'\x1b[200~' + stdin_data.encode('utf-8') + b'\x1b[201~'
+            self.steps.append(('write', paste_bytes, 'SENDING_PASTE'))
+
+        # Wait for content to be processed
+        self.steps.append(('settle', self.paste_settle, None))
+
+        mode_str = "raw" if use_raw else "bracketed paste"
+        if urgent:
+            mode_str = "urgent " + mode_str
+        if entries > 1:
+            mode_str += f" ({entries} entries merged)"
+        if send_enter:
+            self.steps.append(('write', b'\r', 'SENDING_ENTER'))
+            self.steps.append(('log', 'ENTER_SENT', None))
+            self.steps.append(('say', f"[proxy] Sent stdin as {mode_str} + Enter: {repr(stdin_data)}", None))
+            # Give Claude Code time to process Enter before next input
+            self.steps.append(('settle', self.submit_settle, 'POST_ENTER_DELAY_DONE'))
+        else:
+            self.steps.append(('log', 'NO_ENTER', None))
+            self.steps.append(('say', f"[proxy] Sent stdin as {mode_str} (no Enter): {repr(stdin_data)}", None))
+            # Give Claude Code time to process before next input
+            # This is especially important for "Other" option selections
+            # which need time to render the custom text input field
+            self.steps.append(('settle', self.submit_settle, 'POST_NOENTER_DELAY_DONE'))
+
+    def schedule_macro(self, macro, urgent=False):
+        """Queue a macro's steps"""
+        self.steps.append(('macro', None, None))
+        for step in macro.steps:
+            if step[0] == 'keys':
+                self.steps.append(('write', step[1].encode('utf-8'), 'MACRO_KEYS'))
+            elif step[0] == 'paste':
+                self.steps.append(('write', b'\x1b[200~' + step[1].encode('utf-8') + b'\x1b[201~',
+                                   'MACRO_PASTE'))
+            elif step[0] == 'enter':
+                self.steps.append(('write', b'\r', 'MACRO_ENTER'))
+            elif step[0] == 'wait':
+                self.steps.append(('expect', step[1:], 'MACRO_WAIT_DONE'))
+            else:
+                self.steps.append(('quiet', step[1:], 'MACRO_QUIET_DONE'))
+        kind = "urgent stdin macro" if urgent else "stdin macro"
+        self.steps.append(('say', f"[proxy] Ran {kind} ({len(macro.steps)} steps)", None))
+        self.steps.append(('end', None, None))
+        self.steps.append(('settle', self.submit_settle, 'POST_MACRO_DELAY_DONE'))
+
+    def preempt(self, stdin_data, send_enter, use_raw):
+        """Put one entry's steps ahead of everything scheduled. A wait in
+        progress ends and a macro part-way through is stopped, so the
+        entry's first write happens on the next run() and its settle steps
+        aren't taken for the macro's waits."""
+        if self.capturing:
+            self._stop_macro('urgent input')
+        self.wait_until = None
+        self.expect = None
+        self.quiet_for = None
+        steps = self.steps
+        self.steps = collections.deque()
+        self.schedule(stdin_data, send_enter, use_raw, urgent=True)
+        self.steps.extend(steps)
+
+    def note_output(self, now):
+        """Record that the child just produced output"""
+        self.last_output = now
+
+    def feed(self, chunk):
+        """Output read from the child, kept while a macro runs"""
+        if not self.capturing:
+            return
+        self.seen += chunk
+        if len(self.seen) > MACRO_WINDOW:
+            del self.seen[:-MACRO_WINDOW]
+        if self.expect is not None and not self.matched:
+            self.matched = self._matches()
+
+    def _matches(self):
+        text = ANSI_ESCAPE.sub(b'', bytes(self.seen)).decode('utf-8', errors='replace')
+        return self.expect.search(text) is not None
+
+    def _output(self, chunk):
+        """Output drained while a write waits for the child"""
+        (self.on_output or write_stdout)(chunk)
+        self.feed(chunk)
+
+    def next_deadline(self):
+        """Time at which the current settle step may end, or None if not waiting"""
+        if self.wait_until is None:
+            return None
+        if self.expect is not None:
+            return self.wait_started if self.matched else self.wait_until
+        if self.quiet_for is not None:
+            return min(self.wait_until, max(self.wait_started, self.last_output) + self.quiet_for)
+        if self.wait_for_output and self.last_output > self.written_at:
+            return min(self.wait_until, self.last_output + self.quiet)
+        return self.wait_until
+
+    def run(self, fd, now):
+        """Execute steps until one has to wait. Returns True once idle."""
+        while True:
+            if self.wait_until is not None:
+                if now < self.next_deadline():
+                    return False
+                if self.wait_note and self.debug_log:
+                    if self.expect is not None:
+                        reason = 'match' if self.matched else 'timeout'
+                    else:
+                        reason = 'timeout' if now >= self.wait_until else 'quiet'
+                    self.debug_log.debug(self.wait_note, reason=reason,
+                                    waited_s=round(now - self.wait_started, 3))
+                if self.expect is not None and not self.matched:
+                    self._stop_macro(f"no output matching {self.expect.pattern!r} "
+                                     f"within {round(self.wait_until - self.wait_started, 3)}s")
+                self.wait_until = None
+                self.expect = None
+                self.quiet_for = None
+            if not self.steps:
+                return True
+            kind, arg, note = self.steps.popleft()
+            if kind == 'write':
+                if note and self.debug_log:
+                    self.debug_log.debug(note, data=arg)
+                if self.capturing:
+                    self.seen.clear()  # Wait steps match what this write brings
+                self.written_at = time.time()
+                write_pty(fd, arg, self._output, self.recorder)
+            elif kind == 'settle':
+                self.wait_started = now = time.time()
+                self.wait_until = now + arg
+                self.wait_note = note
+            elif kind in ('expect', 'quiet'):
+                if kind == 'expect':
+                    self.expect, timeout = arg
+                    self.matched = self._matches()
+                else:
+                    self.quiet_for, timeout = arg
+                self.wait_started = now = time.time()
+                self.wait_until = now + timeout
+                self.wait_note = note
+            elif kind == 'macro':
+                self.capturing = True
+                self.seen.clear()
+            elif kind == 'end':
+                self.capturing = False
+                self.seen.clear()
+            elif kind == 'log':
+                if self.debug_log:
+                    self.debug_log.debug(arg)
+            elif kind == 'say':
+                print(arg)
+
+    def _stop_macro(self, reason):
+        """Skip the rest of the running macro (a wait step timed out, or
+        urgent input came)"""
+        print(f"[proxy] Stdin macro stopped: {reason}")
+        while self.steps:
+            if self.steps.popleft()[0] == 'end':
+                break
+        self.capturing = False
+        self.seen.clear()
+
+
+StdinBatch = collections.namedtuple('StdinBatch', 'ids data send_enter use_raw')
+
+
+class StdinBatcher:
+    """Merges runs of queued stdin entries so a burst costs one write.
+
+    Entries are taken from `source`, the listener's queue of (idx, extracted
+    value). A run of :noenter entries in the same mode, optionally ended by
+    one entry that sends Enter, becomes one StdinBatch: one paste (or one
+    raw write of the keys joined in queue order), at most one Enter and
+    one set of settle waits. Pasted and :raw entries never share a batch,
+    so entries always reach the PTY in the order they were queued. Empty
+    entries (data None), /clear and macros are never merged, and a batch
+    stops growing at max_bytes (0 disables merging). A run not yet ended
+    by Enter or by an entry it can't take waits up to `window` seconds for
+    more before it is sent.
+
+    Urgent entries (:urgent, or :raw interrupt keys) skip the line: they
+    are kept apart and handed out one at a time by take_urgent().
+    """
 
-    # Handle both single values and dictionaries
-    if isinstance(event.data, dict):
-        # Multiple entries - process each
-        for key, value in sorted(event.data.items(), key=lambda x: int(x[0])):
-            idx = int(key)
-            if idx > last_stdin_id and value is not None:
-                # extract_value returns (value, send_enter, use_raw) tuple
+    def __init__(self, source, window=STDIN_BATCH_WINDOW, max_bytes=STDIN_BATCH_MAX, debug_log=None):
+        self.source = source
+        self.window = window
+        self.max_bytes = max_bytes
+        self.debug_log = debug_log
+        self.pending = collections.deque()  # (idx, data, send_enter, use_raw, size, arrived_at)
+        self.urgent = collections.deque()  # (idx, data, send_enter, use_raw)
+        self.entries = 0
+        self.batches = 0
+        self.merged = 0  # Entries that rode along in an earlier entry's batch
+        self.largest = 0
+        self.urgent_sent = 0
+        self.dropped = 0  # Entries dropped for urgent input (--urgent drop)
+
+    def reset(self):
+        """Drop pending and queued entries (used on restart)"""
+        self.pending.clear()
+        self.urgent.clear()
+        while not self.source.empty():
+            try:
+                self.source.get_nowait()
+            except queue.Empty:
+                break
+
+    def pull(self, now):
+        """Move entries from the listener's queue to pending"""
+        while True:
+            try:
+                idx, stdin_tuple = self.source.get_nowait()
+            except queue.Empty:
+                return
+            # extract_value returns (value, send_enter, use_raw, urgent) tuple
+            urgent = False
+            if isinstance(stdin_tuple, tuple):
+                if len(stdin_tuple) == 4:
+                    stdin_data, send_enter, use_raw, urgent = stdin_tuple
+                elif len(stdin_tuple) == 3:
+                    stdin_data, send_enter, use_raw = stdin_tuple
+                else:
+                    stdin_data, send_enter = stdin_tuple
+                    use_raw = False
+            else:
+                stdin_data, send_enter, use_raw = stdin_tuple, True, False
+            if self.debug_log:
+                self.debug_log.debug('QUEUE_GET', idx=idx, stdin_data=stdin_data,
+                                send_enter=send_enter, use_raw=use_raw, urgent=urgent)
+            # Strip any existing newlines from the data. Empty entries
+            # are only acknowledged (data None).
+            if not isinstance(stdin_data, Macro):
+                stdin_data = stdin_data.rstrip('\r\n') if stdin_data else None
+            if urgent or (use_raw and stdin_data and not stdin_data.strip(INTERRUPT_KEYS)):
+                self.urgent.append((idx, stdin_data, send_enter, use_raw))
+                continue
+            size = len(stdin_data.encode('utf-8')) if isinstance(stdin_data, str) else 0
+            self.pending.append((idx, stdin_data, send_enter, use_raw, size, now))
+
+    def _run(self):
+        """(entries, ended) for the run at the front of pending"""
+        first_raw = self.pending[0][3]
+        count = size = 0
+        for _, data, send_enter, use_raw, nbytes, _ in self.pending:
+            alone = not isinstance(data, str) or data == '/clear'
+            if count and (alone or use_raw != first_raw or size + nbytes > self.max_bytes):
+                return count, True
+            count += 1
+            size += nbytes
+            if alone or send_enter or size >= self.max_bytes:
+                return count, True
+        return count, False
+
+    def next_deadline(self):
+        """Time the unfinished run at the front is sent anyway, or None"""
+        if not self.pending or self.window <= 0 or self._run()[1]:
+            return None
+        return self.pending[0][5] + self.window
+
+    def take(self, now):
+        """Next StdinBatch to send, or None if there is none yet"""
+        self.pull(now)
+        if not self.pending:
+            return None
+        count, ended = self._run()
+        if not ended and now < self.pending[0][5] + self.window:
+            return None
+        run = [self.pending.popleft() for _ in range(count)]
+        self.entries += count
+        self.batches += 1
+        self.merged += count - 1
+        self.largest = max(self.largest, count)
+        if count > 1 and self.debug_log:
+            self.debug_log.debug('BATCH', ids=[entry[0] for entry in run], size=sum(entry[4] for entry in run))
+        data = run[0][1] if count == 1 else ''.join(entry[1] for entry in run)
+        return StdinBatch([entry[0] for entry in run], data, run[-1][2], run[0][3])
+
+    def take_urgent(self, now):
+        """Next urgent entry as a StdinBatch, or None"""
+        self.pull(now)
+        if not self.urgent:
+            return None
+        idx, data, send_enter, use_raw = self.urgent.popleft()
+        self.urgent_sent += 1
+        return StdinBatch([idx], data, send_enter, use_raw)
+
+    def drop(self):
+        """Drop every queued entry that isn't urgent; returns their keys"""
+        self.pull(time.time())
+        ids = [entry[0] for entry in self.pending]
+        self.pending.clear()
+        self.dropped += len(ids)
+        return ids
+
+    def stats(self):
+        return {'entries': self.entries, 'batches': self.batches, 'merged': self.merged,
+                'largest': self.largest, 'urgent': self.urgent_sent, 'dropped': self.dropped}
+
+
+class PlanSwitcher:
+    """Switches the child between plan and default mode without a restart.
+
+    Each Shift+Tab press is followed by a wait for the footer to redraw
+    (output, then `quiet` seconds of silence, or `timeout`). The output
+    since the press tells which mode the child is in: 'plan mode on',
+    'accept edits on', or neither for default. The switch is confirmed
+    once the target mode shows, and fails when a press gets no output or
+    a full cycle of presses never reaches it. Presses are written like
+    the SubmitPacer's writes, draining output to on_output meanwhile.
+    """
+
+    def __init__(self, plan, presses=PLAN_SWITCH_PRESSES, timeout=PLAN_SWITCH_TIMEOUT,
+                 quiet=OUTPUT_QUIET, on_output=None, debug_log=None, recorder=None):
+        self.plan = plan  # Mode the child is in, as far as we know
+        self.presses = presses
+        self.timeout = timeout
+        self.quiet = quiet
+        self.on_output = on_output
+        self.debug_log = debug_log
+        self.recorder = recorder
+        self.target = None  # Mode being switched to, None when idle
+        self.pressed = 0
+        self.pressed_at = 0.0
+        self.last_output = 0.0
+        self.seen = bytearray()
+
+    @property
+    def active(self):
+        return self.target is not None
+
+    def reset(self, plan):
+        """Forget any switch in progress; the child now runs in `plan` mode"""
+        self.plan = plan
+        self.target = None
+
+    def start(self, target, fd, now):
+        self.target = target
+        self.pressed = 0
+        self._press(fd, now)
+
+    def feed(self, chunk):
+        """Output seen while a switch is in progress"""
+        self.seen += chunk
+        if len(self.seen) > PLAN_SWITCH_WINDOW:
+            del self.seen[:-PLAN_SWITCH_WINDOW]
+
+    def note_output(self, now):
+        self.last_output = now
+
+    def next_deadline(self):
+        if self.target is None:
+            return None
+        if self.last_output > self.pressed_at:
+            return min(self.pressed_at + self.timeout, self.last_output + self.quiet)
+        return self.pressed_at + self.timeout
+
+    def run(self, fd, now):
+        """Advance the switch. Returns True once confirmed, False if it
+        failed (target is kept for the fallback) and None while waiting."""
+        if self.target is None or now < self.next_deadline():
+            return None
+        mode = self.mode()
+        if mode == ('plan' if self.target else 'default'):
+            self.reset(self.target)
+            return True
+        if mode is None or self.pressed >= self.presses:
+            return False
+        self._press(fd, now)
+        return None
+
+    def mode(self):
+        """Mode shown by the output since the last press (None if there was none)"""
+        if self.last_output <= self.pressed_at:
+            return None
+        text = re.sub(rb'\s+', b'', ANSI_ESCAPE.sub(b'', bytes(self.seen))).lower()
+        if PLAN_MODE_MARKER in text:
+            return 'plan'
+        if ACCEPT_EDITS_MARKER in text:
+            return 'accept'
+        return 'default'
+
+    def _press(self, fd, now):
+        self.seen.clear()
+        self.pressed += 1
+        self.pressed_at = now
+        write_pty(fd, MODE_CYCLE_KEY, self.on_output, self.recorder)
+        if self.debug_log:
+            self.debug_log.debug('PLAN_SWITCH_PRESS', target=self.target, press=self.pressed)
+
+
+class StateDetector:
+    """Tells from the child's output whether it is idle, busy or waiting
+    for an answer (awaiting-permission, awaiting-choice).
+
+    Each state has marker strings (`patterns`, state -> list of text).
+    Output is scanned as it is read: escape sequences and whitespace are
+    removed, the rest is lowercased and searched for each marker, in the
+    order of their states. Only the new text is searched, and one find per
+    marker beats a combined regex, which CPython's re runs several times
+    slower than bytes.find. The last bytes of each read are carried
+    into the next scan, so a marker split across reads still matches. The
+    state shown by the latest read with a marker is published once it has
+    held for `debounce` seconds. Busy markers are redrawn all the while
+    the child works, so busy turns idle `busy_hold` seconds after the last one.
+    """
+
+    def __init__(self, patterns, debounce=STATE_DEBOUNCE, busy_hold=STATE_BUSY_HOLD):
+        self.markers = []  # (normalized marker, state), first states first
+        for state, texts in patterns.items():
+            for text in texts:
+                marker = text.encode().translate(None, WHITESPACE).lower()
+                if marker:
+                    self.markers.append((marker, state))
+        if not self.markers:
+            raise ValueError('no state markers')
+        self.keep = max(len(marker) for marker, _ in self.markers) - 1
+        self.debounce = debounce
+        self.busy_hold = busy_hold
+        self.transitions = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the output and the published state (a new child)"""
+        self.carry = b''
+        self.partial = b''  # Escape sequence cut off at the end of the last read
+        self.state = None  # Published state
+        self.candidate = None
+        self.candidate_at = 0.0
+        self.last_busy = 0.0
+
+    def feed(self, chunk):
+        data = self.partial + chunk
+        cut = INCOMPLETE_ESCAPE.search(data, max(0, len(data) - STATE_ESCAPE_MAX))
+        if cut:
+            self.partial = data[cut.start():]
+            data = data[:cut.start()]
+        else:
+            self.partial = b''
+        carried = len(self.carry)
+        text = self.carry + ANSI_ESCAPE.sub(b'', data).translate(None, WHITESPACE).lower()
+        self.carry = text[-self.keep:] if self.keep else b''
+        for marker, state in self.markers:
+            # Markers wholly inside the carried bytes were seen last time
+            if text.find(marker, max(0, carried - len(marker) + 1)) >= 0:
+                now = time.time()
+                if state == 'busy':
+                    self.last_busy = now
+                if state != self.candidate:
+                    self.candidate = state
+                    self.candidate_at = now
+                break
+
+    def next_deadline(self):
+        deadlines = []
+        if self.candidate == 'busy':
+            deadlines.append(self.last_busy + self.busy_hold)
+        if self.candidate != self.state:
+            deadlines.append(self.candidate_at + self.debounce)
+        return min(deadlines, default=None)
+
+    def poll(self, now):
+        """The state to publish, or None while it hasn't changed"""
+        if self.candidate == 'busy' and now >= self.last_busy + self.busy_hold:
+            self.candidate = 'idle'
+            self.candidate_at = self.last_busy + self.busy_hold
+        if self.candidate == self.state or now < self.candidate_at + self.debounce:
+            return None
+        self.state = self.candidate
+        self.transitions += 1
+        return self.state
+
+
+def load_state_patterns(path):
+    """Per-command state markers from a JSON file: {command name: {state:
+    [text, ...]}}, where "*" stands for any other command"""
+    with open(path) as f:
+        table = json.load(f)
+    if not isinstance(table, dict):
+        raise ValueError('expected an object of command names')
+    for program, patterns in table.items():
+        if not isinstance(patterns, dict) or not all(
+                isinstance(texts, list) and all(isinstance(text, str) for text in texts)
+                for texts in patterns.values()):
+            raise ValueError(f'{program}: expected an object of state -> list of strings')
+    return table
+
+
+def state_patterns(table, command):
+    """Markers for command: its program's entry in table, else "*", else STATE_PATTERNS"""
+    words = command.split()
+    program = os.path.basename(words[0]) if words else ''
+    if table and program in table:
+        return table[program]
+    if table and '*' in table:
+        return table['*']
+    return STATE_PATTERNS
+
+
+class Inotify:
+    """Linux inotify through libc, for watching one directory without polling"""
+
+    IN_MODIFY = 0x002
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+    def __init__(self, path, mask=IN_MODIFY | IN_MOVED_TO | IN_CREATE):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f'inotify_add_watch failed for {path}')
+
+    def read(self):
+        """[(mask, name)] for the events waiting, [] if there are none"""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            events.append((mask, data[offset:offset + length].rstrip(b'\0').decode(errors='replace')))
+            offset += length
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def claude_projects_dir(cwd=None):
+    """Where Claude Code keeps the JSONL transcripts of sessions run in cwd"""
+    encoded = re.sub(r'[^A-Za-z0-9]', '-', os.path.abspath(cwd or os.getcwd()))
+    return os.path.join(os.path.expanduser('~'), '.claude', 'projects', encoded)
+
+
+def firebase_safe(value):
+    """value with characters Firebase forbids in keys replaced in every dict key"""
+    if isinstance(value, dict):
+        return {re.sub(r'[.$#\[\]/]', '_', key) or '_': firebase_safe(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [firebase_safe(item) for item in value]
+    return value
+
+
+def transcript_message(line, fallback_id):
+    """(key, value) for one transcript JSONL line, None for lines that are
+    not user or assistant messages. Keys sort by time and are the same
+    each time a line is read, so sending a line twice is harmless."""
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(entry, dict) or entry.get('type') not in TRANSCRIPT_MESSAGE_TYPES:
+        return None
+    message = entry.get('message')
+    if not isinstance(message, dict) or not message.get('role'):
+        return None
+    try:
+        stamp = datetime.datetime.fromisoformat(entry['timestamp'].replace('Z', '+00:00'))
+        ms = int(stamp.timestamp() * 1000)
+    except (KeyError, AttributeError, ValueError):
+        ms = 0
+    key = f"{ms:013d}_{entry.get('uuid') or fallback_id}"
+    return key, {'role': message['role'], 'content': firebase_safe(message.get('content', ''))}
+
+
+class TranscriptTailer:
+    """Follows the child's JSONL transcript and publishes new messages in
+    pages under transcript/ (--transcript).
+
+    Messages are numbered in the order they were read and message n goes
+    to transcript/pages/{n // page_size}/{key}. transcript/index holds
+    {pages, count, last_key, page_size, updated_at}, so a viewer reads
+    the index and the last page, and fetches older pages as it scrolls
+    back. Each batch writes its messages and the index in one update;
+    nothing else in the session is rewritten.
+
+    `path` is a transcript file, or a directory such as Claude Code's
+    projects folder; there the tailer follows the .jsonl file that was
+    last created, or written to since it started, and moves on when a new
+    one appears (a new conversation). Only bytes past the last offset are
+    read, and only complete lines are parsed, so cost goes by what was
+    appended rather than by the size of the transcript. A file that
+    shrinks (truncated) is read again from the start; one replaced under
+    the same name (rotated) is finished, then the new one is read. A
+    background thread waits on inotify, or polls where there is none, and
+    sends the messages found within `window` seconds as one multi-path
+    update once attach() gives it the session writer.
+
+    The thread alone touches the file. `lock` guards the unsent messages
+    and page count, and is only held to add a chunk's parsed messages or
+    queue a batch on the writer, never for reads, so reset() from the main
+    loop doesn't wait on a large transcript.
+    """
+
+    def __init__(self, path, window=TRANSCRIPT_BATCH_WINDOW, batch_max=TRANSCRIPT_BATCH_MAX,
+                 page_size=TRANSCRIPT_PAGE_SIZE):
+        self.directory = path if os.path.isdir(path) else None
+        self.path = None if self.directory else path
+        self.window = window
+        self.page_size = max(page_size, 1)
+        self.count = 0  # Messages in the paged layout
+        self.last_key = None
+        self.stale = False  # Pages hold a transcript that was truncated since
+        self.reset_at = None  # Time of a reset() the thread hasn't applied yet
+        self.batch_max = batch_max
+        self.since = time.time()  # Directory mode: files untouched since then are old sessions
+        self.known = None  # Directory mode without inotify: .jsonl names at the last poll
+        self.file = None
+        self.inode = None
+        self.offset = 0
+        self.carry = bytearray()  # Start of a line not yet terminated
+        self.writer = None
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.first_at = 0.0
+        self.messages = 0
+        self.bytes = 0
+        self.truncations = 0
+        self.rotations = 0
+        self.closed = threading.Event()
+        try:
+            self.inotify = Inotify(self.directory or os.path.dirname(os.path.abspath(path)))
+        except (OSError, AttributeError):
+            self.inotify = None  # No inotify here, or nothing to watch yet: poll
+        self.thread = threading.Thread(target=self._run, name='proxy-transcript', daemon=True)
+        self.thread.start()
+
+    def attach(self, session_writer):
+        """Start sending, once the session has been set up"""
+        with self.lock:
+            self.writer = session_writer
+
+    def reset(self):
+        """The session is being reset: drop unsent messages. A file is read
+        again from the start; in a directory the next conversation's file
+        is picked up. The thread does that on its next pass, so this
+        doesn't wait for a read in progress."""
+        with self.lock:
+            self.pending.clear()
+            self.count = 0
+            self.last_key = None
+            self.stale = False
+            self.reset_at = time.time()
+
+    def close(self, timeout=WRITER_FLUSH_TIMEOUT):
+        """Send what is left and stop the thread"""
+        self.closed.set()
+        self.thread.join(timeout)
+
+    def stats(self):
+        return {'path': self.path, 'offset': self.offset, 'messages': self.messages, 'count': self.count,
+                'bytes': self.bytes, 'truncations': self.truncations, 'rotations': self.rotations}
+
+    def _run(self):
+        wait = selectors.DefaultSelector()
+        if self.inotify:
+            wait.register(self.inotify.fd, selectors.EVENT_READ)
+        while True:
+            closing = self.closed.is_set()
+            events = self.inotify.read() if self.inotify else None
+            with self.lock:
+                reset_at, self.reset_at = self.reset_at, None
+            if reset_at is not None:
+                self._rewind(reset_at)
+                events = None  # Look at the files again, changed or not
+            self._follow(events)
+            with self.lock:
+                if self.writer is not None and (self.stale or self.pending and (
+                        closing or time.monotonic() >= self.first_at + self.window)):
+                    self._send()
+                timeout = TRANSCRIPT_POLL_INTERVAL
+                if self.reset_at is not None:
+                    timeout = 0  # Reset during this pass: start over now
+                elif self.pending:
+                    timeout = max(0, min(timeout, self.first_at + self.window - time.monotonic()))
+            if closing:
+                wait.close()
+                self._close_file()
+                if self.inotify:
+                    self.inotify.close()
+                return
+            if self.inotify:
+                wait.select(timeout)
+            else:
+                self.closed.wait(timeout)
+
+    def _rewind(self, reset_at):
+        """The thread's side of reset()"""
+        if self.directory:
+            self._close_file()
+            self.path = None
+            self.since = reset_at
+        else:
+            self.offset = 0
+            self.carry.clear()
+
+    def _follow(self, events):
+        """Read whatever was appended. events are inotify's (mask, name)
+        pairs, None without inotify."""
+        if self.directory:
+            newer = self._pick(events)
+            if newer and newer != self.path:
+                if self.file:
+                    self._read()  # Finish the last conversation first
+                    self.rotations += 1
+                self._close_file()
+                self.path = newer
+        elif events is not None and self.file and all(
+                name != os.path.basename(self.path) for _, name in events):
+            return  # Only other files in the directory changed
+        if self.path is None:
+            return
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            inode = None
+        if self.file and inode != self.inode:
+            self._read()  # Rotated: the rest of the old file, then the new one
+            self._close_file()
+            self.rotations += 1
+        if self.file is None:
+            if inode is None:
+                return
+            self.file = open(self.path, 'rb')
+            self.inode = os.fstat(self.file.fileno()).st_ino
+            self.offset = 0
+            self.carry.clear()
+        self._read()
+
+    def _pick(self, events):
+        """Directory mode: the file to follow from now on, if that changed.
+        With none yet, the newest one written since `since`; after that,
+        only a newly created one."""
+        if events is None:
+            try:
+                names = {name for name in os.listdir(self.directory) if name.endswith('.jsonl')}
+            except FileNotFoundError:
+                names = set()
+            created = names - self.known if self.known is not None else set()
+            self.known = names
+        else:
+            names = {name for _, name in events if name.endswith('.jsonl')}
+            created = {name for mask, name in events if mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO)
+                       and name.endswith('.jsonl')}
+        stamped = []
+        for name in (names if self.path is None else created):
+            full = os.path.join(self.directory, name)
+            try:
+                mtime = os.stat(full).st_mtime
+            except FileNotFoundError:
+                continue
+            if mtime >= self.since:
+                stamped.append((mtime, full))
+        return max(stamped)[1] if stamped else None
+
+    def _read(self):
+        fd = self.file.fileno()
+        size = os.fstat(fd).st_size
+        if size < self.offset:
+            self.truncations += 1
+            self.offset = 0
+            self.carry.clear()
+            self._collect([], truncated=True)
+        while self.offset < size:
+            data = os.pread(fd, min(size - self.offset, TRANSCRIPT_READ_CHUNK), self.offset)
+            if not data:
+                break
+            line_start = self.offset - len(self.carry)
+            self.offset += len(data)
+            self.bytes += len(data)
+            self.carry += data
+            lines = self.carry.split(b'\n')
+            self.carry = bytearray(lines.pop())
+            messages = []
+            for line in lines:
+                message = transcript_message(line, line_start) if line.strip() else None
+                line_start += len(line) + 1
+                if message:
+                    messages.append(message)
+            self._collect(messages)
+
+    def _collect(self, messages, truncated=False):
+        """Add the messages parsed from one chunk"""
+        with self.lock:
+            if self.reset_at is not None:
+                return  # Read before a reset(); the next pass starts over
+            if truncated:
+                # Lay the transcript out again from page 0
+                self.pending.clear()
+                self.count = 0
+                self.last_key = None
+                self.stale = True
+            for key, value in messages:
+                self._add(key, value)
+
+    def _add(self, key, value):
+        if not self.pending:
+            self.first_at = time.monotonic()
+        self.pending[f'transcript/pages/{self.count // self.page_size}/{key}'] = value
+        self.count += 1
+        self.last_key = key
+        self.messages += 1
+        if len(self.pending) >= self.batch_max and self.writer is not None:
+            self._send()
+
+    def _send(self):
+        if self.stale:
+            self.writer.delete('transcript')
+            self.stale = False
+        self.pending['transcript/index'] = {
+            'pages': -(-self.count // self.page_size),
+            'count': self.count,
+            'last_key': self.last_key,
+            'page_size': self.page_size,
+            'updated_at': int(time.time() * 1000),
+        }
+        self.writer.update('', self.pending)
+        self.pending = {}
+
+    def _close_file(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+            self.inode = None
+
+
+class ScreenPublisher:
+    """Publishes the child's screen as a proxy_screen.Screen sees it (--screen).
+
+    While the screen changes, the rows that render differently are sent
+    at most every `interval` seconds as screen/diffs/{seq}: {t, lines:
+    {row: line}, cursor: [row, col], cursor_visible}. Every
+    `snapshot_interval` seconds the diff goes out with a full snapshot at
+    screen/snapshot, in the same update, carrying that diff's seq. A
+    viewer joining late reads the snapshot and applies the diffs after
+    it, instead of replaying the output from the start.
+    """
+
+    def __init__(self, rows=PTY_ROWS, cols=PTY_COLS, interval=SCREEN_INTERVAL,
+                 snapshot_interval=SCREEN_SNAPSHOT_INTERVAL, keep=SCREEN_DIFF_KEEP):
+        self.rows = rows
+        self.cols = cols
+        self.interval = interval
+        self.snapshot_interval = snapshot_interval
+        self.keep = keep
+        self.snapshots = 0
+        self.reset()
+
+    def reset(self):
+        """A new child on a blank screen; the next diff comes with a snapshot"""
+        self.screen = Screen(self.rows, self.cols)
+        self.seq = 0
+        self.cursor = None
+        self.last_sent = 0.0
+        self.last_snapshot = 0.0
+        self.fresh = True  # Replace diffs left by an earlier child or run
+
+    def feed(self, chunk):
+        self.screen.feed(chunk)
+
+    def _cursor(self):
+        return [self.screen.y, self.screen.x, self.screen.cursor_visible]
+
+    def next_deadline(self):
+        if not self.screen.dirty and self._cursor() == self.cursor:
+            return None
+        return self.last_sent + self.interval
+
+    def publish(self, session_writer, now):
+        """Send what changed, if anything did and a diff is due"""
+        if now < self.last_sent + self.interval:
+            return
+        lines = self.screen.diff()
+        cursor = self._cursor()
+        if not lines and cursor == self.cursor:
+            return
+        self.seq += 1
+        diff = {'t': int(now * 1000), 'cursor': cursor[:2], 'cursor_visible': cursor[2]}
+        if lines:
+            diff['lines'] = lines
+        if self.fresh:
+            values = {'diffs': {str(self.seq): diff}}
+        else:
+            values = {f'diffs/{self.seq}': diff}
+        if self.seq > self.keep:
+            values[f'diffs/{self.seq - self.keep}'] = None
+        if self.fresh or now >= self.last_snapshot + self.snapshot_interval:
+            snapshot = self.screen.snapshot()
+            snapshot.update(seq=self.seq, t=diff['t'])
+            values['snapshot'] = snapshot
+            self.last_snapshot = now
+            self.snapshots += 1
+        session_writer.update('screen', values)
+        self.fresh = False
+        self.cursor = cursor
+        self.last_sent = now
+
+    def stats(self):
+        return {'seq': self.seq, 'snapshots': self.snapshots, 'rows': self.rows, 'cols': self.cols}
+
+
+class ProxySession:
+    """One proxied command: its child on a PTY, its session's stdin, plan
+    and meta, and everything the main loop does for it.
+
+    proxy.py's main() drives one session; proxy_supervisor.py drives one
+    per manifest entry, all on one selector and one shared connection.
+    The driver sets `transport` and `writer` (and `lease`) and calls
+    open() once the backend is up, then start(). Listener callbacks run on
+    backend threads; they only queue work and call `wake` so the loop
+    calls service() - also due when the child's PTY (registered with `sel`
+    under the session itself) is readable and at next_deadline(). The
+    driver calls heartbeat() every META_UPDATE_INTERVAL.
+
+    PTY output goes to `sink` (local stdout by default). Messages are
+    printed with `tag` in front.
+    """
+
+    def __init__(self, name, command, args, sel, wake, sink=None, transcript_path=None, tag='[proxy]'):
+        self.name = name
+        self.original_command = command  # With all flags, for plan_command()
+        self.command = command
+        self.args = args
+        self.sel = sel
+        self.wake = wake
+        self.sink = sink
+        self.tag = tag
+        self.env = child_env(name)
+        self.transport = None  # SessionTransport holding stdin, plan and meta
+        self.writer = None  # BackgroundWriter (or ScopedWriter) owning all writes to it
+        self.ready = threading.Event()  # Set once open() has set up the session
+        self.generations = None  # Generations when sessions are namespaced (--generations)
+        self.lease = None  # Lease on the session, when leases are used
+        self.extra_meta = {}  # Added to each child's meta record (the supervisor's pid)
+        self.listeners = []  # Listener handles for the active session's stdin and plan
+        self.lease_listener_handle = None
+        self.timings = None  # StartupTimings, for proxy.py --timings
+        self.proc = None
+        self.fd = None
+        self.exit_code = None
+        self.exited_at = None  # When the child was seen to have exited
+        self.output_until = None  # Until when its last output is waited for
+        self.last_teardown = None  # Finished teardown waiting for the backend, published as meta/teardown
+        self.stdin_queue = queue.Queue()  # (idx, extracted value) in key order
+        self.last_stdin_id = -1  # Highest stdin key received from the listener
+        self.stdin_cursor = -1  # Highest stdin key consumed, persisted as meta/stdin_cursor
+        self.stdin_acks = []  # Consumed stdin keys not yet deleted from the backend
+        self.plan_changes = queue.Queue()
+        self.plan_listener_initialized = False  # Skip initial listener event
+        self.pending_plan = None  # Plan mode waiting for the current stdin entry to finish
+        self.plan_requested_at = 0.0
+
+        # Stdin debug log (off unless asked for)
+        self.debug_log = None
+        if args.debug_log:
+            debug_log_path = os.path.join(SCRIPT_DIR, '.claude', f'proxy_debug_{name}.jsonl')
+            self.debug_log = DebugLog(debug_log_path, args.debug_log,
+                                      max_bytes=int(args.debug_log_max_mb * 1024 * 1024),
+                                      backups=args.debug_log_backups)
+            self.debug_log.info('START', command=command, pid=os.getpid())
+            self.say(f"Stdin debug log ({args.debug_log}): {debug_log_path}")
+
+        # Both directions of the PTY for proxy_record.py (off unless asked for)
+        self.recorder = None
+        if args.record:
+            record_path = os.path.join(SCRIPT_DIR, '.claude', f'proxy_record_{name}_{int(time.time())}.rec')
+            self.recorder = Recorder(record_path, PTY_ROWS, PTY_COLS, name=name, command=command)
+            self.say(f"Recording session to {record_path}")
+
+        # Idle/busy detection on the output (published to meta/state)
+        self.detector = None
+        if args.state:
+            self.detector = StateDetector(state_patterns(args.state_table, command), args.state_debounce)
+
+        # Raw output and screen for remote viewers, sent once the backend is up
+        self.publisher = None
+        if args.publish_output:
+            self.publisher = OutputPublisher(args.output_interval, args.output_chunk, keep=args.output_keep)
+        self.screen = None
+        if args.screen:
+            self.screen = ScreenPublisher(interval=args.screen_interval, snapshot_interval=args.screen_snapshot)
+
+        # Transcript messages, appended as the child writes them
+        self.tailer = None
+        if transcript_path:
+            self.tailer = TranscriptTailer(transcript_path, args.transcript_window,
+                                           page_size=args.transcript_page_size)
+            self.say(f"Following transcript {transcript_path}"
+                     f"{'' if self.tailer.inotify else ' (polling, no inotify)'}")
+
+        self.reaper = Reaper()
+        self.standby = StandbyPool([self.plan_command(True), self.plan_command(False)], self.env,
+                                   self.reaper, args.standby)
+        self.pacer = SubmitPacer(args.paste_delay, args.submit_delay, args.output_quiet,
+                                 wait_for_output=not args.fixed_delays, on_output=self.write_output,
+                                 debug_log=self.debug_log, recorder=self.recorder)
+        self.batcher = StdinBatcher(self.stdin_queue, args.batch_window, args.batch_max,
+                                    debug_log=self.debug_log)
+        self.plan_switcher = PlanSwitcher(PLAN_FLAG in command, quiet=args.output_quiet,
+                                          on_output=self.write_output, debug_log=self.debug_log,
+                                          recorder=self.recorder)
+
+    def say(self, message):
+        say(f"{self.tag} {message}")
+
+    def plan_command(self, plan):
+        """original_command with plan mode on or off"""
+        if plan:
+            return self.original_command
+        return self.original_command.replace(PLAN_FLAG, "")
+
+    # Listener side
+
+    def stdin_listener(self, event):
+        """Handle stdin input from Firebase"""
+        if event.data is None:
+            return
+
+        # Handle both single values and dictionaries
+        if isinstance(event.data, dict):
+            # Multiple entries (initial value, reconnect, patch). Consumed ones
+            # are pruned, so only pick out and sort the keys past the cursor.
+            entries = [(int(key), value) for key, value in event.data.items()
+                       if key.isdigit() and value is not None and int(key) > self.last_stdin_id]
+            for idx, value in sorted(entries):
+                # extract_value returns (value, send_enter, use_raw, urgent) tuple
                 extracted = extract_value(value)
-                if stdin_log:
-                    stdin_log.write(f"[{time.time():.3f}] FIREBASE_RECV (dict): idx={idx}, raw={repr(value)}, extracted={repr(extracted)}\n")
-                    stdin_log.flush()
-                stdin_queue.put(extracted)
-                last_stdin_id = idx
-    elif event.path != '/':
-        # Single entry added
+                if self.debug_log:
+                    self.debug_log.debug('FIREBASE_RECV', source='dict', idx=idx, raw=value,
+                                         extracted=extracted)
+                self.stdin_queue.put((idx, extracted))
+                self.last_stdin_id = idx
+            if entries:
+                self.wake()
+        elif event.path != '/':
+            # Single entry added
+            try:
+                idx = int(event.path.strip('/'))
+                if idx > self.last_stdin_id:
+                    # extract_value returns (value, send_enter, use_raw, urgent) tuple
+                    extracted = extract_value(event.data)
+                    if self.debug_log:
+                        self.debug_log.debug('FIREBASE_RECV', source='single', idx=idx, raw=event.data,
+                                             extracted=extracted)
+                    self.stdin_queue.put((idx, extracted))
+                    self.last_stdin_id = idx
+                    self.wake()
+            except ValueError:
+                pass
+
+    def plan_listener(self, event):
+        """Handle plan mode changes from Firebase"""
+        if event.data is None:
+            return
+
+        # Skip the initial listener event (fires on setup with current value)
+        if not self.plan_listener_initialized:
+            self.plan_listener_initialized = True
+            if self.debug_log:
+                self.debug_log.debug('PLAN_LISTENER_INIT', skipped=event.data)
+            return
+
+        # event.data will be True or False
+        plan_mode = bool(event.data)
+        if self.debug_log:
+            self.debug_log.info('PLAN_CHANGE', plan=plan_mode)
+
+        self.plan_changes.put(plan_mode)
+        self.wake()
+        self.say(f"Plan mode changed to: {plan_mode}")
+
+    def lease_listener(self, event):
+        """Notice another proxy taking the session's lease over, or note
+        who holds it while it isn't ours"""
+        if event.path == '/':
+            current = event.data
+        elif event.path.strip('/') == 'owner':
+            current = {'owner': event.data}
+        else:
+            return
+        if not self.lease.held:
+            self.lease.watch(current, time.time())
+        elif self.lease.observe(current):
+            self.wake()
+
+    def watch_lease(self):
+        """Listen to the lease record, at the session root whatever the generation"""
+        self.lease_listener_handle = self.transport.listen(LEASE_PATH, self.lease_listener)
+
+    # Session data
+
+    def ack_stdin(self, idx):
+        """Mark stdin entry idx as consumed. Entries are pruned in batches."""
+        self.stdin_acks.append(idx)
+        self.stdin_cursor = max(self.stdin_cursor, idx)
+        if len(self.stdin_acks) >= STDIN_ACK_BATCH:
+            self.flush_stdin_acks()
+
+    def flush_stdin_acks(self):
+        """Delete consumed stdin entries and save the cursor in one update, so
+        a --no-clear restart resumes after them instead of replaying"""
+        if not self.stdin_acks:
+            return
+        values = {f'stdin/{idx}': None for idx in self.stdin_acks}
+        values['meta/stdin_cursor'] = self.stdin_cursor
+        # Wait for room rather than drop it, or a restart would replay the
+        # entries; if the queue stays full they are kept for the next flush
+        if self.writer.update('', values, block=True):
+            self.stdin_acks.clear()
+
+    def reset_stdin_cursor(self):
+        """Forget stdin progress after the session data has been deleted"""
+        self.last_stdin_id = -1
+        self.stdin_cursor = -1
+        self.stdin_acks.clear()
+
+    def publish_teardowns(self, finished):
+        """Publish the last finished teardown at meta/teardown. One that
+        finishes before the backend is ready is kept until it is."""
+        for teardown in finished:
+            if self.debug_log:
+                self.debug_log.info('TEARDOWN', **teardown)
+            self.last_teardown = teardown
+        if self.last_teardown is not None and self.ready.is_set():
+            self.writer.update('meta', {'teardown': self.last_teardown})
+            self.last_teardown = None
+
+    def renew_lease(self):
+        """Renew the lease along with the heartbeat, or reclaim it if it may have lapsed"""
+        record = self.lease.renewal(time.time())
+        if record is not None:
+            self.writer.update('/meta', {'lease': record})
+        elif not self.lease.claim(self.transport):
+            self.lease.lost = True
+            self.wake()
+
+    def clear(self):
+        """Delete the session data, keeping the lease record if there is one"""
+        if self.lease:
+            self.writer.set('/', {'meta': {'lease': self.lease.record(time.time())}})
+        else:
+            self.writer.delete()
+
+    def meta(self, values):
+        """Meta record for a (re)started child. Where meta is also the lease's
+        home (the session root), it carries the lease over."""
+        values.update(self.extra_meta)
+        if self.lease and not self.writer.prefix:
+            values['lease'] = self.lease.record(time.time())
+        return values
+
+    def listen(self):
+        """Listen for stdin and plan changes in the active session. Events
+        still arriving from an earlier generation's listeners are dropped."""
+        old, base = self.listeners, self.writer.prefix
+
+        def active(callback):
+            def handler(event):
+                if self.writer.prefix == base:
+                    callback(event)
+            return handler
+
+        self.listeners = [
+            self.transport.listen(self.writer.path('stdin'), active(self.stdin_listener)),
+            self.transport.listen(self.writer.path('meta/plan'), active(self.plan_listener)),
+        ]
+        if old:
+            # Closing an SDK listener waits on its stream, keep that off the loop
+            threading.Thread(target=lambda: [listener.close() for listener in old],
+                             name='proxy-unlisten', daemon=True).start()
+
+    def reset(self):
+        """Start an empty session for a restart: switch to a new generation
+        with --generations, otherwise delete the session data"""
+        if self.generations is None:
+            self.clear()
+            return
+        self.generations.advance()
+        self.writer.prefix = self.generations.path
+        self.writer.set('/current', self.generations.pointer())
+        self.listen()
+        self.say(f"Session generation {self.generations.current} at "
+                 f"{self.transport.describe(self.generations.path)}")
+
+    def open(self, no_clear, started_at):
+        """Set the session up once the backend is connected (and the lease,
+        if any, is held): clear or resume it, listen for stdin and plan
+        changes and write the initial meta"""
+        self.reset_stdin_cursor()
+        self.plan_listener_initialized = False
+
+        # Start from an empty session unless --no-clear is set. With
+        # --generations that is the generation after the one 'current' names;
+        # otherwise previous output is deleted, and waited for so the
+        # listeners below don't replay stale stdin.
+        if self.args.generations:
+            pointer = self.transport.get('current')
+            gen = pointer.get('gen') if isinstance(pointer, dict) else None
+            if isinstance(gen, int) and gen >= 0:
+                self.generations = Generations(gen, pointer.get('oldest', gen), self.args.generations)
+            else:
+                self.generations = Generations(keep=self.args.generations)
+            if not no_clear or self.generations.current < 0:
+                self.generations.advance()
+            self.writer.prefix = self.generations.path
+            self.writer.set('/current', self.generations.pointer())
+            self.say(f"Session generation {self.generations.current} at "
+                     f"{self.transport.describe(self.generations.path)}")
+        elif not no_clear:
+            self.say(f"Clearing previous data at {self.transport.describe()}")
+            self.clear()
+            self.writer.flush()
+        if no_clear:
+            # Resume after the entries the previous run consumed
+            cursor = self.transport.get(self.writer.path('meta/stdin_cursor'))
+            if isinstance(cursor, int) and cursor >= 0:
+                self.last_stdin_id = self.stdin_cursor = cursor
+                self.say(f"Resuming stdin after entry {cursor}")
+        if self.timings:
+            self.timings.mark('clear')
+
+        # Set up stdin and plan mode listeners. Entries already written
+        # arrive with their first event and wait in stdin_queue.
+        self.listen()
+        self.say(f"Listening for stdin at {self.transport.describe(self.writer.path('stdin'))}/")
+        self.say(f"Listening for plan mode at {self.transport.describe(self.writer.path('meta/plan'))}")
+        if self.timings:
+            self.timings.mark('listen')
+
+        # Set initial metadata
+        self.writer.set('meta', self.meta({
+            'command': self.command,
+            'started_at': int(started_at * 1000),
+            'updated_at': int(time.time() * 1000),
+            'status': 'running',
+            'plan': PLAN_FLAG in self.command,
+            'stdin_cursor': self.stdin_cursor
+        }))
+        if self.timings:
+            self.timings.mark('backend')
+        if self.publisher:
+            if no_clear:
+                # Continue the previous run's records instead of overwriting them
+                previous = self.transport.get(self.writer.path('meta/output'))
+                if isinstance(previous, dict) and isinstance(previous.get('seq'), int):
+                    self.publisher.seq = previous['seq']
+            self.publisher.attach(self.writer)
+        if self.tailer:
+            self.tailer.attach(self.writer)
+        self.ready.set()
+
+    # Loop side
+
+    def start(self):
+        """Start the command on a PTY. Raises if it can't be spawned."""
+        self.say(f"Starting: {self.command}")
+        self.proc, self.fd = spawn_child(self.command, self.env)
+        self.exited_at = self.output_until = None
+        self.sel.register(self.fd, selectors.EVENT_READ, self)
+        self.standby.attach(self.sel, time.time())
+
+    def write_output(self, chunk):
+        (self.sink or stdout_buffer).write(chunk)
+
+    def flush_output(self):
+        (self.sink or stdout_buffer).flush()
+
+    def watched_output(self, chunk):
+        """PTY output, for the sink and everything that watches it"""
+        self.write_output(chunk)
+        if self.plan_switcher.active:
+            self.plan_switcher.feed(chunk)
+        self.pacer.feed(chunk)
+        if self.detector:
+            self.detector.feed(chunk)
+        if self.publisher:
+            self.publisher.feed(chunk)
+        if self.screen:
+            self.screen.feed(chunk)
+        if self.recorder:
+            self.recorder.output(chunk)
+
+    def next_deadline(self):
+        """When service() is due next without a wakeup or PTY output, or None"""
+        if self.output_until is not None:
+            return self.output_until
+        if self.pending_plan is not None and self.pacer.idle():
+            return time.time()
+        deadlines = [self.pacer.next_deadline(), self.plan_switcher.next_deadline(),
+                     self.standby.next_deadline(), self.reaper.next_deadline()]
+        if self.ready.is_set():
+            deadlines.append(self.detector.next_deadline() if self.detector else None)
+            deadlines.append(self.screen.next_deadline() if self.screen else None)
+        deadlines.append(self.recorder.next_deadline() if self.recorder else None)
+        if self.pacer.idle() and not self.plan_switcher.active:
+            deadlines.append(self.batcher.next_deadline())
+        return min((deadline for deadline in deadlines if deadline is not None), default=None)
+
+    def service(self, now, readable):
+        """One loop pass: plan changes, stdin, PTY output (`readable`) and
+        publishing. Returns False once the session is over: the child has
+        exited (and its last output was read), could not be restarted, or
+        the lease was taken over."""
+        if self.lease and self.lease.lost:
+            return False
+        self.standby.refill(now)
+        self.publish_teardowns(self.reaper.poll(now))
+
+        # Check for plan mode changes from Firebase
+        plan_restart_cmd = None
+        while True:
+            try:
+                plan_mode = self.plan_changes.get_nowait()
+            except queue.Empty:
+                break
+            self.plan_requested_at = time.time()
+            if self.args.plan_switch == 'keys':
+                # Switched in place once stdin is between entries
+                self.pending_plan = plan_mode
+            else:
+                # Original command, with --permission-mode plan
+                # removed when plan mode is disabled
+                plan_restart_cmd = self.plan_command(plan_mode)
+
+        # Drive an in-place plan switch, falling back to a restart when
+        # the program doesn't confirm it
+        plan_switcher = self.plan_switcher
         try:
-            idx = int(event.path.strip('/'))
-            if idx > last_stdin_id:
-                # extract_value returns (value, send_enter, use_raw) tuple
-                extracted = extract_value(event.data)
-                if stdin_log:
-                    stdin_log.write(f"[{time.time():.3f}] FIREBASE_RECV (single): idx={idx}, raw={repr(event.data)}, extracted={repr(extracted)}\n")
-                    stdin_log.flush()
-                stdin_queue.put(extracted)
-                last_stdin_id = idx
-        except ValueError:
-            pass
+            if plan_switcher.active:
+                now = time.time()
+                switched = plan_switcher.run(self.fd, now)
+                if switched:
+                    latency_ms = round((now - self.plan_requested_at) * 1000)
+                    self.say(f"Switched to plan={plan_switcher.plan} in place ({latency_ms} ms)")
+                    self.writer.update('meta', {
+                        'plan_switch': {'method': 'keys', 'latency_ms': latency_ms,
+                                        'presses': plan_switcher.pressed},
+                        'updated_at': int(time.time() * 1000)
+                    })
+                elif switched is False:
+                    self.say(f"Plan switch not confirmed after {plan_switcher.pressed} "
+                             f"Shift+Tab presses - restarting")
+                    plan_restart_cmd = self.plan_command(plan_switcher.target)
+            elif self.pending_plan is not None and self.pacer.idle():
+                if self.pending_plan != plan_switcher.plan:
+                    plan_switcher.start(self.pending_plan, self.fd, time.time())
+                self.pending_plan = None
+        except OSError as e:
+            self.say(f"Plan switch write error: {e} - restarting")
+            plan_restart_cmd = self.plan_command(plan_switcher.target if plan_switcher.active
+                                                 else self.pending_plan)
+
+        if plan_restart_cmd is not None:
+            self.say(f"Plan mode change - restarting with command: {plan_restart_cmd}")
+            if self.debug_log:
+                self.debug_log.info('PLAN_RESTART', command=plan_restart_cmd)
+            latency_ms = self.restart_child('plan', plan_restart_cmd, self.plan_requested_at)
+            if latency_ms is None:
+                return False
+            self.writer.update('meta', {'plan_switch': {'method': 'restart', 'latency_ms': latency_ms}})
+            return True
+
+        # Urgent stdin goes ahead of the entry being sent and everything
+        # queued, which waits for it (or is dropped with --urgent drop)
+        while True:
+            batch = self.batcher.take_urgent(time.time())
+            if batch is None:
+                break
+            self.ack_stdin(batch.ids[0])
+            if self.debug_log:
+                self.debug_log.info('URGENT', idx=batch.ids[0], stdin_data=batch.data)
+            if self.args.urgent == 'drop':
+                self.pacer.reset()
+                dropped = self.batcher.drop()
+                for idx in dropped:
+                    self.ack_stdin(idx)
+                if dropped:
+                    self.say(f"Dropped {len(dropped)} queued stdin entries for urgent input")
+            if batch.data is not None:
+                self.pacer.preempt(batch.data, batch.send_enter, batch.use_raw)
+
+        # Process any stdin from Firebase. Writes and settle waits are
+        # scheduled on the pacer so PTY output keeps draining meanwhile.
+        while True:
+            try:
+                if not self.pacer.run(self.fd, time.time()):
+                    break  # Waiting for the child to settle
+                if self.pending_plan is not None or plan_switcher.active:
+                    break  # A plan switch goes before the next entry
+
+                # Queued entries, merged where they can share a write
+                batch = self.batcher.take(time.time())
+                if batch is None:
+                    break
+                for idx in batch.ids:
+                    self.ack_stdin(idx)
+
+                if batch.data is not None:
+                    # Check for /clear command - triggers restart
+                    if batch.data == '/clear' and len(batch.ids) == 1:
+                        self.say("Received /clear - restarting process...")
+                        if self.debug_log:
+                            self.debug_log.info('CLEAR_COMMAND', idx=batch.ids[0])
+                        return self.restart_child('clear', self.command, time.time()) is not None
+
+                    # Send content - either raw or with bracketed paste
+                    self.pacer.schedule(batch.data, batch.send_enter, batch.use_raw, len(batch.ids))
+            except OSError as e:
+                self.say(f"Stdin write error: {e}")
+                self.pacer.reset()
+
+        if readable:
+            # Flush pending print() text first so ordering is kept
+            sys.stdout.flush()
+            watched = (plan_switcher.active or self.pacer.capturing or self.detector is not None
+                       or self.publisher is not None or self.screen is not None or self.recorder is not None)
+            nread = drain_pty(self.fd, self.watched_output if watched else self.write_output)
+            if nread < 0:
+                return False  # PTY closed
+            if nread:
+                self.pacer.note_output(time.time())
+                plan_switcher.note_output(time.time())
+                self.flush_output()
+                if self.timings:
+                    self.timings.mark('first_output')
+                if self.output_until is not None:
+                    self.output_until = time.time() + OUTPUT_EXIT_WAIT
+
+        # Once the process has exited, only drain what's left: its last
+        # output can arrive after the SIGCHLD wakeup, so wait for a quiet
+        # OUTPUT_EXIT_WAIT before giving up on it
+        if self.exited_at is None and self.proc.poll() is not None:
+            self.exited_at = time.time()
+            self.output_until = self.exited_at + OUTPUT_EXIT_WAIT
+        elif self.output_until is not None and time.time() >= self.output_until:
+            return False
+
+        if self.ready.is_set():
+            # Publish idle/busy state changes as they happen
+            if self.detector:
+                state = self.detector.poll(time.time())
+                if state is not None:
+                    self.writer.update('meta', {'state': state, 'state_at': int(time.time() * 1000)})
+                    if self.debug_log:
+                        self.debug_log.info('STATE', state=state)
+
+            # Publish what changed on the child's screen
+            if self.screen:
+                self.screen.publish(self.writer, time.time())
+        if self.recorder:
+            self.recorder.poll(time.time())
+        return True
+
+    def restart_child(self, reason, command, requested_at):
+        """Replace the child for a /clear or plan restart: retire it, start
+        an empty session and swap in a standby child running command (or
+        start it cold). Returns the restart's latency in ms, or None if
+        the new child could not be started."""
+        # Retire the current process; its group winds down while the
+        # replacement starts
+        self._unregister()
+        self.reaper.retire(self.proc, self.fd, reason)
+        self.proc = self.fd = None
+        self.say("Process stopping, restarting...")
+
+        # Reset stdin tracking and plan listener. The meta written below
+        # echoes back as a plan event, which must not be taken as another
+        # toggle.
+        self.reset_stdin_cursor()
+        self.plan_listener_initialized = False
+
+        # Drain any remaining items from the queues
+        self.pacer.reset()
+        self.batcher.reset()
+        if self.publisher:
+            self.publisher.reset()
+        if self.screen:
+            self.screen.reset()
+        if self.tailer:
+            self.tailer.reset()
+        while not self.plan_changes.empty():
+            try:
+                self.plan_changes.get_nowait()
+            except queue.Empty:
+                break
+
+        # Start an empty session, listening on it if it moved
+        self.reset()
+
+        self.command = command
+        plan = PLAN_FLAG in command
+        self.writer.set('meta', self.meta({
+            'command': command,
+            'started_at': int(time.time() * 1000),
+            'updated_at': int(time.time() * 1000),
+            'status': 'running',
+            'plan': plan
+        }))
+
+        # Swap in a standby child, or start the command again
+        swap_start = time.time()
+        try:
+            self.proc, self.fd, early_output = self.standby.start(command)
+        except Exception as e:
+            self.say(f"Failed to restart: {e}")
+            self.exit_code = 1
+            self.writer.update('meta', {
+                'status': 'error',
+                'updated_at': int(time.time() * 1000),
+                'error': str(e)
+            })
+            return None
+        self.exited_at = self.output_until = None
+        self.sel.register(self.fd, selectors.EVENT_READ, self)
+        if self.recorder:
+            self.recorder.mark(restart=reason, command=command)
+        if self.detector:
+            self.detector.reset()
+        if early_output:
+            sys.stdout.flush()
+            self.watched_output(early_output)
+            self.flush_output()
+        self.plan_switcher.reset(plan)
+        self.pending_plan = None
+
+        latency_ms = round((time.time() - requested_at) * 1000)
+        self.writer.update('meta', {
+            'restart': {'reason': reason, 'standby': early_output is not None,
+                        'swap_ms': round((time.time() - swap_start) * 1000, 1),
+                        'latency_ms': latency_ms}
+        })
+        self.say(f"Process restarted ({reason}, plan={plan}, {latency_ms} ms)")
+        if self.sink is None:
+            say("-" * 40)
+        return latency_ms
+
+    def heartbeat(self, now):
+        """Periodic meta update, once the backend is up: prune consumed
+        stdin, publish stats, renew the lease and drop old generations"""
+        if not self.ready.is_set():
+            return
+        self.flush_stdin_acks()
+        heartbeat = {
+            'updated_at': int(now * 1000),
+            'writer': self.writer.stats(),
+            'batching': self.batcher.stats(),
+            'standby': self.standby.stats(),
+            'reaper': self.reaper.stats()
+        }
+        if self.publisher:
+            heartbeat['output'] = self.publisher.stats()
+        if self.screen:
+            heartbeat['screen'] = self.screen.stats()
+        if self.recorder:
+            heartbeat['recording'] = self.recorder.stats()
+        if self.tailer:
+            heartbeat['transcript'] = self.tailer.stats()
+        self.writer.update('meta', heartbeat)
+        if self.lease:
+            self.renew_lease()
+        if self.generations:
+            self.generations.collect(self.writer)
+
+    def finish(self):
+        """The child is done: wait for it, clear out anything it left running
+        in its process group and publish the final status. Returns the exit
+        code."""
+        self._unregister()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.standby.close()
+        if self.proc is not None:
+            self.exit_code = self.proc.wait()
+            self.reaper.retire(self.proc, reason='exit')
+            self.proc = None
+
+        # Update final status
+        status = 'completed' if self.exit_code == 0 else 'error'
+        self.say(f"Process exited with code {self.exit_code} ({status})")
+        if self.timings:
+            self.timings.report(force=True)
+        if self.publisher:
+            self.publisher.close()
+        if self.tailer:
+            self.tailer.close()
+        if self.recorder:
+            self.recorder.close()
+        self.flush_stdin_acks()
+        self.writer.update('meta', {
+            'status': status,
+            'exit_code': self.exit_code,
+            'updated_at': int(time.time() * 1000)
+        }, block=True)
+        if self.lease:
+            self.writer.delete(f'/{LEASE_PATH}')
+        return self.exit_code
+
+    def stop(self, reason):
+        """Retire the child without publishing anything, the session's data
+        being no longer ours to write (or unreachable)"""
+        self._unregister()
+        if self.proc is not None:
+            self.reaper.retire(self.proc, self.fd, reason)
+        self.proc = self.fd = None
+        self.standby.close()
+        self.pacer.reset()
+        self.batcher.reset()
+        self.stdin_acks.clear()
+
+    def release(self):
+        """Another proxy took the lease over: stop, leaving the session's
+        data to its new owner"""
+        owner = self.lease.seen.get('owner') if isinstance(self.lease.seen, dict) else None
+        self.say(f"Lease taken over by {owner}, stopping")
+        self.stop('lease lost')
+
+    def interrupt(self):
+        """Ctrl+C or SIGTERM: retire the child and mark the session
+        interrupted (unless another proxy owns it now). Returns True if
+        the status was queued on the writer."""
+        if self.fd is not None:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+            self.fd = None
+        if self.proc is not None:
+            self.reaper.retire(self.proc, reason='interrupt')
+            self.proc = None
+        self.standby.close()
+
+        if self.recorder:
+            try:
+                self.recorder.close()
+            except RuntimeError:
+                pass  # Signal arrived mid-record; readers stop at the last whole one
+
+        if self.writer is None or (self.lease is not None and not self.lease.held):
+            return False
+        if self.publisher:
+            self.publisher.close()
+        if self.tailer:
+            self.tailer.close()
+        self.flush_stdin_acks()
+        self.writer.update('meta', {
+            'status': 'interrupted',
+            'updated_at': int(time.time() * 1000)
+        }, block=True)
+        if self.lease:
+            self.writer.delete(f'/{LEASE_PATH}')  # Hand over to a waiting proxy at once
+        return True
+
+    def close(self):
+        """Wait for every retired process group and close the debug log"""
+        self.standby.close()
+        self.reaper.finish()
+        if self.debug_log:
+            self.debug_log.close()
+
+    def _unregister(self):
+        if self.fd is None:
+            return
+        try:
+            self.sel.unregister(self.fd)
+        except (KeyError, ValueError):
+            pass  # Not registered, or the selector is closed
+
+
+def add_session_arguments(parser):
+    """Options for how each session is run, shared with proxy_supervisor.py"""
+    parser.add_argument(
+        '--paste-delay',
+        type=float,
+        default=PASTE_SETTLE_MAX,
+        help=f'Max seconds to wait after a paste before Enter (default: {PASTE_SETTLE_MAX})'
+    )
+    parser.add_argument(
+        '--submit-delay',
+        type=float,
+        default=SUBMIT_SETTLE_MAX,
+        help=f'Max seconds to wait after Enter before the next input (default: {SUBMIT_SETTLE_MAX})'
+    )
+    parser.add_argument(
+        '--output-quiet',
+        type=float,
+        default=OUTPUT_QUIET,
+        help=f'Seconds of output silence that end a wait early (default: {OUTPUT_QUIET})'
+    )
+    parser.add_argument(
+        '--fixed-delays',
+        action='store_true',
+        help='Always wait the full paste/submit delays instead of watching output'
+    )
+    parser.add_argument(
+        '--batch-window',
+        type=float,
+        default=STDIN_BATCH_WINDOW,
+        help='Seconds a run of queued :noenter entries waits for the rest before it is sent; '
+             'entries already queued are merged even at 0, unless --batch-max is 0 '
+             f'(default: {STDIN_BATCH_WINDOW})'
+    )
+    parser.add_argument(
+        '--batch-max',
+        type=int,
+        default=STDIN_BATCH_MAX,
+        help='Most bytes merged from consecutive stdin entries of the same mode (pasted or '
+             f':raw) into one write; 0 sends each entry on its own (default: {STDIN_BATCH_MAX})'
+    )
+    parser.add_argument(
+        '--urgent',
+        choices=['defer', 'drop'],
+        default='defer',
+        help='What urgent stdin (entries flagged :urgent, or Ctrl+C/Escape sent :raw) does to '
+             'input still queued: send it afterwards, or drop it (default: defer)'
+    )
+    parser.add_argument(
+        '--state-patterns',
+        help='JSON file of idle/busy/awaiting-permission/awaiting-choice markers per command '
+             'name, {"claude": {"busy": ["esc to interrupt"], ...}, "*": ...} '
+             '(default: built-in markers for Claude Code)'
+    )
+    parser.add_argument(
+        '--state-debounce',
+        type=float,
+        default=STATE_DEBOUNCE,
+        help=f'Seconds a detected state must hold before it is published to meta/state '
+             f'(default: {STATE_DEBOUNCE})'
+    )
+    parser.add_argument(
+        '--state',
+        action='store_true',
+        help='Watch the output for the idle/busy state and publish it to meta/state (default: off)'
+    )
+    parser.add_argument(
+        '--publish-output',
+        action='store_true',
+        help='Publish the raw terminal output to output/{seq} for remote viewers (default: off)'
+    )
+    parser.add_argument(
+        '--output-interval',
+        type=float,
+        default=OUTPUT_PUBLISH_INTERVAL,
+        help=f'Seconds output is collected before it is published as one record '
+             f'(default: {OUTPUT_PUBLISH_INTERVAL})'
+    )
+    parser.add_argument(
+        '--output-chunk',
+        type=int,
+        default=OUTPUT_PUBLISH_CHUNK,
+        help=f'Most bytes per published output record; a full one goes at once '
+             f'(default: {OUTPUT_PUBLISH_CHUNK})'
+    )
+    parser.add_argument(
+        '--output-keep',
+        type=int,
+        default=OUTPUT_PUBLISH_KEEP,
+        help=f'Published output records kept in the session (default: {OUTPUT_PUBLISH_KEEP})'
+    )
+    parser.add_argument(
+        '--screen',
+        action='store_true',
+        help='Keep a model of the child\'s screen and publish row diffs and snapshots to screen/ (default: off)'
+    )
+    parser.add_argument(
+        '--screen-interval',
+        type=float,
+        default=SCREEN_INTERVAL,
+        help=f'Seconds between published screen diffs while it changes (default: {SCREEN_INTERVAL})'
+    )
+    parser.add_argument(
+        '--screen-snapshot',
+        type=float,
+        default=SCREEN_SNAPSHOT_INTERVAL,
+        help=f'Seconds between full screen snapshots for late-joining viewers '
+             f'(default: {SCREEN_SNAPSHOT_INTERVAL})'
+    )
+    parser.add_argument(
+        '--transcript-window',
+        type=float,
+        default=TRANSCRIPT_BATCH_WINDOW,
+        help=f'Seconds new transcript messages are collected into one update '
+             f'(default: {TRANSCRIPT_BATCH_WINDOW})'
+    )
+    parser.add_argument(
+        '--transcript-page-size',
+        type=int,
+        default=TRANSCRIPT_PAGE_SIZE,
+        help=f'Transcript messages per page under transcript/pages/ (default: {TRANSCRIPT_PAGE_SIZE})'
+    )
+    parser.add_argument(
+        '--record',
+        action='store_true',
+        help='Record PTY output and input to .claude/proxy_record_{name}_{time}.rec for '
+             'proxy_record.py to replay (default: off)'
+    )
+    parser.add_argument(
+        '--debug-log',
+        choices=list(DEBUG_LOG_LEVELS),
+        help='Write a JSONL stdin debug log to .claude/proxy_debug_{name}.jsonl at this level (default: off)'
+    )
+    parser.add_argument(
+        '--debug-log-max-mb',
+        type=float,
+        default=DEBUG_LOG_MAX_MB,
+        help=f'Rotate the debug log once it reaches this size (default: {DEBUG_LOG_MAX_MB})'
+    )
+    parser.add_argument(
+        '--debug-log-backups',
+        type=int,
+        default=DEBUG_LOG_BACKUPS,
+        help=f'Rotated debug logs to keep (default: {DEBUG_LOG_BACKUPS})'
+    )
+    parser.add_argument(
+        '--standby',
+        type=int,
+        default=0,
+        help='Idle pre-spawned children kept per command variant (plan and non-plan) for '
+             'instant /clear and plan restarts; each is a full copy of the program in '
+             'memory (default: 0)'
+    )
+    parser.add_argument(
+        '--plan-switch',
+        choices=['restart', 'keys'],
+        default='restart',
+        help='How to apply meta/plan changes: restart the command, or press Shift+Tab in '
+             'the running program and restart only if the switch is not confirmed (default: restart)'
+    )
+    parser.add_argument(
+        '--generations',
+        type=int,
+        default=0,
+        help='Write each fresh session under gen/{n} behind a "current" pointer and keep this '
+             'many generations, so a reset is one small write instead of a delete; 0 deletes '
+             'the session data instead (default: 0)'
+    )
+
+
+def acquire_lease(wait):
+    """Block until the session's lease is ours. Without wait, exit as soon
+    as its owner is seen renewing it."""
+    lease, transport = session.lease, session.transport
+    first = None
+    while not lease.claim(transport):
+        owner = lease.seen.get('owner') if isinstance(lease.seen, dict) else None
+        if first is None:
+            first = lease.seen
+            say(f"[proxy] Session is leased by {owner}; taking over if the lease "
+                f"is not renewed within {lease.ttl}s")
+        elif lease.seen != first and not wait:
+            say(f"[proxy] ERROR: Session is in use by {owner} (use --lease-wait to stand by)")
+            transport.close()
+            sys.exit(1)
+        time.sleep(LEASE_POLL_INTERVAL)
+    say(f"[proxy] Holding the session lease as {lease.owner} (ttl {lease.ttl}s)")
+
+
+def setup_backend(args, started_at, lease_ready):
+    """Connect the session backend while the child starts: take the lease
+    (then set lease_ready) and open the session. Sets backend_error to an
+    exit code if that failed."""
+    global backend_error
+    name = session.name
+    try:
+        if args.transport == 'local':
+            transport = LocalTransport(name, args.socket or default_socket_path(name))
+            say(f"[proxy] Serving local session on {transport.socket_path}")
+        elif args.transport == 'fake':
+            from proxy_fakedb import FakeDatabase, FakeFirebaseTransport
+            fake_db = FakeDatabase(args.fake_latency, args.fake_jitter, args.fake_seed)
+            transport = FakeFirebaseTransport(name, args.socket or default_socket_path(name), fake_db)
+            say(f"[proxy] Using offline Firebase stand-in (latency {args.fake_latency}s, "
+                f"jitter {args.fake_jitter}s), served on {transport.socket_path}")
+        elif args.transport == 'shared':
+            from proxy_fakedb import RemoteDatabase
+            socket_path = args.socket or default_socket_path('fakedb')
+            transport = FirebaseTransport(name, database=RemoteDatabase(socket_path))
+            say(f"[proxy] Using shared stand-in on {socket_path}")
+        else:
+            transport = FirebaseTransport(name, args.service_account, DATABASE_URL)
+            say("[proxy] Initializing Firebase...")
+        session.transport = transport
+        transport.connect()
+        session.writer = BackgroundWriter(transport)
+        if timings:
+            timings.mark('connect')
+
+        # Take the session's lease before touching its data
+        if args.lease_ttl:
+            session.lease = Lease(args.owner, args.lease_ttl)
+            acquire_lease(args.lease_wait)
+            session.watch_lease()
+            if timings:
+                timings.mark('lease')
+        lease_ready.set()
+
+        session.open(args.no_clear, started_at)
+    except SystemExit as e:
+        backend_error = e.code
+    except Exception as e:
+        say(f"[proxy] ERROR: Backend setup failed: {e}")
+        backend_error = 1
+    finally:
+        lease_ready.set()
+        wake_main_loop()
 
 
 def main():
-    global proc, ref, master_fd, last_stdin_id, stdin_log, original_command, plan_listener_initialized
+    global session, wakeup_r, wakeup_w, stdout_buffer, timings
+    started_at = time.time()
 
     # Parse command line arguments
     parser = argparse.ArgumentParser(
@@ -195,19 +3284,93 @@ def main():
         action='store_true',
         help='Do not clear previous output before starting'
     )
+    parser.add_argument(
+        '--transport',
+        choices=['firebase', 'local', 'fake', 'shared'],
+        default='firebase',
+        help='Session backend: Firebase RTDB, an in-memory local socket, the offline '
+             'Firebase stand-in, or a stand-in shared with other proxies (default: firebase)'
+    )
+    parser.add_argument(
+        '--socket',
+        help='Unix socket path for --transport local/fake (default: .claude/proxy_{name}.sock), '
+             'or of the stand-in for --transport shared (default: .claude/proxy_fakedb.sock)'
+    )
+    parser.add_argument(
+        '--lease-ttl',
+        type=float,
+        default=0,
+        help='Hold a lease on the session, renewed with the heartbeat and taken over by '
+             f'others after this many seconds without renewal; must exceed '
+             f'{2 * META_UPDATE_INTERVAL} (default: 0, no lease)'
+    )
+    parser.add_argument(
+        '--lease-wait',
+        action='store_true',
+        help='Stand by while another proxy holds the lease, instead of exiting'
+    )
+    parser.add_argument(
+        '--owner',
+        default=f'{os.uname().nodename}:{os.getpid()}',
+        help='Lease owner id (default: hostname:pid)'
+    )
+    parser.add_argument(
+        '--fake-latency',
+        type=float,
+        default=0.0,
+        help='Simulated network delay in seconds for --transport fake (default: 0)'
+    )
+    parser.add_argument(
+        '--fake-jitter',
+        type=float,
+        default=0.0,
+        help='Extra random delay of up to this many seconds for --transport fake (default: 0)'
+    )
+    parser.add_argument(
+        '--fake-seed',
+        type=int,
+        help='Random seed for --transport fake jitter'
+    )
+    add_session_arguments(parser)
+    parser.add_argument(
+        '--transcript',
+        action='store_true',
+        help='Publish the messages Claude Code appends to its JSONL transcript for this directory '
+             '(default: off; leave the status_line.py hook off with it)'
+    )
+    parser.add_argument(
+        '--transcript-path',
+        help='Transcript file to follow, or a directory whose newest .jsonl file is followed; '
+             'implies --transcript (default: ~/.claude/projects/{current directory})'
+    )
+    parser.add_argument(
+        '--timings',
+        action='store_true',
+        help='Print how long startup took, from argument parsing to the first child output '
+             'and the backend being ready (default: off)'
+    )
 
     args = parser.parse_args()
-    original_command = args.command  # Store original command with all flags
     command = args.command
     name = args.name
+    if args.timings:
+        timings = StartupTimings(started_at)
+        timings.mark('args')
 
-    # Set up stdin debug log
-    stdin_log_path = os.path.join(SCRIPT_DIR, '.claude', f'stdin_debug_{name}.log')
-    stdin_log = open(stdin_log_path, 'w')
-    print(f"[proxy] Stdin debug log: {stdin_log_path}")
+    if args.lease_ttl and args.lease_ttl <= 2 * META_UPDATE_INTERVAL:
+        parser.error(f'--lease-ttl must exceed {2 * META_UPDATE_INTERVAL} seconds')
+
+    # Idle/busy markers for --state
+    args.state_table = None
+    if args.state and args.state_patterns:
+        try:
+            args.state_table = load_state_patterns(args.state_patterns)
+        except (OSError, ValueError) as e:
+            print(f"[proxy] ERROR: Cannot use state patterns {args.state_patterns}: {e}")
+            sys.exit(1)
 
     # Validate service account file exists
-    if not os.path.exists(args.service_account):
+    if args.transport == 'firebase' and not os.path.exists(args.service_account):
         print(f"[proxy] ERROR: Service account file not found: {args.service_account}")
         print("[proxy] Please download it from Firebase Console:")
         print("  1. Go to Firebase Console > Project Settings > Service Accounts")
@@ -219,393 +3382,118 @@ def main():
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
-    # Initialize Firebase
-    print(f"[proxy] Initializing Firebase...")
-    try:
-        cred = credentials.Certificate(args.service_account)
-        firebase_admin.initialize_app(cred, {
-            'databaseURL': DATABASE_URL
-        })
-    except ValueError:
-        # App already initialized (e.g., in testing)
-        pass
-
-    # Get reference to shell path
-    ref = db.reference(f'/shell/{name}')
-
-    # Clear previous output unless --no-clear is set
-    if not args.no_clear:
-        print(f"[proxy] Clearing previous data at /shell/{name}")
-        ref.delete()
-
-    # Set up stdin listener
-    stdin_ref = ref.child('stdin')
-    stdin_ref.listen(stdin_listener)
-    print(f"[proxy] Listening for stdin at /shell/{name}/stdin/")
-
-    # Set up plan mode listener
-    plan_ref = ref.child('meta/plan')
-    plan_ref.listen(plan_listener)
-    print(f"[proxy] Listening for plan mode at /shell/{name}/meta/plan")
-
-    # Set initial metadata
-    print(f"[proxy] Starting: {command}")
-    ref.child('meta').set({
-        'command': command,
-        'started_at': int(time.time() * 1000),
-        'updated_at': int(time.time() * 1000),
-        'status': 'running',
-        'plan':True
-    })
-
-    # Create a pseudo-terminal so interactive programs work
-    master_fd, slave_fd = pty.openpty()
-
-    # Set up terminal size (80x24 is standard)
-    winsize = struct.pack('HHHH', 24, 80, 0, 0)
-    fcntl.ioctl(slave_fd, termios.TIOCSWINSZ, winsize)
-
-    # Use full raw mode to disable all terminal processing
-    # This ensures input bytes pass through exactly as sent
+    # Self-pipe for waking the main loop. Listener threads write to it when
+    # they queue input, and SIGCHLD is routed to it so child exit is seen at once.
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.set_wakeup_fd(wakeup_w)
+    sel = selectors.DefaultSelector()
+    sel.register(wakeup_r, selectors.EVENT_READ, 'wakeup')
+
+    transcript_path = None
+    if args.transcript or args.transcript_path:
+        transcript_path = args.transcript_path or claude_projects_dir()
+    session = ProxySession(name, command, args, sel, wake_main_loop, transcript_path=transcript_path)
+    if timings:
+        timings.debug_log = session.debug_log
+        session.timings = timings
+
+    # Connect the backend on its own thread while the child starts. The
+    # child waits only for the lease, when there is one.
+    lease_ready = threading.Event()
+    backend_thread = threading.Thread(target=setup_backend, args=(args, started_at, lease_ready),
+                                      name='proxy-backend', daemon=True)
+    backend_thread.start()
+    if args.lease_ttl:
+        lease_ready.wait()
+        if backend_error is not None:
+            backend_thread.join()
+            sys.exit(backend_error)
+
+    # Run the command on a pseudo-terminal so interactive programs work.
+    # Until setup is done the backend thread prints too, hence say().
     try:
-        tty.setraw(slave_fd)
-        # Re-apply window size after setraw (it may have been cleared)
-        fcntl.ioctl(slave_fd, termios.TIOCSWINSZ, winsize)
-        print("[proxy] Set PTY to full raw mode")
-    except Exception as e:
-        print(f"[proxy] Warning: Could not set raw mode: {e}")
-
-    # Set up environment for proper terminal emulation
-    env = os.environ.copy()
-    env['TERM'] = 'xterm-256color'
-    env['COLORTERM'] = 'truecolor'
-    env['COLUMNS'] = '80'
-    env['LINES'] = '24'
-    env['CLAUDE_PROXY_SHELL'] = name
-
-    # Run the command with PTY
-    try:
-        proc = subprocess.Popen(
-            command,
-            shell=True,
-            stdin=slave_fd,
-            stdout=slave_fd,
-            stderr=slave_fd,
-            close_fds=True,
-            start_new_session=True,
-            env=env
-        )
-        os.close(slave_fd)  # Close slave in parent, child has it
+        session.start()
     except Exception as e:
         print(f"[proxy] Failed to start process: {e}")
-        os.close(master_fd)
-        os.close(slave_fd)
-        ref.child('meta').update({
-            'status': 'error',
-            'updated_at': int(time.time() * 1000),
-            'error': str(e)
-        })
+        backend_thread.join()
+        if backend_error is None:
+            session.writer.update('meta', {
+                'status': 'error',
+                'updated_at': int(time.time() * 1000),
+                'error': str(e)
+            }, block=True)
+            session.writer.flush()
         sys.exit(1)
+    if timings:
+        timings.mark('spawn')
 
-    print(f"[proxy] Process started, PTY connected")
-    print("-" * 40)
+    say("[proxy] Process started, PTY connected")
+    stdout_buffer = stdout_sink()
+    say("-" * 40)
+    if args.standby:
+        print(f"[proxy] Keeping {args.standby} standby child(ren) per command variant")
 
     # Main loop - read PTY output and handle stdin from Firebase
     last_meta_update = time.time()
     try:
         while True:
-            # Check if process is still running
-            ret = proc.poll()
-
-            # Use select to check if there's data to read
-            ready, _, _ = select.select([master_fd], [], [], 0.1)
-
-            # Check for plan mode changes from Firebase
-            plan_restart_cmd = None
-            while not plan_change_queue.empty():
-                try:
-                    plan_mode = plan_change_queue.get_nowait()
-                    if plan_mode:
-                        # Plan mode enabled - use original command
-                        plan_restart_cmd = original_command
-                    else:
-                        # Plan mode disabled - remove --permission-mode plan
-                        plan_restart_cmd = original_command.replace(" --permission-mode plan", "")
-                except queue.Empty:
-                    break
-
-            if plan_restart_cmd is not None:
-                print(f"[proxy] Plan mode change - restarting with command: {plan_restart_cmd}")
-                stdin_log.write(f"[{time.time():.3f}] PLAN_RESTART: cmd={repr(plan_restart_cmd)}\n")
-                stdin_log.flush()
-
-                # Terminate current process
-                os.close(master_fd)
-                master_fd = None
-                proc.terminate()
-                try:
-                    proc.wait(timeout=5)
-                except subprocess.TimeoutExpired:
-                    proc.kill()
-                    proc.wait()
-
-                print(f"[proxy] Process terminated, restarting with new command...")
-
-                # Clear previous output in Firebase
-                ref.delete()
-
-                # Reset stdin tracking
-                last_stdin_id = -1
-
-                # Drain any remaining items from the queues
-                while not stdin_queue.empty():
-                    try:
-                        stdin_queue.get_nowait()
-                    except queue.Empty:
-                        break
-
-                # Update command for this restart
-                command = plan_restart_cmd
-
-                # Determine plan mode from the command
-                is_plan_mode = " --permission-mode plan" in command
-
-                # Set initial metadata again
-                ref.child('meta').set({
-                    'command': command,
-                    'started_at': int(time.time() * 1000),
-                    'updated_at': int(time.time() * 1000),
-                    'status': 'running',
-                    'plan': is_plan_mode
-                })
-
-                # Create new PTY
-                master_fd, slave_fd = pty.openpty()
-                winsize = struct.pack('HHHH', 24, 80, 0, 0)
-                fcntl.ioctl(slave_fd, termios.TIOCSWINSZ, winsize)
-                try:
-                    tty.setraw(slave_fd)
-                    fcntl.ioctl(slave_fd, termios.TIOCSWINSZ, winsize)
-                except Exception as e:
-                    print(f"[proxy] Warning: Could not set raw mode: {e}")
-
-                # Restart the process with new command
-                proc = subprocess.Popen(
-                    command,
-                    shell=True,
-                    stdin=slave_fd,
-                    stdout=slave_fd,
-                    stderr=slave_fd,
-                    close_fds=True,
-                    start_new_session=True,
-                    env=env
-                )
-                os.close(slave_fd)
-
-                print(f"[proxy] Process restarted with plan={is_plan_mode}")
-                print("-" * 40)
-                last_meta_update = time.time()
-                continue
-
-            # Process any stdin from Firebase
-            restart_requested = False
-            while not stdin_queue.empty():
-                try:
-                    # extract_value returns (value, send_enter, use_raw) tuple
-                    stdin_tuple = stdin_queue.get_nowait()
-                    if isinstance(stdin_tuple, tuple):
-                        if len(stdin_tuple) == 3:
-                            stdin_data, send_enter, use_raw = stdin_tuple
-                        else:
-                            stdin_data, send_enter = stdin_tuple
-                            use_raw = False
-                    else:
-                        stdin_data, send_enter, use_raw = stdin_tuple, True, False
-
-                    # Log raw tuple from queue
-                    stdin_log.write(f"[{time.time():.3f}] QUEUE_GET: stdin_data={repr(stdin_data)}, send_enter={send_enter}, use_raw={use_raw}\n")
-                    stdin_log.flush()
-
-                    if stdin_data:
-                        # Strip any existing newlines from the data
-                        stdin_data = stdin_data.rstrip('\r\n')
-
-                        # Check for /clear command - triggers restart
-                        if stdin_data == '/clear':
-                            print(f"[proxy] Received /clear - restarting process...")
-                            stdin_log.write(f"[{time.time():.3f}] CLEAR_COMMAND\n")
-                            stdin_log.flush()
-                            restart_requested = True
-                            break
-
-                        # Send content - either raw or with bracketed paste
-                        if use_raw:
-                            # Send raw bytes without bracketed paste
-                            raw_bytes = stdin_data.encode('utf-8')
-                            stdin_log.write(f"[{time.time():.3f}] SENDING_RAW: {repr(raw_bytes)}\n")
-                            stdin_log.flush()
-                            os.write(master_fd, raw_bytes)
-                        else:
-                            # Send as bracketed paste:
-                            # \x1b[200~ = start paste
-                            # \x1b[201~ = end paste
-                            paste_start = b'\x1b[200~'
-                            paste_end = b'\x1b[201~'
-                            paste_bytes = paste_start + stdin_data.encode('utf-8') + paste_end
-                            stdin_log.write(f"[{time.time():.3f}] SENDING_PASTE: {repr(paste_bytes)}\n")
-                            stdin_log.flush()
-                            os.write(master_fd, paste_bytes)
-
-                        # Wait for content to be processed
-                        time.sleep(0.1)
-
-                        # Only send Enter if not suppressed by :noenter flag
-                        if send_enter:
-                            stdin_log.write(f"[{time.time():.3f}] SENDING_ENTER: b'\\r'\n")
-                            stdin_log.flush()
-                            os.write(master_fd, b'\r')
-                            stdin_log.write(f"[{time.time():.3f}] ENTER_SENT\n")
-                            stdin_log.flush()
-                            mode_str = "raw" if use_raw else "bracketed paste"
-                            print(f"[proxy] Sent stdin as {mode_str} + Enter: {repr(stdin_data)}")
-                            # Give Claude Code time to process Enter before next input
-                            time.sleep(0.5)
-                            stdin_log.write(f"[{time.time():.3f}] POST_ENTER_DELAY_DONE\n")
-                            stdin_log.flush()
-                        else:
-                            stdin_log.write(f"[{time.time():.3f}] NO_ENTER (noenter flag)\n")
-                            stdin_log.flush()
-                            mode_str = "raw" if use_raw else "bracketed paste"
-                            print(f"[proxy] Sent stdin as {mode_str} (no Enter): {repr(stdin_data)}")
-                            # Give Claude Code time to process before next input
-                            # This is especially important for "Other" option selections
-                            # which need time to render the custom text input field
-                            time.sleep(0.5)
-                            stdin_log.write(f"[{time.time():.3f}] POST_NOENTER_DELAY_DONE\n")
-                            stdin_log.flush()
-                except queue.Empty:
-                    break
-                except OSError as e:
-                    print(f"[proxy] Stdin write error: {e}")
-
-            # Handle restart if /clear was received
-            if restart_requested:
-                # Terminate current process
-                os.close(master_fd)
-                master_fd = None
-                proc.terminate()
-                try:
-                    proc.wait(timeout=5)
-                except subprocess.TimeoutExpired:
-                    proc.kill()
-                    proc.wait()
-
-                print(f"[proxy] Process terminated, restarting...")
-
-                # Clear previous output in Firebase
-                ref.delete()
-
-                # Reset stdin tracking and plan listener
-                last_stdin_id = -1
-                plan_listener_initialized = False
-
-                # Drain any remaining items from the queues
-                while not stdin_queue.empty():
-                    try:
-                        stdin_queue.get_nowait()
-                    except queue.Empty:
-                        break
-                while not plan_change_queue.empty():
-                    try:
-                        plan_change_queue.get_nowait()
-                    except queue.Empty:
-                        break
-
-                # Re-listen for stdin (previous listener still active on same ref)
-
-                # Set initial metadata again
-                ref.child('meta').set({
-                    'command': command,
-                    'started_at': int(time.time() * 1000),
-                    'updated_at': int(time.time() * 1000),
-                    'status': 'running',
-                    'plan': True
-                })
-
-                # Create new PTY
-                master_fd, slave_fd = pty.openpty()
-                winsize = struct.pack('HHHH', 24, 80, 0, 0)
-                fcntl.ioctl(slave_fd, termios.TIOCSWINSZ, winsize)
-                try:
-                    tty.setraw(slave_fd)
-                    fcntl.ioctl(slave_fd, termios.TIOCSWINSZ, winsize)
-                except Exception as e:
-                    print(f"[proxy] Warning: Could not set raw mode: {e}")
-
-                # Restart the process
-                proc = subprocess.Popen(
-                    command,
-                    shell=True,
-                    stdin=slave_fd,
-                    stdout=slave_fd,
-                    stderr=slave_fd,
-                    close_fds=True,
-                    start_new_session=True,
-                    env=env
-                )
-                os.close(slave_fd)
-
-                print(f"[proxy] Process restarted")
-                print("-" * 40)
-                last_meta_update = time.time()
-                continue
-
-            if ready:
-                try:
-                    data = os.read(master_fd, 4096)
-                    if not data:
-                        break
-                    # Just print locally - statusline hook handles Firebase
-                    text = data.decode('utf-8', errors='replace')
-                    sys.stdout.write(text)
-                    sys.stdout.flush()
-                except OSError as e:
-                    if e.errno == errno.EIO:
-                        break  # PTY closed
-                    raise
-
-            # Update meta periodically (every 5 seconds)
-            if time.time() - last_meta_update > 5:
-                ref.child('meta').update({
-                    'updated_at': int(time.time() * 1000)
-                })
+            # Block until PTY output, a listener/SIGCHLD wakeup or the next
+            # heartbeat is due
+            timeout = max(0, last_meta_update + META_UPDATE_INTERVAL - time.time())
+            deadline = session.next_deadline()
+            if deadline is not None:
+                timeout = min(timeout, max(0, deadline - time.time()))
+            readable = False
+            for key, _ in sel.select(timeout):
+                if key.data == 'wakeup':
+                    drain_wakeup_pipe()
+                elif key.data is session:
+                    readable = True
+                else:
+                    pool, child = key.data
+                    pool.drain(child)
+            if backend_error is not None:
+                break  # No backend
+            if not session.service(time.time(), readable):
+                break  # Child exited, or another proxy owns the session now
+            if timings and session.ready.is_set():
+                timings.report()
+
+            # Update meta periodically (every 5 seconds), once the backend is up
+            if time.time() - last_meta_update >= META_UPDATE_INTERVAL:
+                session.heartbeat(time.time())
+                if timings and session.ready.is_set():
+                    timings.report(force=True)
                 last_meta_update = time.time()
-
-            # If process exited and no more data, break
-            if ret is not None and not ready:
-                break
-
     finally:
-        os.close(master_fd)
-        master_fd = None
+        session.standby.close()
+        sel.close()
 
     print("\n" + "-" * 40)
 
-    # Wait for process to complete
-    exit_code = proc.wait()
-    proc = None
-
-    # Update final status
-    status = 'completed' if exit_code == 0 else 'error'
-    print(f"[proxy] Process exited with code {exit_code} ({status})")
-
-    ref.child('meta').update({
-        'status': status,
-        'exit_code': exit_code,
-        'updated_at': int(time.time() * 1000)
-    })
-
-    print(f"[proxy] Session complete")
+    # The final status goes after the initial meta, so let setup finish
+    backend_thread.join()
+    if backend_error is not None or (session.lease and session.lease.lost):
+        if backend_error is not None:
+            print("[proxy] Session backend unavailable, stopping")
+            session.stop('backend error')
+        else:
+            session.release()
+        session.close()
+        if session.transport:
+            session.transport.close()
+        sys.exit(1 if backend_error is None else backend_error)
+
+    exit_code = session.finish()
+    if not session.writer.flush():
+        print(f"[proxy] Timed out flushing Firebase writes: {session.writer.stats()}")
+    session.close()
+    session.transport.close()
+
+    print("[proxy] Session complete")
     sys.exit(exit_code)
 
 
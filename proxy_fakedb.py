@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Offline stand-in for the parts of firebase_admin.db that proxy.py uses
+
+    db = FakeDatabase(latency=0.05, jitter=0.02, seed=1)
+    ref = db.reference('/shell/demo')
+    ref.child('stdin').listen(callback)
+    ref.child('stdin/0').set('1735012345:hello')
+
+References support child, get, set, update, delete, push, listen and
+transaction.
+Listeners get Event objects with event_type ('put' or 'patch'), path and
+data, shaped like the SDK's. As in the SDK, each listener runs on its own
+background thread and first receives the current value.
+
+Latency is injected in two places. Writes through a reference block for
+one delay, like an HTTPS round trip. Listener events are delivered one
+delay after the write, in order. Each delay is `latency` plus a uniform
+random value in [0, jitter]. Pass a seed for reproducible runs.
+
+`proxy.py --transport fake` runs a session against this database and
+serves it on the local socket (see proxy_transport.py), so controllers
+can drive the Firebase code path with no network or credentials.
+
+Several processes can also share one stand-in, as hosts share the real
+database:
+    python3 proxy_fakedb.py                          # serve it
+    python3 proxy.py -c claude -n demo --transport shared
+RemoteDatabase is the client side: the same Reference API over the local
+socket protocol, with transactions built on its compare-and-set.
+"""
+
+import argparse
+import copy
+import heapq
+import random
+import signal
+import threading
+import time
+
+from proxy_transport import (Event, FirebaseTransport, LocalClient, MemoryTree, default_socket_path,
+                             serve_tree, split_path, stop_server)
+
+# Compare-and-set attempts per RemoteReference.transaction(), as in the SDK
+TRANSACTION_RETRIES = 25
+
+
+class ListenerRegistration:
+    """Delivers tree events to one callback from a background thread"""
+
+    def __init__(self, database, path, callback):
+        self.database = database
+        self.callback = callback
+        self.cond = threading.Condition()
+        self.pending = []  # heap of (deliver_at, seq, event)
+        self.seq = 0
+        self.last_due = 0.0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='fakedb-listener', daemon=True)
+        self.thread.start()
+        self.handle = database.tree.listen(path, self._enqueue)
+
+    def _enqueue(self, event):
+        with self.cond:
+            # Never deliver before an earlier event - SDK streams are ordered
+            self.last_due = max(self.last_due, time.monotonic() + self.database.delay())
+            heapq.heappush(self.pending, (self.last_due, self.seq, event))
+            self.seq += 1
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.closed and (
+                        not self.pending or self.pending[0][0] > time.monotonic()):
+                    timeout = self.pending[0][0] - time.monotonic() if self.pending else None
+                    self.cond.wait(timeout)
+                if self.closed:
+                    return
+                _, _, event = heapq.heappop(self.pending)
+            try:
+                self.callback(event)
+            except Exception as e:
+                print(f"[fakedb] Listener callback raised: {e}")
+
+    def close(self):
+        """Stop delivering events"""
+        self.database.tree.unlisten(self.handle)
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+
+class Reference:
+    """Location in a FakeDatabase, mirroring firebase_admin.db.Reference"""
+
+    def __init__(self, database, path):
+        self.database = database
+        self.parts = split_path(path)
+
+    @property
+    def path(self):
+        return '/' + '/'.join(self.parts)
+
+    @property
+    def key(self):
+        return self.parts[-1] if self.parts else None
+
+    @property
+    def parent(self):
+        if not self.parts:
+            return None
+        return type(self)(self.database, '/'.join(self.parts[:-1]))
+
+    def child(self, path):
+        if not path or not isinstance(path, str):
+            raise ValueError(f'Invalid path argument: "{path}"')
+        return type(self)(self.database, '/'.join(self.parts + split_path(path)))
+
+    def get(self):
+        self.database.round_trip()
+        return self.database.tree.get(self.path)
+
+    def set(self, value):
+        if value is None:
+            raise ValueError('Value must not be None.')
+        self.database.round_trip()
+        self.database.tree.set(self.path, value)
+
+    def update(self, value):
+        if not value or not isinstance(value, dict):
+            raise ValueError('Value argument must be a non-empty dictionary.')
+        if None in value.keys():
+            raise ValueError('Dictionary must not contain None keys.')
+        # Like the server, refuse a path inside another path of the same update
+        paths = sorted(tuple(split_path(key)) for key in value)
+        for parent, path in zip(paths, paths[1:]):
+            if path[:len(parent)] == parent:
+                raise ValueError(f"Path '/{'/'.join(parent)}' overlaps '/{'/'.join(path)}' in one update.")
+        self.database.round_trip()
+        self.database.tree.update(self.path, value)
+
+    def delete(self):
+        self.database.round_trip()
+        self.database.tree.delete(self.path)
+
+    def push(self, value=''):
+        """Store value under a new child key; returns its Reference"""
+        self.database.round_trip()
+        key = self.database.tree.push(self.path, value)
+        return self.child(key)
+
+    def listen(self, callback):
+        return ListenerRegistration(self.database, self.path, callback)
+
+    def transaction(self, transaction_update):
+        """Atomically replace the value with transaction_update(value); returns the new value"""
+        self.database.round_trip()
+        return self.database.tree.transaction(self.path, transaction_update)
+
+
+class FakeDatabase:
+    """In-process Realtime Database with injectable latency and jitter"""
+
+    def __init__(self, latency=0.0, jitter=0.0, seed=None):
+        self.tree = MemoryTree()
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+
+    def delay(self):
+        """One simulated network delay in seconds"""
+        if not self.jitter:
+            return self.latency
+        with self.random_lock:
+            return self.latency + self.random.uniform(0, self.jitter)
+
+    def round_trip(self):
+        delay = self.delay()
+        if delay > 0:
+            time.sleep(delay)
+
+    def reference(self, path='/'):
+        return Reference(self, path)
+
+
+class RemoteListener:
+    """Streams events for one path of a served tree on its own connection"""
+
+    def __init__(self, socket_path, path, callback):
+        self.client = LocalClient(socket_path)
+        self.callback = callback
+        self.client.send('listen', path)
+        self.thread = threading.Thread(target=self._run, name='fakedb-remote-listener', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                message = self.client.read()
+            except (OSError, ValueError):
+                return  # Closed
+            if 'event' not in message:
+                continue
+            try:
+                self.callback(Event(message['event'], message['path'], message['data']))
+            except Exception as e:
+                print(f"[fakedb] Listener callback raised: {e}")
+
+    def close(self):
+        """Stop delivering events"""
+        try:
+            self.client.sock.shutdown(2)
+        except OSError:
+            pass
+        self.client.close()
+
+
+class RemoteReference(Reference):
+    """Reference into a stand-in served by another process"""
+
+    def get(self):
+        return self.database.request('get', self.path)['value']
+
+    def set(self, value):
+        if value is None:
+            raise ValueError('Value must not be None.')
+        self.database.request('set', self.path, value)
+
+    def update(self, value):
+        if not value or not isinstance(value, dict):
+            raise ValueError('Value argument must be a non-empty dictionary.')
+        self.database.request('update', self.path, value)
+
+    def delete(self):
+        self.database.request('delete', self.path)
+
+    def push(self, value=''):
+        return self.child(self.database.request('push', self.path, value)['key'])
+
+    def listen(self, callback):
+        return RemoteListener(self.database.socket_path, self.path, callback)
+
+    def transaction(self, transaction_update):
+        """Compare-and-set retries; returns the new value"""
+        for _ in range(TRANSACTION_RETRIES):
+            current = self.get()
+            value = transaction_update(copy.deepcopy(current))
+            reply = self.database.request('cas', self.path, value, expect=current)
+            if reply['swapped']:
+                return reply['value']
+        raise RuntimeError(f'Transaction at {self.path} failed after {TRANSACTION_RETRIES} attempts')
+
+
+class RemoteDatabase:
+    """firebase_admin.db stand-in for a tree served by `python3 proxy_fakedb.py`"""
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.client = LocalClient(socket_path)
+        self.lock = threading.Lock()
+
+    def request(self, op, path, value=None, **fields):
+        with self.lock:
+            return self.client.request(op, path, value, **fields)
+
+    def reference(self, path='/'):
+        return RemoteReference(self, path)
+
+
+class FakeFirebaseTransport(FirebaseTransport):
+    """FirebaseTransport against a FakeDatabase. The session subtree is also
+    served on a local socket so outside controllers can write stdin."""
+
+    def __init__(self, name, socket_path, database):
+        super().__init__(name, database=database)
+        self.socket_path = socket_path
+        self.server = None
+
+    def connect(self):
+        super().connect()
+        self.server = serve_tree(self.database.tree, self.socket_path, prefix=self.root)
+
+    def describe(self, path=''):
+        return f'fake:{super().describe(path)}'
+
+    def close(self):
+        if self.server:
+            stop_server(self.server, self.socket_path)
+            self.server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a shared offline database stand-in')
+    parser.add_argument('--socket', default=default_socket_path('fakedb'),
+                        help='Unix socket to serve on (default: .claude/proxy_fakedb.sock)')
+    args = parser.parse_args()
+
+    # Blocked before the server threads start, so only sigwait() sees them
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGINT, signal.SIGTERM})
+    server = serve_tree(MemoryTree(), args.socket)
+    print(f"[fakedb] Serving shared stand-in on {args.socket}")
+    try:
+        signal.sigwait({signal.SIGINT, signal.SIGTERM})
+    finally:
+        stop_server(server, args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Session recordings for proxy.py --record, and a tool to replay them
+
+    python3 proxy_record.py info .claude/proxy_record_demo_1735012345.rec
+    python3 proxy_record.py play .claude/proxy_record_demo_1735012345.rec --from 600 --speed 4
+    python3 proxy_record.py export .claude/proxy_record_demo_1735012345.rec -o demo.cast
+
+A recording holds both directions of a session: every chunk read from
+the child's PTY and every write to it (stdin entries, pastes, keys),
+each stamped with the time since recording started. Restarts are marked
+in between.
+
+The file is append-only. After MAGIC and a length-prefixed JSON header
+come records of RECORD (time in microseconds, kind, length) followed by
+the data. A sparse index beside it (path + '.idx') holds fixed-size
+INDEX entries (time, offset of a record), one every INDEX_INTERVAL
+seconds or INDEX_BYTES of data, whichever comes first. A reader maps
+both files and binary-searches the index, so seeking costs O(log n)
+plus one short scan, however long the session. A recording cut short by
+a crash stays readable up to its last complete record.
+
+Recorder.output() runs in proxy.py's read loop, so it does no more than
+pack a record header and hand both pieces to a buffered file. The buffer
+goes to disk when full or FLUSH_INTERVAL seconds after the first record
+in it, not per read. Index entries wait in memory until a flush has put
+the data they point at on disk, so the index never runs ahead of the
+data. Record times come from the monotonic clock, so a wall clock step
+can't reorder or break them; started_at in the header is wall time. `python3 bench_proxy.py record` measures the
+overhead.
+"""
+
+import argparse
+import codecs
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+MAGIC = b'TCLREC1\n'
+HEADER_LENGTH = struct.Struct('<I')
+RECORD = struct.Struct('<QBI')  # Microseconds since start, kind, data length
+INDEX = struct.Struct('<QQ')    # Microseconds since start, offset of the record
+
+# Record kinds
+OUTPUT = 0  # Bytes read from the PTY
+INPUT = 1   # Bytes written to the PTY
+MARK = 2    # JSON note, e.g. a restart
+
+KIND_NAMES = {OUTPUT: 'output', INPUT: 'input', MARK: 'mark'}
+
+INDEX_INTERVAL = 1.0        # Seconds between index entries
+INDEX_BYTES = 1024 * 1024   # Data bytes between index entries
+FILE_BUFFER = 256 * 1024    # Write buffer of the recording file
+FLUSH_INTERVAL = 0.5        # Longest time records wait in the buffer, seconds
+
+IDLE_LIMIT = 2.0  # Longest pause kept by play and export, seconds
+
+
+class Recorder:
+    """Appends a session's PTY traffic to a recording file and its index"""
+
+    def __init__(self, path, rows=24, cols=80, flush_interval=FLUSH_INTERVAL, **info):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_at = None  # When buffered records are due on disk
+        self.started_at = time.time()
+        self.base = time.monotonic()  # Record times count from here
+        self.file = open(path, 'wb', buffering=FILE_BUFFER)
+        self.index = open(path + '.idx', 'wb')
+        header = json.dumps(dict(info, version=1, started_at=self.started_at,
+                                 rows=rows, cols=cols)).encode()
+        self.file.write(MAGIC + HEADER_LENGTH.pack(len(header)) + header)
+        self.offset = len(MAGIC) + HEADER_LENGTH.size + len(header)
+        self.next_index_at = 0
+        self.next_index_offset = self.offset
+        self.pending_index = []  # Entries whose records may still be buffered
+        self.records = 0
+
+    def _append(self, kind, data):
+        t = int((time.monotonic() - self.base) * 1000000)
+        if t >= self.next_index_at or self.offset >= self.next_index_offset:
+            self.pending_index.append(INDEX.pack(t, self.offset))
+            self.next_index_at = t + int(INDEX_INTERVAL * 1000000)
+            self.next_index_offset = self.offset + INDEX_BYTES
+        self.file.write(RECORD.pack(t, kind, len(data)))
+        self.file.write(data)
+        self.offset += RECORD.size + len(data)
+        self.records += 1
+        if self.flush_at is None:
+            self.flush_at = time.time() + self.flush_interval
+
+    def output(self, chunk):
+        """Record bytes read from the PTY (a memoryview is fine)"""
+        self._append(OUTPUT, chunk)
+
+    def input(self, data):
+        """Record bytes written to the PTY"""
+        self._append(INPUT, data)
+
+    def mark(self, **note):
+        """Record a note, such as a restart"""
+        self._append(MARK, json.dumps(note).encode())
+
+    def next_deadline(self):
+        return self.flush_at
+
+    def poll(self, now):
+        """Flush if buffered records are due"""
+        if self.flush_at is not None and now >= self.flush_at:
+            self.flush()
+
+    def flush(self):
+        # Data first, so an index entry never points past the end of the file
+        self.file.flush()
+        if self.pending_index:
+            self.index.write(b''.join(self.pending_index))
+            self.index.flush()
+            self.pending_index.clear()
+        self.flush_at = None
+
+    def stats(self):
+        return {'records': self.records, 'bytes': self.offset}
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        self.index.close()
+
+
+class Recording:
+    """A recording opened for reading, memory-mapped"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a proxy recording')
+        (length,) = HEADER_LENGTH.unpack_from(self.data, len(MAGIC))
+        start = len(MAGIC) + HEADER_LENGTH.size
+        self.header = json.loads(self.data[start:start + length])
+        self.start = start + length
+        self.index = None
+        self.entries = 0
+        try:
+            with open(path + '.idx', 'rb') as f:
+                size = os.fstat(f.fileno()).st_size // INDEX.size * INDEX.size
+                if size:
+                    self.index = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+                    self.entries = size // INDEX.size
+        except FileNotFoundError:
+            pass  # Seeks scan from the start instead
+
+    def records(self, offset=None):
+        """Yield (t, kind, data, offset) from offset on, t in seconds.
+        data is a memoryview into the map."""
+        view = memoryview(self.data)
+        offset = self.start if offset is None else offset
+        end = len(self.data)
+        while offset + RECORD.size <= end:
+            t, kind, length = RECORD.unpack_from(self.data, offset)
+            body = offset + RECORD.size
+            if body + length > end:
+                return  # Cut short by a crash
+            yield t / 1000000, kind, view[body:body + length], offset
+            offset = body + length
+
+    def seek(self, t):
+        """Offset of the first record at or after t seconds"""
+        target = int(t * 1000000)
+        # Last index entry before target: binary search over the map
+        lo, hi = 0, self.entries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if INDEX.unpack_from(self.index, mid * INDEX.size)[0] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        offset = INDEX.unpack_from(self.index, (lo - 1) * INDEX.size)[1] if lo else self.start
+        for record_t, _, _, record_offset in self.records(offset):
+            if record_t >= t:
+                return record_offset
+        return len(self.data)
+
+    def duration(self):
+        """Time of the last record, in seconds"""
+        # Scan from the last index entry that still has a whole record after
+        # it; a crash may have cut off the records the newest ones point at
+        offsets = [INDEX.unpack_from(self.index, i * INDEX.size)[1] for i in range(self.entries - 1, -1, -1)]
+        for offset in offsets + [None]:
+            t = None
+            for t, _, _, _ in self.records(offset):
+                pass
+            if t is not None:
+                return t
+        return 0.0
+
+    def events(self, start=0.0, end=None, idle_limit=None):
+        """Yield (t, kind, data) from start to end seconds. t counts from
+        start, with pauses longer than idle_limit cut down to it."""
+        shift = start
+        last = start
+        for t, kind, data, _ in self.records(self.seek(start)):
+            if end is not None and t > end:
+                return
+            if idle_limit is not None and t - last > idle_limit:
+                shift += t - last - idle_limit
+            last = t
+            yield t - shift, kind, data
+
+    def close(self):
+        self.data.close()
+        if self.index is not None:
+            self.index.close()
+
+
+def play(recording, start, end, speed, idle_limit):
+    """Write the output to stdout at its recorded pace"""
+    out = sys.stdout.buffer
+    began = time.monotonic()
+    for t, kind, data in recording.events(start, end, idle_limit):
+        if kind != OUTPUT:
+            continue
+        delay = began + t / speed - time.monotonic()
+        if delay > 0:
+            out.flush()
+            time.sleep(delay)
+        out.write(data)
+    out.flush()
+
+
+def export_asciicast(recording, out, start, end, idle_limit):
+    """Write asciicast v2: a header line, then one [t, code, data] event per line"""
+    header = recording.header
+    out.write(json.dumps({
+        'version': 2,
+        'width': header['cols'],
+        'height': header['rows'],
+        'timestamp': int(header['started_at'] + start),
+        'title': header.get('name') or header.get('command', ''),
+        'env': {'TERM': 'xterm-256color'},
+    }) + '\n')
+    decoders = {kind: codecs.getincrementaldecoder('utf-8')(errors='replace') for kind in (OUTPUT, INPUT)}
+    events = 0
+    for t, kind, data in recording.events(start, end, idle_limit):
+        if kind == MARK:
+            event = [round(t, 6), 'm', bytes(data).decode()]
+        else:
+            text = decoders[kind].decode(data)
+            if not text:
+                continue
+            event = [round(t, 6), 'o' if kind == OUTPUT else 'i', text]
+        out.write(json.dumps(event) + '\n')
+        events += 1
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect, replay or export a proxy.py --record file')
+    commands = parser.add_subparsers(dest='action', required=True)
+    info = commands.add_parser('info', help='Show the header, size and duration')
+    info.add_argument('path')
+    for name, text in (('play', 'Replay the output to this terminal'),
+                       ('export', 'Convert to asciicast v2')):
+        sub = commands.add_parser(name, help=text)
+        sub.add_argument('path')
+        sub.add_argument('--from', dest='start', type=float, default=0.0,
+                         help='Start this many seconds in (default: 0)')
+        sub.add_argument('--to', dest='end', type=float, help='Stop this many seconds in (default: the end)')
+        sub.add_argument('--idle-limit', type=float, default=IDLE_LIMIT,
+                         help=f'Cut longer pauses down to this many seconds (default: {IDLE_LIMIT})')
+    commands.choices['play'].add_argument('--speed', type=float, default=1.0,
+                                          help='Playback speed factor (default: 1)')
+    commands.choices['export'].add_argument('-o', '--output',
+                                            help='Asciicast file to write (default: stdout)')
+    args = parser.parse_args()
+
+    recording = Recording(args.path)
+    try:
+        if args.action == 'info':
+            counts = dict.fromkeys(KIND_NAMES.values(), 0)
+            for _, kind, _, _ in recording.records():
+                counts[KIND_NAMES[kind]] += 1
+            print(json.dumps(dict(recording.header, bytes=len(recording.data), index_entries=recording.entries,
+                                  duration=round(recording.duration(), 3), records=counts), indent=2))
+        elif args.action == 'play':
+            play(recording, args.start, args.end, args.speed, args.idle_limit)
+        elif args.output:
+            with open(args.output, 'w', encoding='utf-8') as out:
+                events = export_asciicast(recording, out, args.start, args.end, args.idle_limit)
+            print(f"Wrote {events} events to {args.output}")
+        else:
+            export_asciicast(recording, sys.stdout, args.start, args.end, args.idle_limit)
+    finally:
+        recording.close()
+
+
+if __name__ == '__main__':
+    main()
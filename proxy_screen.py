@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Terminal screen model for proxy.py --screen
+
+    screen = Screen(24, 80)
+    screen.feed(b'\x1b[2J\x1b[1;1H\x1b[1mhello\x1b[0m')
+    screen.snapshot()   # {'rows': 24, 'cols': 80, 'lines': [...], 'cursor': [0, 5], ...}
+    screen.diff()       # {'0': '\x1b[0;1mhello\x1b[0m'} - rows changed since the last call
+
+Screen interprets the VT100/xterm sequences that full-screen programs
+such as Claude Code use: cursor movement, erasing, insert/delete of lines
+and characters, scroll regions, SGR attributes, the alternate screen and
+autowrap. Anything else (mouse and keypad modes, queries, charsets) is
+parsed and ignored. Wide characters take two cells; zero-width ones are
+dropped.
+
+Rendered lines are plain text with SGR escapes wherever the attributes
+change, so a viewer can show them with the same ANSI-to-HTML path it uses
+for output. Each line starts from default attributes and ends with a
+reset, so lines can be replaced one at a time.
+
+Output is tokenized with one regular expression and printable runs are
+copied into a row with slice assignment, so cost goes by escape sequences
+rather than by characters. `python3 bench_proxy.py screen` measures
+parser throughput.
+"""
+
+import codecs
+import itertools
+import operator
+import re
+
+# Printable runs, line ends, CSI, OSC and other escape sequences, single controls
+TOKEN = re.compile(
+    r'(?P<text>[^\x00-\x1f\x7f]+)'
+    r'|(?P<newline>\r\n)'
+    r'|(?P<csi>\x1b\[(?P<private>[<=>?]?)(?P<params>[0-9;:]*)[ -/]*(?P<final>[@-~]))'
+    r'|(?P<osc>\x1b\](?P<body>[^\x07\x1b]*)(?:\x07|\x1b\\))'
+    r'|(?P<esc>\x1b[ -/]*[0-~])'
+    r'|(?P<control>[\x00-\x1f\x7f])'
+)
+# An escape sequence cut off at the end of a read, held for the next one
+INCOMPLETE = re.compile(r'\x1b(?:\[[<=>?]?[0-9;:]*[ -/]*|\][^\x07\x1b]*|[ -/]*)\Z')
+INCOMPLETE_MAX = 4096
+
+# Characters drawn two cells wide (East Asian wide and fullwidth, emoji)
+WIDE = re.compile('[\u1100-\u115f\u2e80-\u303e\u3041-\u33ff\u3400-\u4dbf\u4e00-\u9fff'
+                  '\ua000-\ua4cf\uac00-\ud7a3\uf900-\ufaff\ufe30-\ufe4f\uff00-\uff60'
+                  '\uffe0-\uffe6\U0001f300-\U0001f64f\U0001f900-\U0001f9ff\U00020000-\U0003fffd]')
+# Combining marks and other zero-width characters
+ZERO_WIDTH = re.compile('[\u0300-\u036f\u200b-\u200f\u20d0-\u20ff\ufe00-\ufe0f]')
+
+# SGR attributes that are on/off flags: on code -> off code
+SGR_FLAGS = {1: 22, 2: 22, 3: 23, 4: 24, 5: 25, 7: 27, 8: 28, 9: 29}
+TAB_WIDTH = 8
+
+
+class Screen:
+    """A rows x cols grid of cells fed with terminal output.
+
+    Each cell holds one character ('' for the right half of a wide one)
+    and an attribute string: the SGR parameters in effect when it was
+    drawn, '' for defaults. Rows touched since the last diff() are kept
+    in `dirty`; of those, diff() returns the ones that render differently
+    than they last did, so a redraw of the same text costs nothing.
+    """
+
+    def __init__(self, rows=24, cols=80):
+        self.rows = rows
+        self.cols = cols
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.pending = ''
+        self.title = ''
+        self.shown = [''] * rows  # Lines as of the last diff() or snapshot()
+        self.reset()
+
+    def reset(self):
+        """Full reset (RIS): blank screen, cursor home, default modes"""
+        self.chars = self._blank_rows(self.rows)
+        self.attrs = [[''] * self.cols for _ in range(self.rows)]
+        self.x = self.y = 0
+        self.wrap_pending = False  # Cursor is past the last column
+        self.flags = set()
+        self.fg = self.bg = None
+        self.attr = ''
+        self.top, self.bottom = 0, self.rows - 1
+        self.saved = (0, 0, set(), None, None)
+        self.main = None  # (chars, attrs) of the main screen while the alternate one is up
+        self.cursor_visible = True
+        self.autowrap = True
+        self.dirty = set(range(self.rows))
+
+    # Input
+
+    def feed(self, data):
+        """Interpret a chunk of output (bytes, possibly cut mid-character)"""
+        self.feed_text(self.decoder.decode(data))
+
+    def feed_text(self, text):
+        if self.pending:
+            text = self.pending + text
+        cut = INCOMPLETE.search(text, max(0, len(text) - INCOMPLETE_MAX))
+        if cut:
+            self.pending = text[cut.start():]
+            text = text[:cut.start()]
+        else:
+            self.pending = ''
+        for match in TOKEN.finditer(text):
+            kind = match.lastgroup
+            if kind == 'text':
+                self._draw(match.group())
+            elif kind == 'newline':
+                self.x = 0
+                self.wrap_pending = False
+                self._index()
+            elif kind == 'csi':
+                self._csi(match.group('private'), match.group('params'), match.group('final'))
+            elif kind == 'control':
+                self._control(match.group())
+            elif kind == 'esc':
+                self._esc(match.group()[1:])
+            else:
+                body = match.group('body')
+                if body[:2] in ('0;', '2;'):
+                    self.title = body[2:]
+
+    # Output
+
+    def line(self, y):
+        """Row y as text with SGR escapes, trailing blanks dropped"""
+        chars, attrs = self.chars[y], self.attrs[y]
+        end = self.cols
+        while end and chars[end - 1] == ' ' and not attrs[end - 1]:
+            end -= 1
+        parts = []
+        current = ''
+        for attr, cells in itertools.groupby(zip(attrs[:end], chars[:end]), operator.itemgetter(0)):
+            if attr != current:
+                parts.append(f'\x1b[0;{attr}m' if attr else '\x1b[0m')
+                current = attr
+            parts.append(''.join(char for _, char in cells))
+        if current:
+            parts.append('\x1b[0m')
+        return ''.join(parts)
+
+    def snapshot(self):
+        """The whole screen, for a viewer starting from nothing"""
+        self.shown = [self.line(y) for y in range(self.rows)]
+        self.dirty.clear()
+        return {
+            'rows': self.rows,
+            'cols': self.cols,
+            'lines': list(self.shown),
+            'cursor': [self.y, self.x],
+            'cursor_visible': self.cursor_visible,
+            'alternate': self.main is not None,
+            'title': self.title,
+        }
+
+    def diff(self):
+        """Rows changed since the last diff() or snapshot(), {str(row): line}"""
+        rows = {}
+        for y in sorted(self.dirty):
+            line = self.line(y)
+            if line != self.shown[y]:
+                rows[str(y)] = self.shown[y] = line
+        self.dirty.clear()
+        return rows
+
+    # Drawing
+
+    def _blank_rows(self, count):
+        return [[' '] * self.cols for _ in range(count)]
+
+    def _draw(self, text):
+        if WIDE.search(text) or ZERO_WIDTH.search(text):
+            cells = []
+            for char in ZERO_WIDTH.sub('', text):
+                cells.append(char)
+                if WIDE.match(char):
+                    cells.append('')
+        else:
+            cells = text
+        cols = self.cols
+        while cells:
+            if self.wrap_pending:
+                self.wrap_pending = False
+                if self.autowrap:
+                    self.x = 0
+                    self._index()
+            x = self.x
+            if not self.autowrap and len(cells) > cols - x:
+                cells = cells[:cols - x - 1] + cells[-1:]  # The rest overwrites the last column
+            n = min(len(cells), cols - x)
+            row = self.chars[self.y]
+            if n < len(cells) and cells[n] == '':
+                n -= 1  # A wide character that doesn't fit goes to the next row
+                row[x + n] = ' '
+            # Never leave half of a wide character behind
+            if x and row[x] == '':
+                row[x - 1] = ' '
+            if x + n < cols and row[x + n] == '':
+                row[x + n] = ' '
+            row[x:x + n] = cells[:n]
+            self.attrs[self.y][x:x + n] = [self.attr] * n
+            self.dirty.add(self.y)
+            cells = cells[n:]
+            if x + n < cols and not cells:
+                self.x = x + n
+            else:
+                self.x = cols - 1
+                self.wrap_pending = True
+                if not self.autowrap:
+                    break
+
+    def _control(self, char):
+        if char == '\r':
+            self.x = 0
+        elif char in '\n\x0b\x0c':
+            self._index()
+        elif char == '\b':
+            self.x = max(0, self.x - 1)
+        elif char == '\t':
+            self.x = min(self.cols - 1, (self.x // TAB_WIDTH + 1) * TAB_WIDTH)
+        else:
+            return  # Bell, shift in/out, stray escape
+        self.wrap_pending = False
+
+    def _index(self):
+        """Cursor down a line, scrolling at the bottom of the region"""
+        if self.y == self.bottom:
+            self._scroll_up(1)
+        elif self.y < self.rows - 1:
+            self.y += 1
+
+    def _reverse_index(self):
+        if self.y == self.top:
+            self._scroll_down(1)
+        elif self.y > 0:
+            self.y -= 1
+
+    def _scroll_up(self, n, top=None):
+        top = self.top if top is None else top
+        bottom = self.bottom
+        n = min(n, bottom - top + 1)
+        del self.chars[top:top + n]
+        del self.attrs[top:top + n]
+        at = bottom - n + 1
+        self.chars[at:at] = self._blank_rows(n)
+        self.attrs[at:at] = [[''] * self.cols for _ in range(n)]
+        self.dirty.update(range(top, bottom + 1))
+
+    def _scroll_down(self, n, top=None):
+        top = self.top if top is None else top
+        n = min(n, self.bottom - top + 1)
+        del self.chars[self.bottom - n + 1:self.bottom + 1]
+        del self.attrs[self.bottom - n + 1:self.bottom + 1]
+        self.chars[top:top] = self._blank_rows(n)
+        self.attrs[top:top] = [[''] * self.cols for _ in range(n)]
+        self.dirty.update(range(top, self.bottom + 1))
+
+    def _erase(self, y, start, end):
+        self.chars[y][start:end] = [' '] * (end - start)
+        self.attrs[y][start:end] = [''] * (end - start)
+        self.dirty.add(y)
+
+    def _esc(self, seq):
+        if seq == '7':
+            self.saved = (self.x, self.y, set(self.flags), self.fg, self.bg)
+        elif seq == '8':
+            self._restore()
+        elif seq == 'D':
+            self._index()
+        elif seq == 'E':
+            self.x = 0
+            self._index()
+        elif seq == 'M':
+            self._reverse_index()
+        elif seq == 'c':
+            self.reset()
+        else:
+            return  # Charsets, keypad modes
+        self.wrap_pending = False
+
+    def _restore(self):
+        x, y, flags, self.fg, self.bg = self.saved
+        self.x, self.y = min(x, self.cols - 1), min(y, self.rows - 1)
+        self.flags = set(flags)
+        self._update_attr()
+
+    def _csi(self, private, params, final):
+        if final == 'm':
+            if not private:
+                self._sgr(params)
+            return
+        args = [int(p) if p else 0 for p in params.replace(':', ';').split(';')] if params else []
+        if private:
+            if private == '?' and final in 'hl':
+                self._mode(args, final == 'h')
+            return
+        n = max(args[0], 1) if args else 1
+        if final in 'Hf':
+            self.y = min(max(n, 1), self.rows) - 1
+            self.x = min(max(args[1] if len(args) > 1 else 1, 1), self.cols) - 1
+        elif final == 'A':
+            self.y = max(self.top if self.y >= self.top else 0, self.y - n)
+        elif final == 'B':
+            self.y = min(self.bottom if self.y <= self.bottom else self.rows - 1, self.y + n)
+        elif final == 'C':
+            self.x = min(self.cols - 1, self.x + n)
+        elif final == 'D':
+            self.x = max(0, min(self.x, self.cols - 1) - n)
+        elif final == 'E':
+            self.y, self.x = min(self.rows - 1, self.y + n), 0
+        elif final == 'F':
+            self.y, self.x = max(0, self.y - n), 0
+        elif final in 'G`':
+            self.x = min(n, self.cols) - 1
+        elif final == 'd':
+            self.y = min(n, self.rows) - 1
+        elif final == 'J':
+            self._erase_display(args[0] if args else 0)
+        elif final == 'K':
+            mode = args[0] if args else 0
+            start = 0 if mode in (1, 2) else self.x
+            end = self.x + 1 if mode == 1 else self.cols
+            self._erase(self.y, start, end)
+        elif final == 'X':
+            self._erase(self.y, self.x, min(self.cols, self.x + n))
+        elif final == 'P':
+            row, attrs = self.chars[self.y], self.attrs[self.y]
+            n = min(n, self.cols - self.x)
+            del row[self.x:self.x + n]
+            del attrs[self.x:self.x + n]
+            row.extend([' '] * n)
+            attrs.extend([''] * n)
+            self.dirty.add(self.y)
+        elif final == '@':
+            row, attrs = self.chars[self.y], self.attrs[self.y]
+            n = min(n, self.cols - self.x)
+            row[self.x:self.x] = [' '] * n
+            attrs[self.x:self.x] = [''] * n
+            del row[self.cols:]
+            del attrs[self.cols:]
+            self.dirty.add(self.y)
+        elif final in 'LM':
+            if self.top <= self.y <= self.bottom:
+                if final == 'L':
+                    self._scroll_down(n, self.y)
+                else:
+                    self._scroll_up(n, self.y)
+                self.x = 0
+        elif final == 'S':
+            self._scroll_up(n)
+        elif final == 'T':
+            self._scroll_down(n)
+        elif final == 'r':
+            top = (args[0] if args and args[0] else 1) - 1
+            bottom = (args[1] if len(args) > 1 and args[1] else self.rows) - 1
+            if top < bottom < self.rows:
+                self.top, self.bottom = top, bottom
+                self.x = self.y = 0
+        elif final == 's':
+            self.saved = (self.x, self.y, set(self.flags), self.fg, self.bg)
+        elif final == 'u':
+            self._restore()
+        else:
+            return  # Queries, tab stops, window ops
+        self.wrap_pending = False
+
+    def _erase_display(self, mode):
+        if mode == 0:
+            self._erase(self.y, self.x, self.cols)
+            rows = range(self.y + 1, self.rows)
+        elif mode == 1:
+            self._erase(self.y, 0, self.x + 1)
+            rows = range(self.y)
+        else:
+            rows = range(self.rows)
+        for y in rows:
+            self._erase(y, 0, self.cols)
+
+    def _mode(self, args, on):
+        for mode in args:
+            if mode == 25:
+                self.cursor_visible = on
+            elif mode == 7:
+                self.autowrap = on
+            elif mode in (47, 1047, 1049):
+                if on and self.main is None:
+                    if mode == 1049:
+                        self.saved = (self.x, self.y, set(self.flags), self.fg, self.bg)
+                    self.main = (self.chars, self.attrs)
+                    self.chars = self._blank_rows(self.rows)
+                    self.attrs = [[''] * self.cols for _ in range(self.rows)]
+                elif not on and self.main is not None:
+                    self.chars, self.attrs = self.main
+                    self.main = None
+                    if mode == 1049:
+                        self._restore()
+                self.dirty.update(range(self.rows))
+
+    def _sgr(self, params):
+        codes = [int(p) if p else 0 for p in params.replace(':', ';').split(';')] if params else [0]
+        i = 0
+        while i < len(codes):
+            code = codes[i]
+            if code == 0:
+                self.flags.clear()
+                self.fg = self.bg = None
+            elif code in SGR_FLAGS:
+                self.flags.add(code)
+            elif code in (22, 23, 24, 25, 27, 28, 29):
+                self.flags -= {on for on, off in SGR_FLAGS.items() if off == code}
+            elif 30 <= code <= 37 or 90 <= code <= 97:
+                self.fg = str(code)
+            elif 40 <= code <= 47 or 100 <= code <= 107:
+                self.bg = str(code)
+            elif code == 39:
+                self.fg = None
+            elif code == 49:
+                self.bg = None
+            elif code in (38, 48):
+                # 38;5;n or 38;2;r;g;b (and the same for background)
+                width = {5: 2, 2: 4}.get(codes[i + 1] if i + 1 < len(codes) else None, 1)
+                color = ';'.join(str(c) for c in codes[i:i + 1 + width])
+                if code == 38:
+                    self.fg = color
+                else:
+                    self.bg = color
+                i += width
+            i += 1
+        self._update_attr()
+
+    def _update_attr(self):
+        parts = [str(flag) for flag in sorted(self.flags)]
+        if self.fg:
+            parts.append(self.fg)
+        if self.bg:
+            parts.append(self.bg)
+        self.attr = ';'.join(parts)
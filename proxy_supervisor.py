@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Proxy Supervisor - Run many proxy.py sessions in one process
+
+Usage:
+    python3 proxy_supervisor.py -m sessions.json
+    python3 proxy_supervisor.py -m sessions.json --transport local --log-dir logs
+
+The manifest names the sessions and their commands, as `proxy.py -c ... -n ...`
+would take them, and optionally a transcript to follow (as --transcript-path):
+    {"sessions": [{"name": "agent1", "command": "claude"},
+                  {"name": "agent2", "command": "claude --permission-mode plan",
+                   "transcript": "~/.claude/projects/-work-agent2"}]}
+
+Each session is a proxy.py ProxySession, so it keeps the /shell/{name}
+layout of a standalone proxy (stdin, meta, meta/plan) and everything the
+proxy does for it: pacing, /clear and plan restarts (--plan-switch,
+--standby), --generations, --state, --screen, --publish-output, --record
+and the debug log take the same options as in proxy.py. What is shared is
+the plumbing: one backend connection, one background writer (whose queue
+folds the sessions' heartbeats into one multi-path update) and one
+selector loop for every PTY.
+
+A listener streams the whole subtree below its path, so there is no
+listener on /shell itself, which would also stream everything else kept
+there (transcripts, output records). Each session listens to its own
+stdin, meta/plan and meta/lease on the shared connection instead.
+
+With --transport local all sessions live in one in-memory tree served on
+.claude/proxy_supervisor.sock, each under {name}/:
+    python3 proxy_transport.py --supervisor -n agent1 'hello there'
+
+PTY output is written to {log_dir}/{name}.log with --log-dir and dropped
+otherwise.
+
+Sharding: with --lease-ttl each session runs only while this host holds
+its lease (meta/lease, as in proxy.py), renewed in the heartbeat update.
+Supervisors on several hosts can share one manifest: each claims unowned
+sessions up to --capacity and takes over sessions whose owner stops
+renewing, then keeps running as a standby for the rest.
+"""
+
+import argparse
+import functools
+import json
+import os
+import selectors
+import signal
+import sys
+import threading
+import time
+
+from proxy import (META_UPDATE_INTERVAL, SERVICE_ACCOUNT_PATH, DATABASE_URL, BackgroundWriter, Lease,
+                   ProxySession, ScopedWriter, add_session_arguments, load_state_patterns)
+from proxy_transport import FirebaseTransport, LocalTransport, ScopedTransport, default_socket_path
+
+
+def load_manifest(path):
+    """Read the manifest -> [(name, command, transcript path or None)].
+    Raises ValueError if it is malformed."""
+    with open(path) as f:
+        manifest = json.load(f)
+    entries = manifest.get('sessions') if isinstance(manifest, dict) else manifest
+    if not isinstance(entries, list) or not entries:
+        raise ValueError('expected {"sessions": [{"name": ..., "command": ...}, ...]}')
+    sessions = []
+    for entry in entries:
+        name = entry.get('name') if isinstance(entry, dict) else None
+        command = entry.get('command') if isinstance(entry, dict) else None
+        if not isinstance(name, str) or not name or '/' in name or name.startswith('.'):
+            raise ValueError(f'invalid session name in {entry!r}')
+        if not isinstance(command, str) or not command:
+            raise ValueError(f'session {name!r} has no command')
+        if name in (existing for existing, _, _ in sessions):
+            raise ValueError(f'duplicate session name {name!r}')
+        transcript = entry.get('transcript')
+        if transcript is not None and not isinstance(transcript, str):
+            raise ValueError(f'session {name!r} has an invalid transcript path')
+        sessions.append((name, command, os.path.expanduser(transcript) if transcript else None))
+    return sessions
+
+
+class Discard:
+    """Output sink of sessions without a log file"""
+
+    def write(self, chunk):
+        pass
+
+    def flush(self):
+        pass
+
+
+class Supervisor:
+    """Runs every manifest session on one transport, writer and selector loop.
+
+    Listener callbacks only queue work and wake() the loop for their
+    session, which is then serviced like proxy.py's main loop services
+    its one session.
+    """
+
+    def __init__(self, args, sessions, transport):
+        self.args = args
+        self.transport = transport
+        self.pid = os.getpid()
+        self.writer = BackgroundWriter(transport)
+        self.sel = selectors.DefaultSelector()
+        self.woken = set()  # Names of sessions with queued work
+        self.woken_lock = threading.Lock()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        os.set_blocking(self.wakeup_r, False)
+        os.set_blocking(self.wakeup_w, False)
+        self.sel.register(self.wakeup_r, selectors.EVENT_READ, None)
+        self.sessions = {}
+        for name, command, transcript_path in sessions:
+            session = ProxySession(name, command, args, self.sel, functools.partial(self.wake, name),
+                                   sink=Discard(), transcript_path=transcript_path,
+                                   tag=f'[supervisor] {name}:')
+            session.transport = ScopedTransport(transport, name)
+            session.writer = ScopedWriter(self.writer, name)
+            session.extra_meta = {'supervisor': self.pid}
+            if args.lease_ttl:
+                session.lease = Lease(args.owner, args.lease_ttl)
+                session.watch_lease()
+            self.sessions[name] = session
+        self.capacity = args.capacity or len(self.sessions)
+        self.active = set()
+        self.retiring = set()  # Stopped sessions whose process groups are still winding down
+
+    def wake(self, name):
+        """Have the loop service session name soon (called from listener threads)"""
+        with self.woken_lock:
+            self.woken.add(name)
+        try:
+            os.write(self.wakeup_w, b'\0')
+        except OSError:
+            pass  # Pipe full - a wakeup is already pending
+
+    # Lifecycle
+
+    def start(self):
+        if self.args.log_dir:
+            os.makedirs(self.args.log_dir, exist_ok=True)
+        if self.args.lease_ttl:
+            self.claim_sessions(time.time())
+        else:
+            for session in self.sessions.values():
+                self.launch(session)
+        print(f"[supervisor] Started {len(self.active)} of {len(self.sessions)} session(s)")
+
+    def launch(self, session):
+        """Open a session (clearing it unless --no-clear is set) and start its child"""
+        self.retiring.discard(session)
+        session.batcher.reset()  # Entries queued while another host owned it
+        if self.args.log_dir and isinstance(session.sink, Discard):
+            session.sink = open(os.path.join(self.args.log_dir, f'{session.name}.log'), 'ab')
+        try:
+            session.open(self.args.no_clear, time.time())
+            session.start()
+        except Exception as e:
+            session.say(f"Failed to start process: {e}")
+            session.exit_code = 1
+            session.writer.update('meta', {
+                'status': 'error',
+                'updated_at': int(time.time() * 1000),
+                'error': str(e)
+            })
+            return
+        self.active.add(session)
+
+    def retire(self, session):
+        """The session is over on this host: its child exited, or its lease
+        was taken over. Its process groups are still waited for."""
+        self.active.discard(session)
+        if session.lease and session.lease.lost:
+            session.release()
+        else:
+            session.finish()
+        if not isinstance(session.sink, Discard):
+            session.sink.close()
+            session.sink = Discard()
+        self.retiring.add(session)
+
+    def claim_sessions(self, now):
+        """Take the leases of free or stale sessions while under capacity"""
+        for session in self.sessions.values():
+            if len(self.active) >= self.capacity:
+                return
+            if session in self.active or session.exit_code is not None:
+                continue
+            lease = session.lease
+            if lease.available(lease.seen, now) and lease.claim(session.transport):
+                session.say(f"Holding the lease as {lease.owner}")
+                self.launch(session)
+
+    def waiting(self):
+        """Whether sessions may still be claimed (leases only)"""
+        return bool(self.args.lease_ttl) and any(
+            session not in self.active and session.exit_code is None for session in self.sessions.values())
+
+    def run(self):
+        """Serve until every session's child has exited"""
+        last_heartbeat = time.time()
+        while self.active or self.waiting():
+            timeout = max(0, last_heartbeat + META_UPDATE_INTERVAL - time.time())
+            deadlines = [session.next_deadline() for session in self.active]
+            deadlines += [session.reaper.next_deadline() for session in self.retiring]
+            for deadline in deadlines:
+                if deadline is not None:
+                    timeout = min(timeout, max(0, deadline - time.time()))
+
+            readable = set()
+            child_exited = False
+            for key, _ in self.sel.select(timeout):
+                if key.data is None:
+                    child_exited |= self.drain_wakeup_pipe()
+                elif isinstance(key.data, ProxySession):
+                    readable.add(key.data)
+                else:
+                    pool, child = key.data
+                    pool.drain(child)
+            with self.woken_lock:
+                woken, self.woken = self.woken, set()
+
+            now = time.time()
+            for session in list(self.active):
+                deadline = session.next_deadline()
+                due = (session in readable or session.name in woken
+                       or (deadline is not None and deadline <= now)
+                       or (child_exited and session.proc is not None and session.proc.poll() is not None))
+                if due and not session.service(now, session in readable):
+                    self.retire(session)
+
+            for session in list(self.retiring):
+                for teardown in session.reaper.poll(time.time()):
+                    if teardown['reason'] != 'exit':
+                        session.say(f"Teardown: {teardown}")
+                if not session.reaper.pending:
+                    self.retiring.discard(session)
+
+            if time.time() - last_heartbeat >= META_UPDATE_INTERVAL:
+                now = time.time()
+                for session in self.active:
+                    session.heartbeat(now)
+                if self.args.lease_ttl:
+                    self.claim_sessions(now)
+                last_heartbeat = time.time()
+
+    def drain_wakeup_pipe(self):
+        """Consume wakeup bytes. Returns True if SIGCHLD was among them."""
+        data = b''
+        try:
+            while True:
+                chunk = os.read(self.wakeup_r, 4096)
+                if not chunk:
+                    break
+                data += chunk
+        except BlockingIOError:
+            pass
+        return bytes([signal.SIGCHLD]) in data
+
+    def close(self):
+        """Flush the writes, wait for every child group and disconnect"""
+        if not self.writer.flush():
+            print(f"[supervisor] Timed out flushing writes: {self.writer.stats()}")
+        for session in self.sessions.values():
+            session.close()
+        self.sel.close()
+        self.transport.close()
+
+    def signal_handler(self, signum, frame):
+        """Mark every running session interrupted and exit"""
+        print(f"\n[supervisor] Received signal {signum}, shutting down...")
+        for session in self.active:
+            session.interrupt()
+        self.active.clear()
+        self.close()
+        sys.exit(130)  # 128 + SIGINT(2)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run the sessions of a manifest in one process, synced like proxy.py'
+    )
+    parser.add_argument(
+        '-m', '--manifest',
+        required=True,
+        help='JSON file listing the sessions: {"sessions": [{"name": ..., "command": ...}]}'
+    )
+    parser.add_argument(
+        '--service-account',
+        default=SERVICE_ACCOUNT_PATH,
+        help=f'Path to Firebase service account JSON (default: {SERVICE_ACCOUNT_PATH})'
+    )
+    parser.add_argument(
+        '--no-clear',
+        action='store_true',
+        help='Do not clear previous session data before starting'
+    )
+    parser.add_argument(
+        '--transport',
+        choices=['firebase', 'local', 'fake', 'shared'],
+        default='firebase',
+        help='Session backend, as for proxy.py (default: firebase)'
+    )
+    parser.add_argument(
+        '--socket',
+        help='Unix socket path for --transport local/fake (default: .claude/proxy_supervisor.sock), '
+             'or of the stand-in for --transport shared (default: .claude/proxy_fakedb.sock)'
+    )
+    parser.add_argument(
+        '--lease-ttl',
+        type=float,
+        default=0,
+        help='Run only the sessions this host holds a lease on, renewed with the heartbeat '
+             f'and taken over after this many seconds without renewal; must exceed '
+             f'{2 * META_UPDATE_INTERVAL} (default: 0, no leases)'
+    )
+    parser.add_argument(
+        '--capacity',
+        type=int,
+        default=0,
+        help='Most sessions to run at once with --lease-ttl (default: all of the manifest)'
+    )
+    parser.add_argument(
+        '--owner',
+        default=f'{os.uname().nodename}:{os.getpid()}',
+        help='Lease owner id (default: hostname:pid)'
+    )
+    parser.add_argument(
+        '--fake-latency',
+        type=float,
+        default=0.0,
+        help='Simulated network delay in seconds for --transport fake (default: 0)'
+    )
+    parser.add_argument(
+        '--log-dir',
+        help='Write each session\'s PTY output to {log_dir}/{name}.log (default: discard it)'
+    )
+    add_session_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.lease_ttl and args.lease_ttl <= 2 * META_UPDATE_INTERVAL:
+        parser.error(f'--lease-ttl must exceed {2 * META_UPDATE_INTERVAL} seconds')
+    return args
+
+
+def main():
+    args = parse_args()
+    try:
+        sessions = load_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        print(f"[supervisor] ERROR: Cannot read manifest {args.manifest}: {e}")
+        sys.exit(1)
+
+    # Idle/busy markers for --state
+    args.state_table = None
+    if args.state and args.state_patterns:
+        try:
+            args.state_table = load_state_patterns(args.state_patterns)
+        except (OSError, ValueError) as e:
+            print(f"[supervisor] ERROR: Cannot use state patterns {args.state_patterns}: {e}")
+            sys.exit(1)
+
+    if args.transport == 'firebase' and not os.path.exists(args.service_account):
+        print(f"[supervisor] ERROR: Service account file not found: {args.service_account}")
+        sys.exit(1)
+
+    socket_path = args.socket or default_socket_path('supervisor')
+    if args.transport == 'shared':
+        from proxy_fakedb import RemoteDatabase
+        socket_path = args.socket or default_socket_path('fakedb')
+        transport = FirebaseTransport('', database=RemoteDatabase(socket_path))
+        print(f"[supervisor] Using shared stand-in on {socket_path}")
+    elif args.transport == 'local':
+        transport = LocalTransport('', socket_path)
+        print(f"[supervisor] Serving local sessions on {socket_path}")
+    elif args.transport == 'fake':
+        from proxy_fakedb import FakeDatabase, FakeFirebaseTransport
+        transport = FakeFirebaseTransport('', socket_path, FakeDatabase(args.fake_latency))
+        print(f"[supervisor] Using offline Firebase stand-in, served on {socket_path}")
+    else:
+        transport = FirebaseTransport('', args.service_account, DATABASE_URL)
+        print("[supervisor] Initializing Firebase...")
+    transport.connect()
+
+    supervisor = Supervisor(args, sessions, transport)
+    signal.signal(signal.SIGINT, supervisor.signal_handler)
+    signal.signal(signal.SIGTERM, supervisor.signal_handler)
+    # SIGCHLD wakes the loop so exited children are noticed at once
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.set_wakeup_fd(supervisor.wakeup_w)
+
+    supervisor.start()
+    supervisor.run()
+
+    failed = [name for name, session in supervisor.sessions.items() if session.exit_code != 0]
+    supervisor.close()
+    print(f"[supervisor] All sessions finished ({len(failed)} failed)")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,637 @@
+#!/usr/bin/env python3
+"""
+Session transports for proxy.py
+
+A transport is where a proxy session's stdin entries, plan toggles and
+meta live. Paths are relative to the session root (/shell/{name} on
+Firebase), with '' meaning the root itself. With `proxy.py --generations`
+each run lives under gen/{n} and the record at 'current' names n.
+
+    FirebaseTransport - Firebase Realtime Database (the default)
+    LocalTransport    - in-memory tree served on a Unix socket, for
+                        co-located controllers and offline runs
+
+proxy_supervisor.py opens one transport for all of its sessions, rooted
+one level up (/shell on Firebase), with each session under {name}/ and
+seeing it through a ScopedTransport.
+
+Listener callbacks receive Firebase-style events with .event_type, .path
+and .data, so the same handlers work with every transport.
+
+Local socket protocol: newline-delimited JSON, one request per line.
+    {"op": "set", "path": "stdin/0", "value": "1735012345:hello"}
+    {"op": "push", "path": "stdin", "value": "1735012346:hi",
+     "after": "meta/stdin_cursor", "id": 1}
+    {"op": "update", "path": "meta", "value": {"plan": false}}
+    {"op": "delete", "path": "stdin"}
+    {"op": "get", "path": "meta", "id": 2}
+    {"op": "listen", "path": "meta"}
+    {"op": "cas", "path": "meta/lease", "expect": null,
+     "value": {"owner": "host:1"}, "id": 3}
+Requests carrying an "id" get a reply line {"id": ..., "ok": true, ...}.
+"cas" writes only if the path holds "expect", replying with "swapped"
+and the value now there; clients build transactions on it.
+"listen" streams {"event": "put", "path": ..., "data": ...} lines.
+"push" keys never reuse one at or below the integer stored at "after",
+so pruned stdin entries keep their numbers.
+
+Usage (send one stdin entry to a local session):
+    python3 proxy_transport.py -n my_session 'hello there'
+    python3 proxy_transport.py --supervisor -n my_session 'hello there'
+    python3 proxy_transport.py -n my_session 'macro:[["keys", "4"], ["wait", "Type"], ["paste", "hi"], ["enter"]]'
+"""
+
+import argparse
+import collections
+import copy
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+
+class Event:
+    """Listener event shaped like firebase_admin.db.Event"""
+
+    def __init__(self, event_type, path, data):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+
+def split_path(path):
+    """'a/b/' -> ['a', 'b']"""
+    return [part for part in str(path).split('/') if part]
+
+
+def normalize(value):
+    """Apply Firebase storage rules: keys are strings, null and empty
+    containers are not stored, lists become index-keyed dicts"""
+    if isinstance(value, list):
+        value = {str(i): v for i, v in enumerate(value)}
+    if isinstance(value, dict):
+        out = {}
+        for key, child in value.items():
+            child = normalize(child)
+            if child is not None:
+                out[str(key)] = child
+        return out or None
+    return value
+
+
+class TreeSubscription:
+    """One MemoryTree listener and the events queued for it"""
+
+    def __init__(self, parts, callback):
+        self.parts = parts
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        self.draining = False  # A thread is running the callback
+        self.closed = False
+
+    def queue(self, event):
+        with self.lock:
+            self.pending.append(event)
+
+    def deliver(self):
+        """Run the callback for queued events, unless another thread is
+        already doing so; it picks up these events too, in order"""
+        with self.lock:
+            if self.draining:
+                return
+            self.draining = True
+        while True:
+            with self.lock:
+                if self.closed or not self.pending:
+                    self.draining = False
+                    return
+                event = self.pending.popleft()
+            try:
+                self.callback(event)
+            except BaseException:
+                with self.lock:
+                    self.draining = False
+                raise
+
+
+class MemoryTree:
+    """Minimal in-memory JSON tree with Firebase-style listeners.
+
+    A listener fires once with the current value when attached. After that
+    it gets a 'put' event when set() changes data at or below its path, a
+    'patch' event (data = the changed children) for update() at or below
+    its path, and a 'put' of its whole new value when a write to an
+    ancestor changes it. Events are queued per listener under the tree's
+    lock and delivered in write order after it is released, usually on
+    the writing thread, so a slow callback (a socket send) never holds up
+    other readers and writers.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.lock = threading.RLock()
+        self.listeners = []  # [TreeSubscription]
+
+    def get(self, path=''):
+        with self.lock:
+            node = self.root
+            for part in split_path(path):
+                if not isinstance(node, dict) or part not in node:
+                    return None
+                node = node[part]
+            return copy.deepcopy(node)
+
+    def listen(self, path, callback):
+        """Attach callback to path; returns a handle for unlisten()"""
+        listener = TreeSubscription(split_path(path), callback)
+        with self.lock:
+            self.listeners.append(listener)
+            listener.queue(Event('put', '/', self.get(path)))
+        listener.deliver()
+        return listener
+
+    def unlisten(self, handle):
+        with self.lock:
+            if handle in self.listeners:
+                self.listeners.remove(handle)
+        with handle.lock:
+            handle.closed = True
+
+    def set(self, path, value):
+        with self.lock:
+            self._write(split_path(path), {'': value}, 'put')
+        self._deliver()
+
+    def update(self, path, values):
+        """Multi-path update: each key may itself be a slash path"""
+        with self.lock:
+            self._write(split_path(path), values, 'patch')
+        self._deliver()
+
+    def delete(self, path=''):
+        self.set(path, None)
+
+    def transaction(self, path, update):
+        """Replace the value at path with update(value) atomically; returns the new value"""
+        with self.lock:
+            self._write(split_path(path), {'': update(self.get(path))}, 'put')
+            value = self.get(path)
+        self._deliver()
+        return value
+
+    def compare_and_set(self, path, expected, value):
+        """Set path to value if it holds expected. Returns (swapped, value now at path)."""
+        with self.lock:
+            current = self.get(path)
+            if current != normalize(copy.deepcopy(expected)):
+                return False, current
+            self._write(split_path(path), {'': value}, 'put')
+            value = self.get(path)
+        self._deliver()
+        return True, value
+
+    def push(self, path, value, after=None):
+        """Store value under the next integer key at path; returns the key.
+        `after` names a node holding the last key handed out, if any."""
+        with self.lock:
+            node = self.get(path) or {}
+            keys = [int(k) for k in node if k.isdigit()]
+            floor = self.get(after) if after else None
+            if isinstance(floor, int):
+                keys.append(floor)
+            key = str(max(keys, default=-1) + 1)
+            self._write(split_path(path) + [key], {'': value}, 'put')
+        self._deliver()
+        return key
+
+    def _deliver(self):
+        """Run queued events; called with the lock released"""
+        with self.lock:
+            listeners = [listener for listener in self.listeners if listener.pending]
+        for listener in listeners:
+            listener.deliver()
+
+    def _write(self, base, values, event_type):
+        """Apply a write and queue its events; called with the lock held"""
+        changed = {}
+        for key, value in values.items():
+            parts = base + split_path(key)
+            value = normalize(copy.deepcopy(value))
+            if self.get('/'.join(parts)) != value:
+                changed[key] = (parts, value)
+        if not changed:
+            return
+        # Listeners below the write see their whole new value, so
+        # snapshot them before changing anything
+        below = []
+        for listener in self.listeners:
+            if len(listener.parts) > len(base) and listener.parts[:len(base)] == base:
+                below.append((listener, self.get('/'.join(listener.parts))))
+        for parts, value in changed.values():
+            self.root = self._assign(self.root, parts, value)
+
+        for listener in self.listeners:
+            if base[:len(listener.parts)] != listener.parts:
+                continue
+            rel = '/' + '/'.join(base[len(listener.parts):])
+            if event_type == 'put':
+                listener.queue(Event('put', rel, copy.deepcopy(changed[''][1])))
+            else:
+                data = {key: copy.deepcopy(value) for key, (_, value) in changed.items()}
+                listener.queue(Event('patch', rel, data))
+        for listener, before in below:
+            after = self.get('/'.join(listener.parts))
+            if after != before:
+                listener.queue(Event('put', '/', after))
+
+    def _assign(self, node, parts, value):
+        if not parts:
+            return value
+        node = dict(node) if isinstance(node, dict) else {}
+        child = self._assign(node.get(parts[0]), parts[1:], value)
+        if child is None:
+            node.pop(parts[0], None)
+        else:
+            node[parts[0]] = child
+        return node or None
+
+
+class TreeListener:
+    """Handle for a MemoryTree listener, closed like an SDK ListenerRegistration"""
+
+    def __init__(self, tree, handle):
+        self.tree = tree
+        self.handle = handle
+
+    def close(self):
+        self.tree.unlisten(self.handle)
+
+
+class TreeRequestHandler(socketserver.StreamRequestHandler):
+    """Serves the local socket protocol for one client connection.
+
+    serve_tree() subclasses this with the tree and the path prefix that
+    client paths are relative to.
+    """
+
+    tree = None
+    prefix = ''
+
+    def setup(self):
+        super().setup()
+        self.send_lock = threading.Lock()
+        self.handles = []
+
+    def send(self, message):
+        data = (json.dumps(message) + '\n').encode('utf-8')
+        with self.send_lock:
+            self.connection.sendall(data)
+
+    def handle(self):
+        for line in self.rfile:
+            request = {}
+            try:
+                request = json.loads(line)
+                reply = self.dispatch(request)
+            except Exception as e:
+                reply = {'ok': False, 'error': str(e)}
+            if isinstance(request, dict) and 'id' in request:
+                reply.setdefault('ok', True)
+                reply['id'] = request['id']
+                self.send(reply)
+
+    def dispatch(self, request):
+        op = request['op']
+        client_path = request.get('path', '')
+        path = '/'.join(split_path(self.prefix) + split_path(client_path))
+        if op == 'set':
+            self.tree.set(path, request.get('value'))
+        elif op == 'update':
+            self.tree.update(path, request['value'])
+        elif op == 'delete':
+            self.tree.delete(path)
+        elif op == 'push':
+            after = request.get('after')
+            if after:
+                after = '/'.join(split_path(self.prefix) + split_path(after))
+            return {'key': self.tree.push(path, request.get('value'), after)}
+        elif op == 'get':
+            return {'value': self.tree.get(path)}
+        elif op == 'cas':
+            swapped, value = self.tree.compare_and_set(path, request.get('expect'), request.get('value'))
+            return {'swapped': swapped, 'value': value}
+        elif op == 'listen':
+            def forward(event):
+                try:
+                    self.send({'event': event.event_type, 'listen': client_path,
+                               'path': event.path, 'data': event.data})
+                except OSError:
+                    pass  # Client went away; finish() unlistens
+            self.handles.append(self.tree.listen(path, forward))
+        else:
+            raise ValueError(f'unknown op {op!r}')
+        return {}
+
+    def finish(self):
+        for handle in self.handles:
+            self.tree.unlisten(handle)
+        super().finish()
+
+
+def serve_tree(tree, socket_path, prefix=''):
+    """Serve tree (below prefix) on a Unix socket from a background thread"""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)  # Stale socket from a previous run
+    handler = type('BoundTreeRequestHandler', (TreeRequestHandler,),
+                   {'tree': tree, 'prefix': prefix})
+    server = socketserver.ThreadingUnixStreamServer(socket_path, handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='proxy-local-transport',
+                     daemon=True).start()
+    return server
+
+
+def stop_server(server, socket_path):
+    """Shut down a serve_tree() server and remove its socket"""
+    server.shutdown()
+    server.server_close()
+    try:
+        os.unlink(socket_path)
+    except OSError:
+        pass
+
+
+class SessionTransport:
+    """Interface shared by all session backends"""
+
+    def connect(self):
+        """Open the backend connection (called once, before anything else)"""
+
+    def describe(self, path=''):
+        """Human-readable location of path, for log messages"""
+        raise NotImplementedError
+
+    def listen(self, path, callback):
+        """Call callback with events at path; returns a handle with close()"""
+        raise NotImplementedError
+
+    def get(self, path):
+        """Read the value at path (None if absent)"""
+        raise NotImplementedError
+
+    def transaction(self, path, update):
+        """Atomically replace the value at path with update(value), which
+        may be called more than once; returns the value written"""
+        raise NotImplementedError
+
+    def update(self, path, values):
+        raise NotImplementedError
+
+    def set(self, path, value):
+        raise NotImplementedError
+
+    def delete(self, path=''):
+        raise NotImplementedError
+
+    def close(self):
+        """Release the backend connection"""
+
+
+class FirebaseTransport(SessionTransport):
+    """Session stored at /shell/{name} in the Firebase Realtime Database.
+    An empty name roots the transport at /shell itself.
+
+    `database` replaces the firebase_admin.db module, e.g. with a
+    proxy_fakedb.FakeDatabase; no app is initialized in that case.
+    """
+
+    def __init__(self, name, service_account=None, database_url=None, database=None):
+        self.name = name
+        self.root = f'/shell/{name}' if name else '/shell'
+        self.service_account = service_account
+        self.database_url = database_url
+        self.database = database
+        self.ref = None
+
+    def connect(self):
+        if self.database is None:
+            # Imported here so local sessions run without the Firebase SDK
+            import firebase_admin
+            from firebase_admin import credentials, db
+
+            try:
+                cred = credentials.Certificate(self.service_account)
+                firebase_admin.initialize_app(cred, {
+                    'databaseURL': self.database_url
+                })
+            except ValueError:
+                # App already initialized (e.g., in testing)
+                pass
+            self.database = db
+        self.ref = self.database.reference(self.root)
+
+    def describe(self, path=''):
+        return f'{self.root}/{path}'.rstrip('/')
+
+    def _child(self, path):
+        return self.ref.child(path) if path else self.ref
+
+    def listen(self, path, callback):
+        return self._child(path).listen(callback)
+
+    def get(self, path):
+        return self._child(path).get()
+
+    def transaction(self, path, update):
+        return self._child(path).transaction(update)
+
+    def update(self, path, values):
+        self._child(path).update(values)
+
+    def set(self, path, value):
+        self._child(path).set(value)
+
+    def delete(self, path=''):
+        self._child(path).delete()
+
+
+class LocalTransport(SessionTransport):
+    """Session held in memory and served to local controllers on a Unix socket"""
+
+    def __init__(self, name, socket_path):
+        self.name = name
+        self.socket_path = socket_path
+        self.tree = MemoryTree()
+        self.server = None
+
+    def connect(self):
+        self.server = serve_tree(self.tree, self.socket_path)
+
+    def describe(self, path=''):
+        return f'local:{self.socket_path}#/{path}'.rstrip('/')
+
+    def listen(self, path, callback):
+        return TreeListener(self.tree, self.tree.listen(path, callback))
+
+    def get(self, path):
+        return self.tree.get(path)
+
+    def transaction(self, path, update):
+        return self.tree.transaction(path, update)
+
+    def update(self, path, values):
+        self.tree.update(path, values)
+
+    def set(self, path, value):
+        self.tree.set(path, value)
+
+    def delete(self, path=''):
+        self.tree.delete(path)
+
+    def close(self):
+        if self.server:
+            stop_server(self.server, self.socket_path)
+            self.server = None
+
+
+class ScopedTransport(SessionTransport):
+    """One session's view of a transport shared by several sessions
+    (proxy_supervisor.py): paths are relative to `root` below the shared
+    transport's root. Connecting and closing is left to the shared one."""
+
+    def __init__(self, shared, root):
+        self.shared = shared
+        self.root = root
+
+    def _path(self, path):
+        return '/'.join(split_path(self.root) + split_path(path))
+
+    def describe(self, path=''):
+        return self.shared.describe(self._path(path))
+
+    def listen(self, path, callback):
+        return self.shared.listen(self._path(path), callback)
+
+    def get(self, path):
+        return self.shared.get(self._path(path))
+
+    def transaction(self, path, update):
+        return self.shared.transaction(self._path(path), update)
+
+    def update(self, path, values):
+        self.shared.update(self._path(path), values)
+
+    def set(self, path, value):
+        self.shared.set(self._path(path), value)
+
+    def delete(self, path=''):
+        self.shared.delete(self._path(path))
+
+
+class LocalClient:
+    """Controller side of the LocalTransport socket protocol.
+
+    Paths are relative to `prefix` within the served tree, e.g. the
+    session name on a proxy_supervisor.py socket.
+    """
+
+    def __init__(self, socket_path, prefix=''):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.rfile = self.sock.makefile('rb')
+        self.prefix = prefix
+        self.next_id = 0
+
+    def path(self, path=''):
+        """Served-tree path of a client path"""
+        return '/'.join(split_path(self.prefix) + split_path(path))
+
+    def send(self, op, path='', value=None):
+        """Fire-and-forget request"""
+        message = {'op': op, 'path': self.path(path)}
+        if value is not None:
+            message['value'] = value
+        self.sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+
+    def request(self, op, path='', value=None, **fields):
+        """Request and wait for its reply (skipping any listen events)"""
+        self.next_id += 1
+        message = {'op': op, 'path': self.path(path), 'id': self.next_id, **fields}
+        if value is not None:
+            message['value'] = value
+        self.sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        while True:
+            reply = self.read()
+            if reply.get('id') == self.next_id:
+                if not reply.get('ok'):
+                    raise RuntimeError(reply.get('error'))
+                return reply
+
+    def read(self):
+        """Next message from the server (reply or listen event)"""
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionError('proxy closed the connection')
+        return json.loads(line)
+
+    def session_base(self):
+        """Path of the active session: the active generation when the proxy
+        runs with --generations, else the root"""
+        pointer = self.request('get', 'current')['value']
+        if isinstance(pointer, dict) and isinstance(pointer.get('gen'), int):
+            return f"gen/{pointer['gen']}/"
+        return ''
+
+    def push_stdin(self, text, noenter=False, raw=False, urgent=False):
+        """Append a stdin entry in the timestamp:value[:noenter][:raw][:urgent]
+        format. Returns the new entry's path."""
+        value = f'{int(time.time() * 1000)}:{text}'
+        if noenter:
+            value += ':noenter'
+        if raw:
+            value += ':raw'
+        if urgent:
+            value += ':urgent'
+        base = self.session_base()
+        key = self.request('push', f'{base}stdin', value,
+                           after=self.path(f'{base}meta/stdin_cursor'))['key']
+        return f'{base}stdin/{key}'
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def default_socket_path(name):
+    """Socket used by `proxy.py --transport local` for session name"""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(script_dir, '.claude', f'proxy_{name}.sock')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Send stdin to a local proxy session')
+    parser.add_argument('-n', '--name', required=True, help='Program name of the session')
+    parser.add_argument('--socket', help='Socket path (default: .claude/proxy_{name}.sock, or '
+                                          '.claude/proxy_supervisor.sock with --supervisor)')
+    parser.add_argument('--supervisor', action='store_true',
+                        help='Send to session NAME of a proxy_supervisor.py local socket')
+    parser.add_argument('--noenter', action='store_true', help='Do not press Enter after the text')
+    parser.add_argument('--raw', action='store_true', help='Send without bracketed paste')
+    parser.add_argument('--urgent', action='store_true', help='Send ahead of queued input')
+    parser.add_argument('text', help='Text to send')
+    args = parser.parse_args()
+
+    if args.supervisor:
+        client = LocalClient(args.socket or default_socket_path('supervisor'), prefix=args.name)
+    else:
+        client = LocalClient(args.socket or default_socket_path(args.name))
+    path = client.push_stdin(args.text, noenter=args.noenter, raw=args.raw, urgent=args.urgent)
+    print(f"Sent {path}")
+    client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import argparse
+import selectors
+import threading
+
+import pytest
+
+import proxy
+from proxy_transport import LocalTransport
+
+
+class GatedTransport:
+    """Holds the writer's first update until opened, so the ops behind it
+    queue up and are folded together; records each update it passes on"""
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.entered = threading.Event()
+        self.opened = threading.Event()
+        self.updates = []
+
+    def update(self, path, values):
+        self.entered.set()
+        self.opened.wait(5)
+        self.updates.append(sorted(values))
+        self.transport.update(path, values)
+
+    def set(self, path, value):
+        self.transport.set(path, value)
+
+    def delete(self, path=''):
+        self.transport.delete(path)
+
+
+def session_args(argv=()):
+    """proxy.py's per-session options: the defaults, or as set in argv"""
+    parser = argparse.ArgumentParser()
+    proxy.add_session_arguments(parser)
+    args = parser.parse_args(list(argv))
+    args.state_table = None
+    return args
+
+
+@pytest.fixture
+def session(tmp_path):
+    """A ProxySession (its child not started) with a BackgroundWriter over
+    an in-memory LocalTransport (never connected, so the socket is not served)"""
+    sel = selectors.DefaultSelector()
+    session = proxy.ProxySession('test', 'cat', session_args(), sel, lambda: None)
+    session.transport = LocalTransport('test', str(tmp_path / 'test.sock'))
+    session.writer = proxy.BackgroundWriter(session.transport)
+    yield session
+    session.writer.flush()
+    sel.close()
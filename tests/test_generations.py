@@ -0,0 +1,40 @@
+import proxy
+
+
+def test_pointer_names_the_current_generation(monkeypatch):
+    monkeypatch.setattr(proxy.time, 'time', lambda: 1735012345.5)
+    generations = proxy.Generations(keep=2)
+    assert generations.current == -1
+    generations.advance()
+    assert generations.path == 'gen/0'
+    assert generations.pointer() == {'gen': 0, 'oldest': 0, 'updated_at': 1735012345500}
+
+
+def test_resume_clamps_oldest_to_current():
+    assert proxy.Generations(current=-1, oldest=4).oldest == 0
+    assert proxy.Generations(current=3, oldest=7).oldest == 3
+    assert proxy.Generations(current=3, oldest=1, keep=0).keep == 1
+
+
+def test_collect_deletes_generations_past_the_limit(session):
+    for gen in range(4):
+        session.transport.set(f'gen/{gen}/output/0', f'run {gen}')
+    generations = proxy.Generations(current=3, oldest=0, keep=2)
+    session.transport.set('current', generations.pointer())
+
+    generations.collect(session.writer)
+    session.writer.flush()
+    assert sorted(session.transport.get('gen')) == ['2', '3']
+    assert session.transport.get('current')['oldest'] == 2
+    assert session.transport.get('current')['gen'] == 3
+
+    # Nothing new to drop until the next generation
+    writes = session.writer.stats()['writes']
+    generations.collect(session.writer)
+    session.writer.flush()
+    assert session.writer.stats()['writes'] == writes
+    generations.advance()
+    generations.collect(session.writer)
+    session.writer.flush()
+    assert sorted(session.transport.get('gen')) == ['3']
+    assert generations.oldest == 3
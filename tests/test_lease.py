@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+import proxy
+from proxy_fakedb import FakeDatabase
+from proxy_transport import FirebaseTransport
+
+TTL = 10
+
+
+@pytest.fixture
+def db():
+    transport = FirebaseTransport('demo', database=FakeDatabase())
+    transport.connect()
+    return transport
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(proxy.time, 'time', lambda: now[0])
+    return now
+
+
+def test_concurrent_claims_have_one_winner():
+    # Real latency, so every contender reads the lease before any writes it
+    transport = FirebaseTransport('demo', database=FakeDatabase(latency=0.01, jitter=0.01, seed=1))
+    transport.connect()
+    leases = [proxy.Lease(f'host:{i}', TTL) for i in range(8)]
+    start = threading.Barrier(len(leases))
+    won = []
+
+    def claim(lease):
+        start.wait()
+        if lease.claim(transport):
+            won.append(lease.owner)
+
+    threads = [threading.Thread(target=claim, args=(lease,)) for lease in leases]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(won) == 1
+    assert transport.get(proxy.LEASE_PATH)['owner'] == won[0]
+    assert [lease.held for lease in leases].count(True) == 1
+
+
+def test_expired_lease_is_taken_over(db, clock):
+    old, new = proxy.Lease('host:old', TTL), proxy.Lease('host:new', TTL)
+    assert old.claim(db)
+    assert not new.claim(db)
+
+    # Renewals change the record, so the watch starts over
+    clock[0] += TTL / 4
+    db.set(proxy.LEASE_PATH, old.renewal(clock[0]))
+    assert not new.claim(db)
+    clock[0] += TTL - 1
+    assert not new.claim(db)
+
+    # The same record for a whole ttl of our own watching: stale
+    clock[0] += 1
+    assert new.claim(db)
+    record = db.get(proxy.LEASE_PATH)
+    assert record['owner'] == 'host:new'
+    assert record['expires_at'] == int(clock[0] * 1000) + TTL * 1000
+
+    # The old owner hears of it through its listener
+    assert old.observe(record)
+    assert old.lost and not old.held
+
+
+def test_lost_heartbeat_means_claiming_again(db, clock):
+    lease = proxy.Lease('host:a', TTL)
+    assert lease.claim(db)
+    clock[0] += TTL / 4
+    assert lease.renewal(clock[0])['renewed_at'] == int(clock[0] * 1000)
+
+    # A heartbeat that came too late can't just renew: someone may have
+    # taken over meanwhile, so the lease must be claimed again
+    clock[0] += TTL / 2
+    assert lease.renewal(clock[0]) is None
+    acquired_at = lease.acquired_at
+    assert lease.claim(db)
+    assert db.get(proxy.LEASE_PATH)['acquired_at'] == acquired_at
+
+
+def test_own_record_and_empty_lease_are_not_a_loss(db):
+    lease = proxy.Lease('host:a', TTL)
+    assert lease.claim(db)
+    assert not lease.observe(db.get(proxy.LEASE_PATH))
+    assert not lease.observe(None)
+    assert lease.held and not lease.lost
@@ -0,0 +1,152 @@
+import os
+import pty
+import queue
+import re
+import time
+import tty
+
+import pytest
+
+import proxy
+from proxy import Macro
+
+
+@pytest.fixture
+def pty_pair():
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    os.set_blocking(master, False)
+    yield master, slave
+    os.close(master)
+    os.close(slave)
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """Every write the pacer makes to the PTY, in order"""
+    sent = []
+    write_pty = proxy.write_pty
+
+    def record(fd, data, on_output=None, recorder=None):
+        sent.append(bytes(data))
+        write_pty(fd, data, on_output, recorder)
+
+    monkeypatch.setattr(proxy, 'write_pty', record)
+    return sent
+
+
+def pump(batcher, pacer, fd, timeout=2.0):
+    """The main loop's stdin handling, until everything queued is written"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        while True:
+            batch = batcher.take_urgent(time.time())
+            if batch is None:
+                break
+            pacer.preempt(batch.data, batch.send_enter, batch.use_raw)
+        while pacer.run(fd, time.time()):
+            batch = batcher.take(time.time())
+            if batch is None:
+                break
+            pacer.schedule(batch.data, batch.send_enter, batch.use_raw, len(batch.ids))
+        if pacer.idle() and not batcher.pending and not batcher.urgent and batcher.source.empty():
+            return
+        time.sleep(0.002)
+    raise AssertionError('stdin was not written in time')
+
+
+def make(**pacing):
+    source = queue.Queue()
+    pacing.setdefault('paste_settle', 0.01)
+    pacing.setdefault('submit_settle', 0.01)
+    pacer = proxy.SubmitPacer(on_output=lambda chunk: None, **pacing)
+    return source, pacer
+
+
+def test_raw_keystrokes_merge_in_queue_order(pty_pair, writes):
+    master, slave = pty_pair
+    source, pacer = make()
+    batcher = proxy.StdinBatcher(source)
+    for idx, key in enumerate('123'):
+        source.put((idx, (key, False, True, False)))
+    pump(batcher, pacer, master)
+
+    assert writes == [b'123']
+    assert batcher.stats()['merged'] == 2
+    assert os.read(slave, 1024) == b'123'
+
+
+def test_mixed_modes_stay_in_queue_order(pty_pair, writes):
+    master, _ = pty_pair
+    source, pacer = make()
+    batcher = proxy.StdinBatcher(source)
+    source.put((0, ('a', False, True, False)))
+    source.put((1, ('b', False, True, False)))
+    source.put((2, ('paste', False, False, False)))
+    source.put((3, ('c', False, True, False)))
+    pump(batcher, pacer, master)
+
+    # Raw keys never join a paste, so nothing overtakes an earlier entry
+    assert writes == [b'ab', b'\x1b[200~paste\x1b[201~', b'c']
+
+
+def test_pastes_merge_by_default(pty_pair, writes):
+    master, _ = pty_pair
+    source, pacer = make()
+    batcher = proxy.StdinBatcher(source)
+    source.put((0, ('first', False, False, False)))
+    source.put((1, (' second', True, False, False)))
+    pump(batcher, pacer, master)
+
+    assert writes == [b'\x1b[200~first second\x1b[201~', b'\r']
+
+
+def test_max_bytes_zero_sends_each_entry_alone(pty_pair, writes):
+    master, _ = pty_pair
+    source, pacer = make()
+    batcher = proxy.StdinBatcher(source, max_bytes=0)
+    source.put((0, ('1', False, True, False)))
+    source.put((1, ('2', False, True, False)))
+    source.put((2, ('first', False, False, False)))
+    source.put((3, ('second', True, False, False)))
+    pump(batcher, pacer, master)
+
+    assert writes == [b'1', b'2', b'\x1b[200~first\x1b[201~', b'\x1b[200~second\x1b[201~', b'\r']
+    assert batcher.stats()['merged'] == 0
+
+
+def test_noenter_settle_ends_once_echo_is_quiet(pty_pair, writes):
+    master, slave = pty_pair
+    os.set_blocking(slave, False)
+    _, pacer = make(paste_settle=1.0, submit_settle=1.0, quiet=0.02)
+    pacer.schedule('choice', False, False)
+    started = time.time()
+    while not pacer.run(master, time.time()):
+        try:
+            if os.read(slave, 1024):
+                pacer.note_output(time.time())  # The child echoes the paste
+        except BlockingIOError:
+            pass
+        time.sleep(0.002)
+
+    # Both settles end on quiet, well inside their 1s upper bounds
+    assert time.time() - started < 0.5
+    assert writes == [b'\x1b[200~choice\x1b[201~']
+
+
+def test_urgent_entry_during_macro_wait_gets_its_enter(pty_pair, writes):
+    master, slave = pty_pair
+    _, pacer = make()
+    pacer.schedule(Macro([('keys', 'a'), ('wait', re.compile('never'), 1.0), ('enter',)], 'test'), False, False)
+    assert not pacer.run(master, time.time())  # Waiting for the macro's match
+
+    pacer.preempt('\x03', True, True)
+    started = time.time()
+    while not pacer.run(master, time.time()):
+        time.sleep(0.002)
+
+    # The macro is stopped: no Enter of its own, and the urgent settle
+    # isn't held to the macro's 1s wait
+    assert time.time() - started < 0.5
+    assert os.read(slave, 1024) == b'a\x03\r'
+    assert writes == [b'a', b'\x03', b'\r']
@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+import proxy_record
+from proxy_record import INDEX, INPUT, MARK, OUTPUT, RECORD, Recorder, Recording
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Monotonic clock the test moves by hand, in seconds"""
+    now = [1000.0]
+    monkeypatch.setattr(proxy_record.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_round_trip(tmp_path, clock):
+    path = str(tmp_path / 'demo.rec')
+    recorder = Recorder(path, rows=30, cols=100, name='demo')
+    recorder.output(memoryview(b'hello'))
+    clock[0] += 0.25
+    recorder.input(b'\r')
+    recorder.mark(event='restart', reason='clear')
+    recorder.close()
+
+    recording = Recording(path)
+    try:
+        assert recording.header['name'] == 'demo'
+        assert (recording.header['rows'], recording.header['cols']) == (30, 100)
+        records = [(t, kind, bytes(data)) for t, kind, data, _ in recording.records()]
+        assert records == [(0.0, OUTPUT, b'hello'), (0.25, INPUT, b'\r'),
+                           (0.25, MARK, b'{"event": "restart", "reason": "clear"}')]
+        assert recording.duration() == 0.25
+    finally:
+        recording.close()
+
+
+def test_seek_uses_the_index(tmp_path, clock):
+    path = str(tmp_path / 'long.rec')
+    recorder = Recorder(path)
+    for i in range(100):
+        recorder.output(b'%d' % i)
+        clock[0] += 0.5
+    recorder.close()
+
+    recording = Recording(path)
+    try:
+        # One entry per INDEX_INTERVAL of recorded time
+        assert recording.entries == 50
+        for t, expected in ((0.0, b'0'), (12.25, b'25'), (30.0, b'60'), (49.5, b'99')):
+            first = [bytes(d) for _, _, d, _ in recording.records(recording.seek(t))][0]
+            assert first == expected
+        assert recording.seek(60) == len(recording.data)
+        assert [bytes(d) for _, _, d in recording.events(10, 11)] == [b'20', b'21', b'22']
+    finally:
+        recording.close()
+
+
+def test_truncated_recording_reads_up_to_the_last_whole_record(tmp_path, clock):
+    path = str(tmp_path / 'crash.rec')
+    recorder = Recorder(path)
+    for i in range(3):
+        recorder.output(b'chunk %d' % i)
+        clock[0] += 1
+    recorder.close()
+    # Cut the last record's data short, as a crash mid-write would
+    os.truncate(path, os.path.getsize(path) - 3)
+
+    recording = Recording(path)
+    try:
+        assert [bytes(d) for _, _, d, _ in recording.records()] == [b'chunk 0', b'chunk 1']
+        assert recording.duration() == 1.0
+        assert recording.seek(1.5) == len(recording.data)
+    finally:
+        recording.close()
+
+
+def test_index_never_points_past_the_data(tmp_path, clock):
+    path = str(tmp_path / 'live.rec')
+    recorder = Recorder(path)
+    recorder.output(b'x' * 100)
+    recorder.output(b'y' * 100)
+    # Nothing flushed yet: the index must not get ahead of the data
+    assert os.path.getsize(path + '.idx') == 0
+
+    recorder.flush()
+    size = os.path.getsize(path)
+    with open(path + '.idx', 'rb') as f:
+        entries = f.read()
+    assert entries
+    for i in range(0, len(entries), INDEX.size):
+        _, offset = INDEX.unpack_from(entries, i)
+        assert offset + RECORD.size <= size
+    recorder.close()
+
+
+def test_wall_clock_step_back_does_not_break_recording(tmp_path, clock, monkeypatch):
+    path = str(tmp_path / 'step.rec')
+    recorder = Recorder(path)
+    monkeypatch.setattr(proxy_record.time, 'time', lambda: recorder.started_at - 3600)
+    clock[0] += 0.1
+    recorder.output(b'still here')
+    recorder.close()
+
+    recording = Recording(path)
+    try:
+        assert [(t, bytes(d)) for t, _, d, _ in recording.records()] == [(0.1, b'still here')]
+    finally:
+        recording.close()
@@ -0,0 +1,89 @@
+from proxy_screen import Screen
+
+
+def text(screen):
+    """Screen contents as plain rows, trailing blanks dropped"""
+    return [''.join(row).rstrip() for row in screen.chars]
+
+
+def test_cursor_movement():
+    screen = Screen(5, 10)
+    screen.feed(b'\x1b[3;4Hx')
+    assert (screen.y, screen.x) == (2, 4)
+    screen.feed(b'\x1b[2Ay\x1b[10Cz')
+    assert (screen.y, screen.x) == (0, 9)  # Clamped to the last column
+    screen.feed(b'\x1b[9B\x1b[3Dw\x1b[Gv\x1b[2;2f\x1b[1Ku')
+    assert text(screen) == ['    y    z', ' u', '   x', '', 'v     w']
+    assert screen.snapshot()['cursor'] == [1, 2]
+
+
+def test_autowrap_waits_for_the_next_character():
+    screen = Screen(3, 4)
+    screen.feed(b'abcd')
+    assert (screen.y, screen.x, screen.wrap_pending) == (0, 3, True)
+    screen.feed(b'e')
+    assert text(screen) == ['abcd', 'e', '']
+
+
+def test_scroll_region_keeps_the_rows_outside_it():
+    screen = Screen(5, 10)
+    screen.feed(b'head\r\n1\r\n2\r\n3\r\nfoot')
+    screen.feed(b'\x1b[2;4r\x1b[4;1H\nnew')
+    assert text(screen) == ['head', '2', '3', 'new', 'foot']
+    # Reverse index at the top of the region scrolls it down
+    screen.feed(b'\x1b[2;1H\x1bMtop')
+    assert text(screen) == ['head', 'top', '2', '3', 'foot']
+    # Inserted and deleted lines stay inside the region too
+    screen.feed(b'\x1b[3;1H\x1b[M')
+    assert text(screen) == ['head', 'top', '3', '', 'foot']
+    screen.feed(b'\x1b[2;1H\x1b[2L')
+    assert text(screen) == ['head', '', '', 'top', 'foot']
+
+
+def test_alternate_screen_restores_the_main_one():
+    screen = Screen(3, 10)
+    screen.feed(b'shell $ \x1b[1m')
+    screen.diff()
+    screen.feed(b'\x1b[?1049h\x1b[2J\x1b[Hfull screen')
+    assert screen.snapshot()['alternate']
+    assert text(screen) == ['full scree', 'n', '']
+
+    screen.feed(b'\x1b[?1049l')
+    assert not screen.snapshot()['alternate']
+    assert text(screen) == ['shell $', '', '']
+    assert (screen.y, screen.x) == (0, 8)
+    assert screen.attr == '1'  # Saved with the cursor on entry
+
+
+def test_wide_and_combining_characters():
+    screen = Screen(2, 5)
+    screen.feed('日本é'.encode())
+    assert screen.chars[0] == ['日', '', '本', '', 'e']
+    assert screen.x == 4 and screen.wrap_pending
+    # A wide character that doesn't fit the row goes to the next one
+    screen.feed('\x1b[1;5H字'.encode())
+    assert screen.chars[0][4] == ' '
+    assert screen.chars[1][:2] == ['字', '']
+    # Overwriting half of a wide character blanks the other half
+    screen.feed(b'\x1b[1;2Hx')
+    assert screen.chars[0][:3] == [' ', 'x', '本']
+
+
+def test_sequences_split_across_feeds():
+    screen = Screen(3, 20)
+    data = '\x1b[2;3H\x1b[31mred\x1b[0m \x1b]0;title\x07é'.encode()
+    for i in range(len(data)):
+        screen.feed(data[i:i + 1])
+    assert screen.title == 'title'
+    assert screen.line(1) == '  \x1b[0;31mred\x1b[0m é'
+    assert screen.pending == ''
+
+
+def test_diff_only_returns_rows_that_render_differently():
+    screen = Screen(3, 10)
+    screen.feed(b'one\r\ntwo')
+    assert screen.diff() == {'0': 'one', '1': 'two'}
+    screen.feed(b'\x1b[1;1Hone')
+    assert screen.diff() == {}
+    screen.feed(b'\x1b[2;1H\x1b[4mtwo')
+    assert screen.diff() == {'1': '\x1b[0;4mtwo\x1b[0m'}
@@ -0,0 +1,53 @@
+import selectors
+import sys
+import time
+
+import proxy
+
+# A hook's view of the session, printed once at start and once it changes
+HOOK = '''
+import sys, time
+sys.path.insert(0, {root!r})
+import proxy
+print('session=[%s]' % proxy.hook_session(), flush=True)
+while proxy.hook_session() is None:
+    time.sleep(0.01)
+print('promoted=[%s]' % proxy.hook_session(), flush=True)
+time.sleep(5)
+'''
+
+
+def output_of(fd, until, timeout=5.0):
+    deadline = time.time() + timeout
+    output = bytearray()
+    while until not in output and time.time() < deadline:
+        proxy.drain_pty(fd, output.extend)
+        time.sleep(0.01)
+    return bytes(output)
+
+
+def test_promoted_child_can_attribute_its_transcript(tmp_path):
+    hook = tmp_path / 'hook.py'
+    hook.write_text(HOOK.format(root=proxy.SCRIPT_DIR))
+    command = f'{sys.executable} {hook}'
+    reaper = proxy.Reaper()
+    pool = proxy.StandbyPool([command], proxy.child_env('demo'), reaper, size=1, marker_dir=str(tmp_path))
+    with selectors.DefaultSelector() as sel:
+        pool.attach(sel, time.time() - proxy.STANDBY_REFILL_DELAY)
+        pool.refill(time.time())
+        child = pool.children[command][0]
+        # On standby the hook holds off
+        assert b'session=[None]' in output_of(child.fd, b']')
+
+        proc, fd, early = pool.start(command)
+        assert proc is child.proc
+        assert b'promoted=[demo]' in early + output_of(fd, b'promoted=')
+        reaper.retire(proc, fd, 'test')
+
+        # Spawned cold: serving the session from the start
+        proc, fd, _ = pool.start(command + ' ')
+        assert b'session=[demo]' in output_of(fd, b']')
+        reaper.retire(proc, fd, 'test')
+        pool.close()
+    reaper.finish()
+    assert not list(tmp_path.glob('proxy_standby_*'))
@@ -0,0 +1,84 @@
+import pytest
+
+import proxy
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(proxy.time, 'time', lambda: now[0])
+    return now
+
+
+def detector(**kwargs):
+    return proxy.StateDetector(proxy.STATE_PATTERNS, debounce=0.25, busy_hold=2.0, **kwargs)
+
+
+def test_marker_is_found_through_escapes_and_spacing(clock):
+    state = detector()
+    state.feed(b'\x1b[2m?\x1b[0m for\r\n   \x1b[38;5;244mShortcuts\x1b[39m')
+    assert state.candidate == 'idle'
+    # Published only once it has held for the debounce
+    assert state.poll(clock[0] + 0.1) is None
+    assert state.next_deadline() == clock[0] + 0.25
+    assert state.poll(clock[0] + 0.25) == 'idle'
+    assert state.poll(clock[0] + 1) is None
+
+
+def test_marker_split_across_reads(clock):
+    state = detector()
+    state.feed(b'Do you w')
+    assert state.candidate is None
+    state.feed(b'ant to proceed?')
+    assert state.candidate == 'awaiting-permission'
+
+
+def test_escape_split_across_reads(clock):
+    state = detector()
+    state.feed(b'Enter to\x1b[3')
+    state.feed(b'8;5;2m select')
+    assert state.candidate == 'awaiting-choice'
+
+
+def test_earlier_states_win_within_a_read(clock):
+    state = detector()
+    state.feed(b'? for shortcuts ... esc to interrupt')
+    assert state.candidate == 'busy'
+
+
+def test_carried_marker_is_not_seen_twice(clock):
+    state = detector()
+    state.feed(b'esc to interrupt')
+    first = state.last_busy
+    clock[0] += 1
+    state.feed(b'.')  # The marker is still in the carried bytes
+    assert state.last_busy == first
+    state.feed(b'esc to interrupt')
+    assert state.last_busy == clock[0]
+
+
+def test_busy_turns_idle_without_redraws(clock):
+    state = detector()
+    state.feed(b'esc to interrupt')
+    assert state.poll(clock[0] + 0.25) == 'busy'
+    assert state.next_deadline() == clock[0] + 2.0
+    assert state.poll(clock[0] + 2.0) is None  # Idle from then, once debounced
+    assert state.poll(clock[0] + 2.25) == 'idle'
+    assert state.transitions == 2
+
+
+def test_short_flicker_is_not_published(clock):
+    state = detector()
+    state.feed(b'? for shortcuts')
+    assert state.poll(clock[0] + 0.25) == 'idle'
+    clock[0] += 1
+    state.feed(b'Enter to select')
+    clock[0] += 0.1
+    state.feed(b'? for shortcuts')
+    assert state.poll(clock[0] + 0.2) is None
+    assert state.state == 'idle'
+
+
+def test_patterns_need_a_marker():
+    with pytest.raises(ValueError):
+        proxy.StateDetector({'idle': ['  ']})
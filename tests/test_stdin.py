@@ -0,0 +1,82 @@
+import threading
+
+import proxy
+from conftest import GatedTransport
+from proxy_transport import Event
+
+
+def drain(session):
+    entries = []
+    while not session.stdin_queue.empty():
+        entries.append(session.stdin_queue.get_nowait())
+    return entries
+
+
+def test_acks_prune_entries_and_save_cursor(session):
+    session.transport.tree.set('stdin', {str(i): f'line {i}' for i in range(5)})
+    session.stdin_listener(Event('put', '/', session.transport.tree.get('stdin')))
+    entries = drain(session)
+    assert [idx for idx, _ in entries] == [0, 1, 2, 3, 4]
+
+    for idx, _ in entries:
+        session.ack_stdin(idx)
+    session.flush_stdin_acks()
+    session.writer.flush()
+    assert session.transport.tree.get('stdin') is None
+    assert session.transport.tree.get('meta/stdin_cursor') == 4
+
+
+def test_keys_past_cursor_are_heard(session):
+    session.transport.tree.set('meta/stdin_cursor', 4)
+    session.last_stdin_id = 4
+
+    # A controller that restarted at key 0 would be ignored...
+    session.stdin_listener(Event('put', '/0', 'lost'))
+    assert drain(session) == []
+    # ...one starting past meta/stdin_cursor is not
+    session.stdin_listener(Event('put', '/5', 'kept'))
+    assert [idx for idx, _ in drain(session)] == [5]
+
+
+def test_resume_skips_consumed_entries(session):
+    session.last_stdin_id = 2
+    session.stdin_listener(Event('put', '/', {'1': 'old', '3': 'new', '4': 'newer'}))
+    assert [idx for idx, _ in drain(session)] == [3, 4]
+
+
+def backed_up(session, monkeypatch):
+    """A writer whose one-slot queue is full behind a held update"""
+    gate = GatedTransport(session.transport)
+    monkeypatch.setattr(session, 'writer', proxy.BackgroundWriter(gate, maxsize=1))
+    session.writer.update('meta', {'status': 'running'})
+    assert gate.entered.wait(5)
+    session.writer.update('meta', {'heartbeat': 1})
+    return gate
+
+
+def test_acks_wait_for_room_in_a_full_queue(session, monkeypatch):
+    gate = backed_up(session, monkeypatch)
+    for idx in range(3):
+        session.ack_stdin(idx)
+    threading.Timer(0.1, gate.opened.set).start()
+    session.flush_stdin_acks()
+
+    assert session.stdin_acks == []
+    session.writer.flush()
+    assert session.writer.dropped == 0
+    assert session.transport.tree.get('meta/stdin_cursor') == 2
+
+
+def test_acks_are_kept_while_the_queue_stays_full(session, monkeypatch):
+    monkeypatch.setattr(proxy, 'WRITER_FLUSH_TIMEOUT', 0.05)
+    gate = backed_up(session, monkeypatch)
+    for idx in range(3):
+        session.ack_stdin(idx)
+    session.flush_stdin_acks()
+    assert session.stdin_acks == [0, 1, 2]
+
+    gate.opened.set()
+    session.writer.flush()
+    session.flush_stdin_acks()
+    session.writer.flush()
+    assert session.transport.tree.get('meta/stdin_cursor') == 2
@@ -0,0 +1,81 @@
+import json
+import time
+
+import pytest
+
+import proxy_supervisor
+from proxy_transport import LocalTransport
+
+
+def drain(session):
+    entries = []
+    while not session.stdin_queue.empty():
+        entries.append(session.stdin_queue.get_nowait())
+    return entries
+
+
+@pytest.fixture
+def supervisor(tmp_path):
+    """Start a Supervisor of sessions a and b (both running cat) on an in-memory
+    LocalTransport, with extra options from the test's argv"""
+    started = []
+
+    def start(*argv):
+        manifest = tmp_path / 'sessions.json'
+        manifest.write_text(json.dumps({'sessions': [{'name': 'a', 'command': 'cat'},
+                                                     {'name': 'b', 'command': 'cat'}]}))
+        args = proxy_supervisor.parse_args(['-m', str(manifest), *argv])
+        args.state_table = None
+        transport = LocalTransport('', str(tmp_path / 'supervisor.sock'))
+        supervisor = proxy_supervisor.Supervisor(args, proxy_supervisor.load_manifest(args.manifest),
+                                                 transport)
+        started.append(supervisor)
+        supervisor.start()
+        supervisor.writer.flush()
+        return supervisor
+
+    yield start
+    for supervisor in started:
+        for session in supervisor.active:
+            session.interrupt()
+        supervisor.close()
+
+
+def test_stdin_reaches_only_its_session(supervisor):
+    sup = supervisor()
+    a, b = sup.sessions['a'], sup.sessions['b']
+    assert sup.active == {a, b}
+
+    sup.transport.set('a/stdin/0', '1735012345:for a')
+    sup.transport.set('b/stdin/0', '1735012346:for b')
+    sup.transport.set('b/stdin/1', '1735012347:also for b')
+    assert [value for _, (value, *_) in drain(a)] == ['for a']
+    assert [value for _, (value, *_) in drain(b)] == ['for b', 'also for b']
+    assert sup.woken == {'a', 'b'}
+
+
+def test_plan_toggle_reaches_only_its_session(supervisor):
+    sup = supervisor()
+    a, b = sup.sessions['a'], sup.sessions['b']
+    assert sup.transport.get('b/meta/supervisor') == sup.pid
+
+    sup.transport.set('b/meta/plan', True)
+    assert b.plan_changes.get_nowait() is True
+    assert a.plan_changes.empty()
+
+
+def test_old_generation_stdin_is_dropped(supervisor):
+    sup = supervisor('--generations', '2')
+    a = sup.sessions['a']
+    assert a.writer.prefix == 'gen/0'
+
+    assert a.restart_child('clear', a.command, time.time()) is not None
+    sup.writer.flush()
+    assert a.writer.prefix == 'gen/1'
+    assert sup.transport.get('a/current')['gen'] == 1
+
+    sup.transport.set('a/gen/0/stdin/0', '1735012345:stale')
+    assert drain(a) == []
+    sup.transport.set('a/gen/1/stdin/0', '1735012346:fresh')
+    assert [value for _, (value, *_) in drain(a)] == ['fresh']
+    assert drain(sup.sessions['b']) == []
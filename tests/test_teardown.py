@@ -0,0 +1,11 @@
+def test_teardown_before_backend_is_ready_is_kept(session):
+    # Backend still connecting: open() has not set the session up
+    record = {'reason': 'standby exited', 'exit_ms': 3}
+    session.publish_teardowns([record])
+    assert session.last_teardown == record
+
+    session.ready.set()
+    session.publish_teardowns([])
+    session.writer.flush()
+    assert session.transport.tree.get('meta/teardown') == record
+    assert session.last_teardown is None
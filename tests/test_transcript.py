@@ -0,0 +1,49 @@
+import json
+import threading
+import time
+
+import proxy
+
+
+def line(i):
+    return json.dumps({'type': 'user', 'uuid': f'u{i}', 'timestamp': f'2026-01-01T00:00:{i:02d}Z',
+                       'message': {'role': 'user', 'content': f'message {i}'}}) + '\n'
+
+
+def wait_for(check, timeout=5.0):
+    deadline = time.time() + timeout
+    while not check():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_reset_does_not_wait_for_a_read(session, monkeypatch, tmp_path):
+    path = tmp_path / 'session.jsonl'
+    path.write_text(''.join(line(i) for i in range(5)))
+
+    # Hold the thread part-way through parsing the transcript
+    parsing = threading.Event()
+    release = threading.Event()
+    parse = proxy.transcript_message
+
+    def slow_parse(data, fallback_id):
+        parsing.set()
+        release.wait(5)
+        return parse(data, fallback_id)
+
+    monkeypatch.setattr(proxy, 'transcript_message', slow_parse)
+    tailer = proxy.TranscriptTailer(str(path), window=0.01)
+    try:
+        assert parsing.wait(5)
+        threading.Timer(1.0, release.set).start()
+        started = time.time()
+        tailer.reset()
+        assert time.time() - started < 0.5
+        release.set()
+
+        # The file is read again from the start and published once
+        tailer.attach(session.writer)
+        wait_for(lambda: (session.transport.tree.get('transcript/index') or {}).get('count') == 5)
+        assert len(session.transport.tree.get('transcript/pages/0')) == 5
+    finally:
+        tailer.close()
@@ -0,0 +1,63 @@
+import threading
+
+from proxy_transport import MemoryTree
+
+
+def test_slow_listener_does_not_hold_the_tree():
+    tree = MemoryTree()
+    entered = threading.Event()
+    release = threading.Event()
+    seen = []
+
+    def slow(event):
+        if event.data == 'first':
+            entered.set()
+            release.wait(5)  # A socket send to a client that stopped reading
+        seen.append(event.data)
+
+    tree.listen('stdin', lambda event: None)
+    tree.listen('meta/state', slow)
+    writer = threading.Thread(target=tree.set, args=('meta/state', 'first'))
+    writer.start()
+    assert entered.wait(5)
+
+    # Other threads keep reading and writing while the callback blocks
+    done = threading.Event()
+
+    def other():
+        tree.set('stdin/0', 'hello')
+        tree.set('meta/state', 'second')
+        done.set()
+
+    threading.Thread(target=other).start()
+    assert done.wait(5)
+    assert tree.get('stdin/0') == 'hello'
+    assert seen == [None]  # 'second' waits for the blocked delivery
+
+    release.set()
+    writer.join(5)
+    assert seen == [None, 'first', 'second']
+
+
+def test_writes_from_a_callback_are_delivered_in_order():
+    tree = MemoryTree()
+    seen = []
+
+    def echo(event):
+        seen.append((event.path, event.data))
+        if event.data == 'ping':
+            tree.set('a/reply', 'pong')
+
+    tree.listen('a', echo)
+    tree.set('a/msg', 'ping')
+    tree.update('a', {'x': 1})
+    assert seen == [('/', None), ('/msg', 'ping'), ('/reply', 'pong'), ('/', {'x': 1})]
+
+
+def test_unlisten_stops_queued_events():
+    tree = MemoryTree()
+    seen = []
+    handle = tree.listen('a', lambda event: seen.append(event.data))
+    tree.unlisten(handle)
+    tree.set('a', 1)
+    assert seen == [None]
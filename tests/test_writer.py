@@ -0,0 +1,35 @@
+import proxy
+from conftest import GatedTransport
+from proxy_fakedb import FakeDatabase
+from proxy_transport import FirebaseTransport
+
+
+def firebase():
+    database = FakeDatabase()
+    transport = FirebaseTransport('test', database=database)
+    transport.connect()
+    return transport, database
+
+
+def test_overlapping_updates_are_not_folded():
+    transport, database = firebase()
+    gate = GatedTransport(transport)
+    writer = proxy.BackgroundWriter(gate)
+    writer.update('meta', {'status': 'running'})
+    assert gate.entered.wait(5)
+
+    writer.update('screen', {'diffs/1': {'t': 1}})
+    writer.update('screen', {'diffs': {'2': {'t': 2}}, 'snapshot': {'seq': 2}})  # A fresh screen
+    writer.update('screen', {'diffs/3': {'t': 3}})
+    writer.update('meta', {'heartbeat': 1})
+    gate.opened.set()
+    assert writer.flush()
+
+    assert writer.failed == 0
+    assert gate.updates == [
+        ['meta/status'],
+        ['screen/diffs/1'],
+        ['screen/diffs', 'screen/snapshot'],
+        ['meta/heartbeat', 'screen/diffs/3'],
+    ]
+    assert database.tree.get('/shell/test/screen/diffs') == {'2': {'t': 2}, '3': {'t': 3}}